@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'atfoc.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once the apps are loaded
+from listing.events import EVENTS_PATH, events_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # the listing event stream is a long-lived response served outside of
+    # Django's request handling, everything else goes to Django
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        return await events_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,125 @@
+"""
+Response compression, in place of django.middleware.gzip.GZipMiddleware.
+
+Compresses with brotli when the client accepts it and the package is
+installed, gzip otherwise. Responses under COMPRESSION_MIN_SIZE bytes are
+sent as they are (the headers would eat the gain), as are media that are
+already compressed, such as the donation JPEGs.
+
+A view can set compression_cache_key on a response whose body is the same
+for every user, such as the listing responses it caches itself: the
+compressed body is then kept in the cache next to it, under that key and the
+encoding, for COMPRESSION_CACHE_TIMEOUT seconds, and repeated hits are
+rendered but not compressed again. HTML pages (the browsable API shows the
+user and a CSRF token) and responses that vary with the cookies or the
+credentials are never cached.
+"""
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import has_vary_header, patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence, compress_string
+
+# fast enough to compress dynamic responses on every request
+BROTLI_QUALITY = 5
+
+# content types that compress no further
+COMPRESSED_TYPES = ('image/', 'video/', 'audio/', 'font/woff', 'application/zip', 'application/gzip')
+UNCOMPRESSED_TYPES = ('image/svg+xml',)
+
+def accepted_encoding(header):
+    """
+    'br' or 'gzip', whichever is supported and accepted (q > 0), or None
+    """
+    accepted = set()
+    for coding in header.split(','):
+        name, _, params = coding.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def compress(encoding, content):
+    if encoding == 'br':
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    return compress_string(content)
+
+def compress_stream(encoding, sequence):
+    if encoding == 'gzip':
+        return compress_sequence(sequence)
+
+    def chunks():
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for item in sequence:
+            # flushed per item, so streamed responses keep streaming
+            yield compressor.process(item) + compressor.flush()
+        yield compressor.finish()
+    return chunks()
+
+def is_compressed(content_type):
+    content_type = content_type.split(';')[0].strip().lower()
+    return content_type.startswith(COMPRESSED_TYPES) and content_type not in UNCOMPRESSED_TYPES
+
+def cache_key(response, encoding):
+    """
+    Where the compressed body of the response is cached, or None if it is not
+    """
+    key = getattr(response, 'compression_cache_key', None)
+    if key is None or response.status_code != 200:
+        return None
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    if content_type == 'text/html' or any(has_vary_header(response, header) for header in ('Cookie', 'Authorization')):
+        return None
+    return "%s:%s" % (key, encoding)
+
+class CompressionMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding') or is_compressed(response.get('Content-Type', '')):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            # the compressed size is not known until the end of the stream
+            response.streaming_content = compress_stream(encoding, response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            key = cache_key(response, encoding)
+            entry = cache.get(key) if key is not None else None
+            if entry is not None and entry[0] == len(response.content):
+                compressed_content = entry[1]
+            else:
+                compressed_content = compress(encoding, response.content)
+                if key is not None:
+                    cache.set(key, (len(response.content), compressed_content), settings.COMPRESSION_CACHE_TIMEOUT)
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # the compressed body is a different representation: make a strong
+        # ETag weak, conditional requests still match it
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,65 @@
+"""
+Faster renderers for the API responses, picked by content negotiation.
+
+JSONRenderer stays the default. A client opts in with
+"Accept: application/json; encoder=orjson" for the same JSON encoded by
+orjson, or "Accept: application/msgpack" (or ?format=msgpack) for
+MessagePack. Both libraries are optional: settings only registers the
+renderers whose package is installed.
+
+Values neither library encodes the way DRF does (datetimes, Decimal, lazy
+translation strings, ...) go through DRF's JSONEncoder.default, and U+2028
+and U+2029 are escaped after orjson as JSONRenderer escapes them, so the
+orjson output is the JSONRenderer output and the MessagePack one decodes to
+it.
+"""
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+encoder = JSONEncoder()
+
+LINE_SEPARATOR = '\u2028'.encode('utf-8')
+PARAGRAPH_SEPARATOR = '\u2029'.encode('utf-8')
+
+def default(obj):
+    return encoder.default(obj)
+
+class ORJSONRenderer(BaseRenderer):
+    # the parameter keeps plain application/json on JSONRenderer. Listed
+    # before it, since JSONRenderer matches this media type too. Only the
+    # Accept header selects it: ?format= alone falls back to */*, which
+    # does not carry the parameter
+    media_type = 'application/json; encoder=orjson'
+    format = 'orjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # datetimes through default, for DRF's format instead of orjson's
+        ret = orjson.dumps(data, default=default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+        # valid JSON but not valid JavaScript, JSONRenderer escapes them too.
+        # Outside of strings JSON has no non-ASCII bytes to collide with
+        return ret.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=default, use_bin_type=True)
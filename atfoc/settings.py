@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 from os import getenv, path
 
@@ -37,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
@@ -48,6 +50,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'atfoc.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -56,6 +59,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Response compression (atfoc.middleware): responses smaller than this many
+# bytes are sent uncompressed, and compressed bodies of the cached listing
+# responses are cached for this many seconds
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_CACHE_TIMEOUT = 300
+
 ROOT_URLCONF = 'atfoc.urls'
 
 TEMPLATES = [
@@ -96,6 +105,16 @@ DATABASES = {
     }
 }
 
+# Cache, used for the listing response cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'atfoc',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -141,7 +160,17 @@ MEDIA_ROOT = path.join(BASE_DIR, 'media')
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Django REST setting
+# Response renderers, picked by the Accept header or ?format= (see
+# atfoc.renderers). orjson and MessagePack are only offered when installed
+RENDERER_CLASSES = [
+    *(['atfoc.renderers.ORJSONRenderer'] if find_spec('orjson') else []),
+    'rest_framework.renderers.JSONRenderer',
+    *(['atfoc.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+    'rest_framework.renderers.BrowsableAPIRenderer',
+]
+
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': RENDERER_CLASSES,
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.TokenAuthentication',
@@ -150,6 +179,60 @@ REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'identity.views.custom_exception_handler'
 }
 
+# Listing endpoints keyset pagination, used when a client passes cursor or page_size
+LISTING_PAGE_SIZE = 100
+LISTING_MAX_PAGE_SIZE = 1000
+
+# Most listings accepted by one call to the bulk create endpoints
+LISTING_BULK_MAX_SIZE = 1000
+
+# Default and largest radius, in km, of the listing near= filter
+LISTING_NEAR_RADIUS_KM = 5
+LISTING_NEAR_MAX_RADIUS_KM = 500
+
+# Rows read and serialized at a time by the stream=true listing responses
+LISTING_STREAM_CHUNK_SIZE = 500
+
+# Seconds a cached listing response lives, it is also dropped whenever a listing
+# of the same org is created or deactivated
+LISTING_CACHE_TIMEOUT = 300
+
+# Build the listing responses from values() rows with listing.fast_serializers
+# instead of the DRF serializers. The rendered JSON is the same
+LISTING_FAST_SERIALIZER = False
+
+# Most changes returned by one call to /api/listing/changes/
+LISTING_CHANGES_PAGE_SIZE = 500
+
+# /api/listing/events/ (ASGI only): seconds between two reads of the change feed,
+# seconds between keepalive comments on idle connections, and events buffered per
+# client before a slow client is disconnected
+LISTING_EVENTS_POLL_INTERVAL = 1
+LISTING_EVENTS_HEARTBEAT = 15
+LISTING_EVENTS_QUEUE_SIZE = 100
+
+# Request to donation matching: largest distance between two located orgs for
+# their listings to match, and most matches returned by one call
+LISTING_MATCH_RADIUS_KM = 50
+LISTING_MATCHES_PAGE_SIZE = 50
+# Most match candidates kept per request, at least LISTING_MATCHES_PAGE_SIZE
+LISTING_MATCH_CANDIDATES = 100
+
+# Uploaded donation pictures are re-encoded to this format and quality, with
+# the longest side capped at LISTING_IMAGE_MAX_DIMENSION pixels
+LISTING_IMAGE_FORMAT = 'JPEG'
+LISTING_IMAGE_QUALITY = 82
+LISTING_IMAGE_MAX_DIMENSION = 1600
+
+# Donation picture thumbnails, {label: longest side in pixels}. They are made
+# after the donation is saved on LISTING_THUMBNAIL_WORKERS threads (0 = inline)
+LISTING_THUMBNAIL_SIZES = {
+    'small': 128,
+    'medium': 512,
+}
+LISTING_THUMBNAIL_QUALITY = 80
+LISTING_THUMBNAIL_WORKERS = 2
+
 # Allowed hosts to send cross origin request
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
@@ -0,0 +1,83 @@
+"""
+Geohash grid helpers for organization locations.
+
+A geohash names a cell of a fixed grid, and every prefix of it names the
+larger cell that contains it. Organizations store the full hash, so "orgs
+near a point" becomes a few indexed prefix lookups on the cell around the
+point and its neighbours, followed by an exact distance check on what is left.
+"""
+from math import asin, cos, radians, sin, sqrt
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LON = 111.320
+
+def encode(latitude, longitude, precision=PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        # bits alternate between longitude and latitude, starting with longitude
+        value, value_range = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+def cell_size(precision):
+    """
+    (latitude, longitude) span in degrees of a cell with this many characters
+    """
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+def covering_cells(latitude, longitude, radius_km):
+    """
+    Geohash prefixes whose cells together contain every point within
+    radius_km of (latitude, longitude): the smallest cells that are at least
+    radius_km on each side, i.e. the cell of the point and its 8 neighbours.
+    Returns None when the radius is too large for any cell size, in which case
+    the caller should not prune by cell at all
+    """
+    for precision in range(PRECISION, 0, -1):
+        lat_span, lon_span = cell_size(precision)
+        # cells get narrower away from the equator, use the worst edge of the circle
+        edge_latitude = min(abs(latitude) + radius_km / KM_PER_DEGREE_LAT, 90.0)
+        width_km = lon_span * KM_PER_DEGREE_LON * cos(radians(edge_latitude))
+        height_km = lat_span * KM_PER_DEGREE_LAT
+        if width_km >= radius_km and height_km >= radius_km:
+            break
+    else:
+        return None
+
+    cells = set()
+    for lat_step in (-1, 0, 1):
+        neighbour_lat = latitude + lat_step * lat_span
+        if neighbour_lat > 90.0 or neighbour_lat < -90.0:
+            continue
+        for lon_step in (-1, 0, 1):
+            neighbour_lon = (longitude + lon_step * lon_span + 180.0) % 360.0 - 180.0
+            cells.add(encode(neighbour_lat, neighbour_lon, precision))
+    return sorted(cells)
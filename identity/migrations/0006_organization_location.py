@@ -0,0 +1,43 @@
+# Generated by Django 3.2.7 on 2026-10-18 12:49
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('identity', '0005_alter_organization_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=9),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='latitude',
+            field=models.FloatField(blank=True, default=None, null=True, validators=[django.core.validators.MinValueValidator(-90.0), django.core.validators.MaxValueValidator(90.0)]),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='longitude',
+            field=models.FloatField(blank=True, default=None, null=True, validators=[django.core.validators.MinValueValidator(-180.0), django.core.validators.MaxValueValidator(180.0)]),
+        ),
+        migrations.AddField(
+            model_name='orgapplication',
+            name='latitude',
+            field=models.FloatField(blank=True, default=None, null=True, validators=[django.core.validators.MinValueValidator(-90.0), django.core.validators.MaxValueValidator(90.0)]),
+        ),
+        migrations.AddField(
+            model_name='orgapplication',
+            name='longitude',
+            field=models.FloatField(blank=True, default=None, null=True, validators=[django.core.validators.MinValueValidator(-180.0), django.core.validators.MaxValueValidator(180.0)]),
+        ),
+        migrations.AddIndex(
+            model_name='organization',
+            index=models.Index(fields=['geohash'], name='organization_geohash_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
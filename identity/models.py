@@ -1,8 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils.translation import gettext_lazy as _
 from phonenumber_field.modelfields import PhoneNumberField
 
+from identity import geo
+
 class UserProfile(models.Model):
     """
     Profile describes an user
@@ -18,6 +21,14 @@ class OrgStatus(models.IntegerChoices):
     ACTIVE = 0,_('Active')
     INACTIVE = 1,_('Inactive')
     
+def latitude_field():
+    return models.FloatField(null=True, blank=True, default=None,
+        validators=[MinValueValidator(-90.0), MaxValueValidator(90.0)])
+
+def longitude_field():
+    return models.FloatField(null=True, blank=True, default=None,
+        validators=[MinValueValidator(-180.0), MaxValueValidator(180.0)])
+
 class Organization(models.Model):
     name=models.CharField(max_length=20, blank=False)
     address=models.CharField(max_length=50, blank=False)
@@ -28,6 +39,46 @@ class Organization(models.Model):
         choices=OrgStatus.choices,
         default=OrgStatus.ACTIVE
     )
+    latitude = latitude_field()
+    longitude = longitude_field()
+    # grid cell of (latitude, longitude), kept in sync by save(), see identity.geo
+    geohash = models.CharField(max_length=geo.PRECISION, blank=True, default="", editable=False)
+
+    class Meta:
+        indexes = [
+            # prefix (LIKE 'abc%') lookups for the proximity search
+            models.Index(fields=['geohash'], name='organization_geohash_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geo.encode(self.latitude, self.longitude)
+        else:
+            self.geohash = ""
+        super().save(*args, **kwargs)
+
+def organizations_near(latitude, longitude, radius_km):
+    """
+    (organization id, distance in km) of every located organization within
+    radius_km of the point, closest first. Candidates come from prefix
+    lookups on the geohash index, only those get an exact distance check
+    """
+    organizations = Organization.objects.exclude(geohash="")
+    cells = geo.covering_cells(latitude, longitude, radius_km)
+    if cells is not None:
+        in_cells = models.Q()
+        for cell in cells:
+            in_cells |= models.Q(geohash__startswith=cell)
+        organizations = organizations.filter(in_cells)
+
+    nearby = []
+    for org_id, org_latitude, org_longitude in organizations.values_list('id', 'latitude', 'longitude'):
+        distance = geo.haversine_km(latitude, longitude, org_latitude, org_longitude)
+        if distance <= radius_km:
+            nearby.append((org_id, distance))
+    nearby.sort(key=lambda item: (item[1], item[0]))
+    return nearby
+
 class ApplicationStatus(models.IntegerChoices):
     PENDING = 0,_('Pending')
     APPROVED = 1,_('Approved')
@@ -62,6 +113,8 @@ class OrgApplication(models.Model):
     phone=PhoneNumberField(blank=False)
     email=models.EmailField(default=None, blank=True)
     url=models.URLField(default=None, blank=True)
+    latitude = latitude_field()
+    longitude = longitude_field()
 
     class Meta:
         constraints = [
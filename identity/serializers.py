@@ -8,10 +8,30 @@ from django.core.validators import validate_email
 from identity import models
 
 
+def validate_location(attrs):
+    """
+    latitude and longitude only make sense together
+    """
+    if ('latitude' in attrs) != ('longitude' in attrs) or \
+            (attrs.get('latitude') is None) != (attrs.get('longitude') is None):
+        raise serializers.ValidationError(_('latitude and longitude must be given together.'))
+
 class OrganizationSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Organization
-        fields = ['id', 'name','address', 'email', 'phone', 'url', 'status']
+        fields = ['id', 'name','address', 'email', 'phone', 'url', 'status', 'latitude', 'longitude']
+
+    def __init__(self, *args, **kwargs):
+        # fields=[...] keeps only those of Meta.fields, see OrganizationViewSet
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def validate(self, attrs):
+        validate_location(attrs)
+        return attrs
 
 class RegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(max_length=128, min_length=8, write_only=True, required=True)
@@ -84,7 +104,11 @@ class OrgApplicationSerializer(serializers.ModelSerializer):
     #status = serializers.(default=models.ApplicationStatus.PENDING)
     class Meta:
         model = models.OrgApplication
-        fields = ["id", "user", "name", "address", "phone", "email", "url", "status"]
+        fields = ["id", "user", "name", "address", "phone", "email", "url", "status", "latitude", "longitude"]
+
+    def validate(self, attrs):
+        validate_location(attrs)
+        return attrs
 
 class JoinRequestSerializerWrite(serializers.ModelSerializer):
     user = serializers.HiddenField(
@@ -2,7 +2,7 @@ import pytest
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from rest_framework import status
-from identity import models
+from identity import geo, models
 import json
 
 EMAIL="email@example.com"
@@ -152,7 +152,9 @@ def test_info(client):
             "email": "email@example.com",
             "phone": "+16088675309",
             "url": "http://example.com",
-            "status": 0
+            "status": 0,
+            "latitude": None,
+            "longitude": None
         },
         "is_org_admin": False,
         "is_site_admin": False,
@@ -179,7 +181,9 @@ def test_list_organization(client):
         "email": "email@example.com",
         "phone": "+16088675309",
         "url": "http://example.com",
-        "status": 0
+        "status": 0,
+        "latitude": None,
+        "longitude": None
     }
     assert dict(response.data[0]) == expected
 
@@ -212,6 +216,83 @@ def test_create_organization(client):
     assert organization.url == ORG_URL_2
     assert organization.status == ORG_STATUS
 
+@pytest.mark.django_db()
+def test_create_organization_with_location(client):
+    user = User.objects.create_user("email@example.com", "email@example.com", "password")
+    token = Token.objects.create(user=user)
+    data = {
+        "name": "name",
+        "address": "address",
+        "email": "email@example.com",
+        "phone": "+16088675309",
+        "url": "http://example.com",
+        "latitude": 43.0731,
+        "longitude": -89.4012,
+    }
+    response = client.post("/api/identity/organization/", data, HTTP_AUTHORIZATION='Token ' + token.key)
+    assert response.status_code == status.HTTP_201_CREATED
+    organization = models.Organization.objects.get(id=response.data["id"])
+
+    assert organization.latitude == 43.0731
+    assert organization.geohash == geo.encode(43.0731, -89.4012)
+
+    # a location needs both coordinates
+    del data["longitude"]
+    response = client.post("/api/identity/organization/", data, HTTP_AUTHORIZATION='Token ' + token.key)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    data["longitude"] = 200
+    response = client.post("/api/identity/organization/", data, HTTP_AUTHORIZATION='Token ' + token.key)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_geohash_encode():
+    # reference values from the original geohash.org implementation
+    assert geo.encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geo.encode(42.6, -5.6, 5) == "ezs42"
+
+def test_covering_cells_contain_circle():
+    latitude, longitude, radius = 43.0731, -89.4012, 5
+    cells = geo.covering_cells(latitude, longitude, radius)
+    precision = len(cells[0])
+
+    assert len(cells) == 9
+    # points on the circle around the center all fall in one of the cells
+    for lat_offset, lon_offset in [(1, 0), (-1, 0), (0, 1), (0, -1), (0.7, 0.7), (-0.7, -0.7)]:
+        point_latitude = latitude + lat_offset * radius / geo.KM_PER_DEGREE_LAT
+        point_longitude = longitude + lon_offset * radius / (geo.KM_PER_DEGREE_LON * 0.73)
+        assert geo.encode(point_latitude, point_longitude, precision) in cells
+
+    # too large a radius for any cell size disables the pruning
+    assert geo.covering_cells(latitude, longitude, 20000) is None
+
+@pytest.mark.django_db()
+def test_organizations_near():
+    def located_organization(latitude, longitude):
+        return models.Organization.objects.create(
+            name="name",
+            address="address",
+            email="email@example.com",
+            phone="+16088675309",
+            url="http://example.com",
+            latitude=latitude,
+            longitude=longitude,
+        )
+    # Madison capitol, UW campus (~2 km), Milwaukee (~120 km)
+    capitol = located_organization(43.0747, -89.3841)
+    campus = located_organization(43.0766, -89.4125)
+    located_organization(43.0389, -87.9065)
+    models.Organization.objects.create(
+        name="name",
+        address="address",
+        email="email@example.com",
+        phone="+16088675309",
+        url="http://example.com",
+    )
+
+    nearby = models.organizations_near(43.0731, -89.4012, 5)
+    assert [org_id for org_id, _ in nearby] == [campus.id, capitol.id]
+    assert all(distance <= 5 for _, distance in nearby)
+
 @pytest.mark.django_db()
 def test_get_organization(client):
     organization = models.Organization.objects.create(
@@ -232,10 +313,35 @@ def test_get_organization(client):
         "email": "email@example.com",
         "phone": "+16088675309",
         "url": "http://example.com",
-        "status": 0
+        "status": 0,
+        "latitude": None,
+        "longitude": None
     }
     assert response.data == expected
 
+@pytest.mark.django_db()
+def test_list_organization_fields(client):
+    organization = models.Organization.objects.create(
+        name="name",
+        address="address",
+        email="email@example.com",
+        phone="+16088675309",
+        url="http://example.com",
+        status=models.OrgStatus.ACTIVE
+    )
+    user = User.objects.create_user("email@example.com", "email@example.com", "password")
+    token = Token.objects.create(user=user)
+    response = client.get("/api/identity/organization/", {"fields": "id,name"}, HTTP_AUTHORIZATION='Token ' + token.key)
+    assert response.status_code == status.HTTP_200_OK
+    assert [dict(org) for org in response.data] == [{"id": organization.id, "name": "name"}]
+
+    response = client.get("/api/identity/organization/"+str(organization.id)+"/", {"fields": "url"},
+        HTTP_AUTHORIZATION='Token ' + token.key)
+    assert response.data == {"url": "http://example.com"}
+
+    response = client.get("/api/identity/organization/", {"fields": "id,password"}, HTTP_AUTHORIZATION='Token ' + token.key)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
 @pytest.mark.django_db()
 def test_create_application(client):
     user = User.objects.create_user("email@example.com", "email@example.com", "password")
@@ -276,7 +382,9 @@ def test_list_application(client):
         "email": "email@example.com",
         "phone": "+16088675309",
         "url": "http://example.com",
-        "status": models.ApplicationStatus.PENDING
+        "status": models.ApplicationStatus.PENDING,
+        "latitude": None,
+        "longitude": None
     }
     assert dict(response.data[0]) == expected
 
@@ -370,7 +478,9 @@ def test_list_joinrequest(client):
         "email": "email@example.com",
         "phone": "+16088675309",
         "url": "http://example.com",
-        "status": 0
+        "status": 0,
+        "latitude": None,
+        "longitude": None
     }
     expected = {
         "id": join_request.id,
@@ -5,6 +5,7 @@ from django.core.exceptions import ValidationError
 from rest_framework import viewsets, status
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.exceptions import ValidationError as DRFValidationError
 from rest_framework.generics import CreateAPIView, RetrieveAPIView
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
@@ -53,6 +54,31 @@ class OrganizationViewSet(
     permission_classes = (IsAuthenticated,)
     serializer_class = serializers.OrganizationSerializer
 
+    def get_requested_fields(self):
+        """
+        fields=a,b of list and retrieve, None when every field is wanted
+        """
+        fields = self.request.query_params.get('fields', None)
+        if fields is None or self.action not in ('list', 'retrieve'):
+            return None
+        fields = [field for field in fields.split(',') if field]
+        if not fields or not set(fields) <= set(self.serializer_class.Meta.fields):
+            raise DRFValidationError({"message": "Invalid fields parameter value"})
+        return fields
+
+    def get_queryset(self):
+        fields = self.get_requested_fields()
+        if fields is None:
+            return super().get_queryset()
+        # every serializer field is a model field of the same name
+        return super().get_queryset().only('id', *fields)
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
 class OrgApplicationViewSet(viewsets.mixins.UpdateModelMixin, viewsets.mixins.CreateModelMixin, viewsets.mixins.ListModelMixin, viewsets.mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     queryset = models.OrgApplication.objects.all()
     permissions_classes = (IsAuthenticated,)
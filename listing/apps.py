@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ListingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'listing'
+
+    def ready(self):
+        # connect the signal receivers, register the system checks
+        from listing import blobs, changes, images, matching, response_cache, stats, thumbnails  # noqa: F401
@@ -0,0 +1,78 @@
+"""
+Reference counts of the content-addressed donation pictures.
+
+ContentAddressedStorage stores identical pictures once, so one file can back
+many donations. Every save of a picture counts one more user of the file and
+every hard delete of a donation counts one less; the file (and its
+thumbnails) is removed when nobody uses it any more. Soft deleted donations
+keep their picture.
+
+The PictureBlob row is the lock on its files: retain() holds it from the
+count to the end of the upload's transaction, and the row of an unused blob
+stays at refcount 0 until delete_files() has locked it and removed the
+files. An upload of the same content racing the delete either counts itself
+first, and the files stay, or waits for them to be gone and writes them
+again.
+"""
+from django.db import connection, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from listing import thumbnails
+from listing.models import Donation, PictureBlob
+
+def picture_storage():
+    return Donation._meta.get_field('picture').storage
+
+def retain(name, size):
+    """
+    Count one more donation using the blob, before its file is written (see
+    ContentAddressedStorage.save). Runs in the caller's transaction, so a
+    create that is rolled back does not leave a count behind
+    """
+    table = PictureBlob._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO {table} (name, size, refcount) VALUES (%s, %s, 1) "
+            "ON CONFLICT (name) DO UPDATE SET refcount = {table}.refcount + 1".format(table=table),
+            [name, size])
+
+def release(name):
+    """
+    Count one less donation using the blob, and delete its files once the
+    transaction commits if that was the last one. Returns True if the blob
+    is going away
+    """
+    table = PictureBlob._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE {table} SET refcount = refcount - 1 WHERE name = %s AND refcount > 0 "
+            "RETURNING refcount".format(table=table),
+            [name])
+        row = cursor.fetchone()
+    # no row: a picture stored before content addressing, it is never deleted
+    if row is None or row[0] > 0:
+        return False
+    transaction.on_commit(lambda: delete_files(name))
+    return True
+
+def delete_files(name):
+    """
+    Delete the files and the row of a blob nobody uses. An upload of the same
+    content that counted itself since the release keeps them: the lock waits
+    for its transaction and the refcount check then sees its count
+    """
+    with transaction.atomic():
+        blob = PictureBlob.objects.select_for_update().filter(name=name, refcount=0).first()
+        if blob is None:
+            return
+        storage = picture_storage()
+        storage.delete(name)
+        for label in thumbnails.sizes():
+            storage.delete(thumbnails.thumbnail_name(name, label))
+        blob.delete()
+
+@receiver(post_delete, sender=Donation)
+def release_picture(sender, instance, **kwargs):
+    if instance.picture.name:
+        release(instance.picture.name)
@@ -0,0 +1,54 @@
+"""
+Change feed of the listings.
+
+Every listing created or deactivated through the serializers (including
+soft_delete_listings) gets a ListingChange row in the same transaction, so a
+client holding the seq of the last change it saw can ask for just the
+changes after it instead of re-reading the lists.
+
+A sequence alone does not give commit order: a transaction can take seq 10,
+commit after another one that took seq 11, and a reader that already moved
+past 11 would never see 10. Writers therefore take a transaction-level
+advisory lock before numbering their rows, which orders the commits of
+listing writes from that point on. The lock is taken at the very end of the
+writing transactions, where the signals are sent, so it is held briefly.
+"""
+from django.db import connection
+from django.dispatch import receiver
+
+from listing.models import ChangeAction, Donation, ListingChange, ListingType, Request
+from listing.signals import listings_created, listings_deactivated
+
+# pg_advisory_xact_lock key, any constant not used by another lock
+CHANGE_LOCK_KEY = 0x6c697374
+
+LISTING_TYPES = {
+    Donation: ListingType.DONATION,
+    Request: ListingType.REQUEST,
+}
+
+def record(model, listings, action, time_field):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", [CHANGE_LOCK_KEY])
+    ListingChange.objects.bulk_create([
+        ListingChange(
+            listing_type=LISTING_TYPES[model],
+            listing_id=listing.pk,
+            organization_id=listing.organization_id,
+            action=action,
+            time=getattr(listing, time_field),
+            trait_mask=listing.trait_mask,
+        ) for listing in listings
+    ])
+
+def latest_seq():
+    change = ListingChange.objects.order_by('-seq').only('seq').first()
+    return change.seq if change is not None else 0
+
+@receiver(listings_created)
+def record_created(sender, listings, **kwargs):
+    record(sender, listings, ChangeAction.CREATED, 'creation_time')
+
+@receiver(listings_deactivated)
+def record_deactivated(sender, listings, **kwargs):
+    record(sender, listings, ChangeAction.DEACTIVATED, 'deactivation_time')
@@ -1,5 +1,13 @@
 from .tests import TEST_DIR
+import pytest
 import shutil
 
+from django.core.cache import cache
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # the locmem cache outlives the per-test database rollback
+    cache.clear()
+
 def pytest_sessionfinish(session, exitstatus):
-    shutil.rmtree(TEST_DIR)
\ No newline at end of file
+    shutil.rmtree(TEST_DIR)
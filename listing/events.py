@@ -0,0 +1,253 @@
+"""
+Server-Sent Events push of listing changes, served by atfoc.asgi at
+/api/listing/events/ (it needs an ASGI server, runserver does not serve it).
+
+Each worker runs one Broker. While at least one client is connected, the
+broker polls the change feed (ListingChange, see listing.changes) every
+LISTING_EVENTS_POLL_INTERVAL seconds and fans the new rows out to the
+subscribers whose filters match. A connection is one coroutine waiting on
+its own queue, so idle clients cost no thread and no database query, and
+changes written by any worker reach the clients of every worker.
+
+Clients authenticate with "Authorization: Token <key>" or, since browsers'
+EventSource cannot set headers, ?token=<key>, and can filter with org_id=1,2,
+type=donation|request, traits=0,1 and traits_match=any|all. The id of each
+event is the change seq: after a reconnect, /api/listing/changes/?since=<id>
+returns what was missed.
+
+The stream is served outside of Django, so django-cors-headers does not see
+it: the CORS headers for the origins in CORS_ALLOWED_ORIGINS are set here.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connection
+from rest_framework.authtoken.models import Token
+
+from listing import changes
+from listing.models import ChangeAction, ListingChange, ListingType, TraitType, mask_traits, masks_matching, trait_mask
+
+EVENTS_PATH = '/api/listing/events/'
+
+def change_event(change):
+    return {
+        "seq": change.seq,
+        "type": ListingType(change.listing_type).label,
+        "id": change.listing_id,
+        "organization_id": change.organization_id,
+        "action": ChangeAction(change.action).label,
+        "time": change.time,
+        "traits": mask_traits(change.trait_mask),
+    }
+
+class EventFilter:
+    """
+    Which changes a subscriber wants, None meaning any
+    """
+    def __init__(self, org_ids=None, listing_type=None, masks=None):
+        self.org_ids = org_ids
+        self.listing_type = listing_type
+        self.masks = masks
+
+    @classmethod
+    def from_query(cls, params):
+        """
+        Build the filter from the parsed query string, raise ValueError with
+        the message for the client on invalid values
+        """
+        org_ids = listing_type = masks = None
+        if 'org_id' in params:
+            try:
+                org_ids = {int(org_id) for org_id in params['org_id'].split(',')}
+            except ValueError:
+                raise ValueError("Invalid org_id parameter value")
+        if 'type' in params:
+            types = {label: value for value, label in ListingType.choices}
+            if params['type'] not in types:
+                raise ValueError("Invalid type parameter value")
+            listing_type = types[params['type']]
+        if 'traits' in params:
+            try:
+                trait_list = [int(trait) for trait in params['traits'].split(',')]
+            except ValueError:
+                trait_list = None
+            if not trait_list or not set(trait_list) <= set(TraitType.values):
+                raise ValueError("Invalid traits parameter value")
+            traits_match = params.get('traits_match', 'any')
+            if traits_match not in ['any', 'all']:
+                raise ValueError("Invalid traits_match parameter value")
+            masks = set(masks_matching(trait_mask(trait_list), match_all=(traits_match == 'all')))
+        return cls(org_ids, listing_type, masks)
+
+    def matches(self, change):
+        return ((self.org_ids is None or change.organization_id in self.org_ids)
+            and (self.listing_type is None or change.listing_type == self.listing_type)
+            and (self.masks is None or change.trait_mask in self.masks))
+
+class Subscription:
+    def __init__(self, event_filter):
+        self.filter = event_filter
+        self.queue = asyncio.Queue(maxsize=settings.LISTING_EVENTS_QUEUE_SIZE)
+
+class Broker:
+    """
+    In-process fan-out of the change feed to the connected clients, runs on
+    the event loop of the ASGI server
+    """
+    def __init__(self):
+        self.subscriptions = set()
+        self.poller = None
+        # last change seq read, None until the poller has started
+        self.seq = None
+
+    def subscribe(self, event_filter):
+        subscription = Subscription(event_filter)
+        self.subscriptions.add(subscription)
+        if self.poller is None or self.poller.done():
+            self.poller = asyncio.ensure_future(self.poll())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    def publish(self, change_rows):
+        for subscription in list(self.subscriptions):
+            for change in change_rows:
+                if not subscription.filter.matches(change):
+                    continue
+                try:
+                    subscription.queue.put_nowait(change)
+                except asyncio.QueueFull:
+                    # the client fell too far behind: close its connection, it
+                    # reconnects and catches up through the change feed
+                    self.unsubscribe(subscription)
+                    subscription.queue.get_nowait()
+                    subscription.queue.put_nowait(None)
+                    break
+
+    async def poll(self):
+        """
+        Read new changes while anyone is subscribed. Starts at the current
+        end of the feed, the clients connected before that use since=
+        """
+        self.seq = await sync_to_async(changes.latest_seq)()
+        try:
+            while self.subscriptions:
+                await asyncio.sleep(settings.LISTING_EVENTS_POLL_INTERVAL)
+                rows = await sync_to_async(self.fetch)(self.seq)
+                if rows:
+                    self.seq = rows[-1].seq
+                    self.publish(rows)
+        finally:
+            self.seq = None
+
+    @staticmethod
+    def fetch(seq):
+        try:
+            return list(ListingChange.objects.filter(seq__gt=seq).order_by('seq')[:settings.LISTING_CHANGES_PAGE_SIZE])
+        except DatabaseError:
+            # the connection lives as long as the poller, reconnect on the next poll
+            connection.close()
+            return []
+
+broker = Broker()
+
+def authenticate(key):
+    try:
+        token = Token.objects.select_related('user').get(key=key)
+    except Token.DoesNotExist:
+        return None
+    return token.user if token.user.is_active else None
+
+def request_token(scope, params):
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            kind, _, key = value.decode('latin-1').partition(' ')
+            if kind == 'Token':
+                return key.strip()
+    return params.get('token', None)
+
+def cors_headers(scope):
+    """
+    The CORS response headers for the Origin of the request, the way
+    corsheaders.middleware.CorsMiddleware sets them on the Django responses
+    """
+    headers = [(b'vary', b'Origin')]
+    for name, value in scope['headers']:
+        if name == b'origin' and value.decode('latin-1') in settings.CORS_ALLOWED_ORIGINS:
+            headers.append((b'access-control-allow-origin', value))
+            if getattr(settings, 'CORS_ALLOW_CREDENTIALS', False):
+                headers.append((b'access-control-allow-credentials', b'true'))
+    return headers
+
+def sse_message(change):
+    event = change_event(change)
+    data = json.dumps(event, cls=DjangoJSONEncoder)
+    return ("id: %d\nevent: %s\ndata: %s\n\n" % (change.seq, event["action"], data)).encode('utf-8')
+
+async def send_error(scope, send, code, message):
+    await send({
+        'type': 'http.response.start',
+        'status': code,
+        'headers': [(b'content-type', b'application/json'), *cors_headers(scope)],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps({"message": message}).encode('utf-8')})
+
+async def events_application(scope, receive, send):
+    params = {key: values[-1] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+    key = request_token(scope, params)
+    user = await sync_to_async(authenticate)(key) if key else None
+    if user is None:
+        return await send_error(scope, send, 401, "Authentication credentials were not provided.")
+    try:
+        event_filter = EventFilter.from_query(params)
+    except ValueError as exc:
+        return await send_error(scope, send, 400, str(exc))
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # tell nginx not to buffer the stream
+            (b'x-accel-buffering', b'no'),
+            *cors_headers(scope),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+
+    subscription = broker.subscribe(event_filter)
+    disconnect = asyncio.ensure_future(receive())
+    next_change = None
+    try:
+        while True:
+            if next_change is None:
+                next_change = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait([next_change, disconnect],
+                timeout=settings.LISTING_EVENTS_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # keep proxies from closing an idle connection
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                continue
+            if disconnect in done:
+                if disconnect.result()['type'] == 'http.disconnect':
+                    return
+                disconnect = asyncio.ensure_future(receive())
+            if next_change in done:
+                change = next_change.result()
+                next_change = None
+                if change is None:
+                    break
+                await send({'type': 'http.response.body', 'body': sse_message(change), 'more_body': True})
+    finally:
+        broker.unsubscribe(subscription)
+        disconnect.cancel()
+        if next_change is not None:
+            next_change.cancel()
+    # the client fell behind, end the response, it reconnects and catches up
+    await send({'type': 'http.response.body', 'body': b''})
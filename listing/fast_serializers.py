@@ -0,0 +1,126 @@
+"""
+Fast path for the listing representations.
+
+DonationSerializer and RequestSerializer go through DRF's per-row dispatch,
+a model instance, an ImageFieldFile and a storage url() call for every row.
+The classes here build the same dicts from .values() rows instead: the media
+URL prefix is looked up once, datetimes are formatted by one function the
+way DRF's JSON encoder formats them, and traits come from one query. The JSON
+rendered from their output is byte for byte the one rendered from the DRF
+serializers. Used by the listing views when LISTING_FAST_SERIALIZER is set.
+"""
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from operator import itemgetter
+
+from django.utils.encoding import filepath_to_uri
+
+from listing.models import Donation, DonationTraits, Request, RequestTraits
+from listing.thumbnails import sizes, thumbnail_name
+
+def format_datetime(value):
+    """
+    The string DRF's JSONEncoder writes for a datetime
+    """
+    if value is None:
+        return None
+    representation = value.isoformat()
+    if representation.endswith('+00:00'):
+        representation = representation[:-6] + 'Z'
+    return representation
+
+class FastListingSerializer(ABC):
+    listing_model = None
+    trait_model = None
+    trait_listing_field = None
+
+    def __init__(self, fields=None):
+        getters = self.get_getters()
+        # same key order as the DRF serializers
+        self.keys = [key for key in getters if fields is None or key in fields]
+        self.getters = [(key, getters[key][1]) for key in self.keys if key != 'traits']
+        self.with_traits = 'traits' in self.keys
+        self.key_columns = {key: getters[key][0] for key in self.keys}
+
+    @abstractmethod
+    def get_getters(self):
+        """
+        {representation key: (values() columns it reads, row -> value)}, in
+        the key order of the DRF serializer
+        """
+
+    def columns(self):
+        columns = [self.listing_model._meta.pk.name]
+        for key in self.keys:
+            columns.extend(column for column in self.key_columns[key] if column not in columns)
+        return columns
+
+    def load_traits(self, listing_ids):
+        traits = defaultdict(list)
+        rows = (self.trait_model.objects.filter(**{self.trait_listing_field + '__in': listing_ids})
+            .order_by('id').values_list(self.trait_listing_field, 'trait'))
+        for listing_id, trait in rows:
+            traits[listing_id].append(trait)
+        return traits
+
+    def represent(self, rows):
+        """
+        Representations of values() rows that have at least columns()
+        """
+        rows = list(rows)
+        getters = self.getters
+        if not self.with_traits:
+            return [{key: getter(row) for key, getter in getters} for row in rows]
+
+        pk = self.listing_model._meta.pk.name
+        traits = self.load_traits([row[pk] for row in rows])
+        data = []
+        for row in rows:
+            rep = {key: getter(row) for key, getter in getters}
+            # traits is the last key of both representations
+            rep['traits'] = traits.get(row[pk], [])
+            data.append(rep)
+        return data
+
+class FastDonationSerializer(FastListingSerializer):
+    listing_model = Donation
+    trait_model = DonationTraits
+    trait_listing_field = 'donation_id'
+
+    def get_getters(self):
+        storage = Donation._meta.get_field('picture').storage
+        media_url = storage.base_url
+        labels = list(sizes())
+
+        def url(name):
+            # FileSystemStorage.url() without the per call urljoin
+            return media_url + filepath_to_uri(name).lstrip('/')
+
+        def thumbnails(row):
+            if not row['thumbnails_ready']:
+                picture = url(row['picture'])
+                return {label: picture for label in labels}
+            return {label: url(thumbnail_name(row['picture'], label)) for label in labels}
+
+        return {
+            'donation_id': (['donation_id'], itemgetter('donation_id')),
+            'description': (['description'], itemgetter('description')),
+            'expiration_date': (['expiration_date'], lambda row: format_datetime(row['expiration_date'])),
+            'organization_id': (['organization_id'], itemgetter('organization_id')),
+            'picture': (['picture'], lambda row: url(row['picture'])),
+            'thumbnails': (['picture', 'thumbnails_ready'], thumbnails),
+            'traits': ([], None),
+        }
+
+class FastRequestSerializer(FastListingSerializer):
+    listing_model = Request
+    trait_model = RequestTraits
+    trait_listing_field = 'request_id'
+
+    def get_getters(self):
+        return {
+            'request_id': (['request_id'], itemgetter('request_id')),
+            'description': (['description'], itemgetter('description')),
+            'organization_id': (['organization_id'], itemgetter('organization_id')),
+            'traits': ([], None),
+        }
@@ -0,0 +1,55 @@
+import os
+
+from django.conf import settings
+from django.core import checks
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+from six import BytesIO
+
+EXTENSIONS = {
+    'JPEG': '.jpg',
+    'WEBP': '.webp',
+}
+
+@checks.register()
+def check_image_format(app_configs, **kwargs):
+    """
+    LISTING_IMAGE_FORMAT must be one of EXTENSIONS, reported at startup
+    rather than as a KeyError on the first upload
+    """
+    if settings.LISTING_IMAGE_FORMAT in EXTENSIONS:
+        return []
+    return [checks.Error(
+        "LISTING_IMAGE_FORMAT is %r, it must be one of %s" % (
+            settings.LISTING_IMAGE_FORMAT, ", ".join(sorted(EXTENSIONS))),
+        id='listing.E001',
+    )]
+
+def normalize_picture(picture):
+    """
+    Re-encode an uploaded picture before it is stored: apply the EXIF
+    orientation, cap the longest side at LISTING_IMAGE_MAX_DIMENSION and
+    write it as LISTING_IMAGE_FORMAT at LISTING_IMAGE_QUALITY. No metadata
+    is copied over, so EXIF (GPS position, camera, ...) is dropped
+    """
+    image_format = settings.LISTING_IMAGE_FORMAT
+    max_dimension = settings.LISTING_IMAGE_MAX_DIMENSION
+
+    picture.seek(0)
+    image = Image.open(picture)
+    # let the JPEG decoder scale down while decoding, much cheaper than
+    # decoding the full photo and resizing it afterwards. draft() only scales
+    # while both sides stay at or above the requested size, so ask for the
+    # final size with the photo's own aspect ratio, not a square box
+    width, height = image.size
+    scale = min(1.0, max_dimension / max(width, height))
+    image.draft('RGB', (int(width * scale), int(height * scale)))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS, reducing_gap=3.0)
+
+    output = BytesIO()
+    image.save(output, image_format, quality=settings.LISTING_IMAGE_QUALITY, optimize=True)
+    root, _ = os.path.splitext(os.path.basename(picture.name))
+    return ContentFile(output.getvalue(), name=root + EXTENSIONS[image_format])
@@ -0,0 +1,222 @@
+import gzip
+import tempfile
+from time import perf_counter
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from six import BytesIO
+
+from atfoc.renderers import MessagePackRenderer, ORJSONRenderer, msgpack, orjson
+from identity.models import Organization
+from listing.fast_serializers import FastDonationSerializer, FastRequestSerializer
+from listing.images import normalize_picture
+from listing.models import Donation, DonationTraits, Request, RequestTraits
+from listing.renderers import ColumnarRenderer
+from listing.serializers import DonationSerializer, RequestSerializer
+from listing.views import DonationView, RequestView
+
+
+class Command(BaseCommand):
+    help = (
+        "Time listing code paths against the configured database. "
+        "Everything runs in a transaction that is rolled back and uploaded "
+        "files go to a temporary MEDIA_ROOT, so no data is left behind."
+    )
+    suites = ['bulk', 'columnar', 'images', 'renderers', 'serializers']
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=self.suites)
+        parser.add_argument('--count', type=int, default=500,
+            help='Number of listings used by the suite')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            with transaction.atomic():
+                getattr(self, 'suite_' + options['suite'])(options)
+                transaction.set_rollback(True)
+
+    def report(self, label, count, seconds):
+        self.stdout.write("%-32s %8d rows %10.3f s %12.1f rows/s" % (label, count, seconds, count / seconds))
+
+    def organization(self):
+        return Organization.objects.create(
+            name="benchmark",
+            address="benchmark",
+            email="benchmark@example.com",
+            phone="+16081112222",
+            url="example.com",
+        )
+
+    def picture(self, size=(100, 100)):
+        image = BytesIO()
+        Image.new('RGB', size).save(image, 'JPEG')
+        return SimpleUploadedFile("benchmark.jpg", image.getvalue())
+
+    def suite_bulk(self, options):
+        """
+        Per-item POST path against the bulk create path
+        """
+        count = options['count']
+        org = self.organization()
+
+        def donations():
+            return [{
+                "org_id": org.id,
+                "description": "benchmark donation %d" % i,
+                "picture": self.picture(),
+                "expiration_date": timezone.now(),
+                "traits": [0, 1],
+            } for i in range(count)]
+
+        def requests():
+            return [{
+                "org_id": org.id,
+                "description": "benchmark request %d" % i,
+                "traits": [0, 1],
+            } for i in range(count)]
+
+        for label, serializer_class, make_items in [
+                ("donations", DonationSerializer, donations),
+                ("requests", RequestSerializer, requests)]:
+            items = make_items()
+            start = perf_counter()
+            for item in items:
+                serializer = serializer_class(data=item)
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+            self.report(label + " per item", count, perf_counter() - start)
+
+            items = make_items()
+            start = perf_counter()
+            serializer = serializer_class(data=items, many=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            self.report(label + " bulk", count, perf_counter() - start)
+
+    def photo(self, size=(4032, 3024)):
+        """
+        A phone-sized JPEG with an EXIF block, noisy enough not to compress to nothing
+        """
+        width, height = size
+        noise = Image.effect_noise((width // 4, height // 4), 40).resize(size)
+        gradient = Image.linear_gradient('L').resize(size)
+        image = Image.merge('RGB', (noise, gradient, noise.transpose(Image.FLIP_LEFT_RIGHT)))
+        exif = Image.Exif()
+        exif[0x0112] = 6  # orientation: rotate 90
+        exif[0x010f] = "benchmark camera"
+        output = BytesIO()
+        image.save(output, 'JPEG', quality=95, exif=exif.tobytes())
+        return SimpleUploadedFile("benchmark.jpg", output.getvalue())
+
+    def suite_images(self, options):
+        """
+        Bytes saved and CPU time of the upload normalization stage
+        """
+        count = options['count']
+        photos = [self.photo() for _ in range(count)]
+        bytes_in = sum(photo.size for photo in photos)
+        start = perf_counter()
+        normalized = [normalize_picture(photo) for photo in photos]
+        seconds = perf_counter() - start
+        bytes_out = sum(picture.size for picture in normalized)
+
+        self.report("normalize_picture", count, seconds)
+        self.stdout.write("%.1f ms per image, %d -> %d bytes (%.1f%% saved)" % (
+            1000 * seconds / count, bytes_in, bytes_out, 100.0 * (bytes_in - bytes_out) / bytes_in))
+
+    def listings(self, count):
+        """
+        count donations and count requests with two traits each, return their organization
+        """
+        org = self.organization()
+        now = timezone.now()
+        donations = Donation.objects.bulk_create([Donation(
+            organization=org,
+            description="benchmark donation %d" % i,
+            picture="donations/benchmark-%d.jpg" % i,
+            expiration_date=now,
+            thumbnails_ready=bool(i % 2),
+            trait_mask=0b11,
+        ) for i in range(count)], batch_size=5000)
+        DonationTraits.objects.bulk_create([
+            DonationTraits(donation=donation, trait=trait) for donation in donations for trait in [0, 1]
+        ], batch_size=5000)
+        requests = Request.objects.bulk_create([Request(
+            organization=org,
+            description="benchmark request %d" % i,
+            trait_mask=0b11,
+        ) for i in range(count)], batch_size=5000)
+        RequestTraits.objects.bulk_create([
+            RequestTraits(request=request, trait=trait) for request in requests for trait in [0, 1]
+        ], batch_size=5000)
+        return org
+
+    def suite_serializers(self, options):
+        """
+        DRF serializers against listing.fast_serializers, from query to JSON bytes
+        """
+        count = options['count']
+        org = self.listings(count)
+        renderer = JSONRenderer()
+        for label, model, serializer_class, fast_class in [
+                ("donations", Donation, DonationSerializer, FastDonationSerializer),
+                ("requests", Request, RequestSerializer, FastRequestSerializer)]:
+            queryset = model.objects.filter(organization=org).order_by('pk')
+
+            start = perf_counter()
+            drf = renderer.render(serializer_class(queryset, many=True).data)
+            self.report(label + " DRF serializer", count, perf_counter() - start)
+
+            fast = fast_class()
+            start = perf_counter()
+            rendered = renderer.render(fast.represent(queryset.values(*fast.columns())))
+            self.report(label + " fast serializer", count, perf_counter() - start)
+            if rendered != drf:
+                self.stderr.write(label + ": the fast serializer output differs")
+
+    def suite_renderers(self, options):
+        """
+        Encode time and payload size of the listing responses per renderer
+        """
+        count = options['count']
+        org = self.listings(count)
+        payloads = [
+            ("donations", {"donations": DonationSerializer(
+                Donation.objects.filter(organization=org).order_by('pk'), many=True).data}),
+            ("requests", {"requests": RequestSerializer(
+                Request.objects.filter(organization=org).order_by('pk'), many=True).data}),
+        ]
+        for label, payload in payloads:
+            for renderer in [JSONRenderer(), ORJSONRenderer(), MessagePackRenderer()]:
+                name = "%s %s" % (label, renderer.format)
+                if renderer.format == 'orjson' and orjson is None or renderer.format == 'msgpack' and msgpack is None:
+                    self.stdout.write("%-32s not installed" % name)
+                    continue
+                start = perf_counter()
+                content = renderer.render(payload)
+                self.report(name, count, perf_counter() - start)
+                self.stdout.write("%-32s %8d bytes" % (name, len(content)))
+
+    def suite_columnar(self, options):
+        """
+        Size and encode time of format=columnar against the row format
+        """
+        count = options['count']
+        org = self.listings(count)
+        for label, view_class, serializer_class in [
+                ("donations", DonationView, DonationSerializer),
+                ("requests", RequestView, RequestSerializer)]:
+            rows = serializer_class(
+                view_class.model.objects.filter(organization=org).order_by('pk'), many=True).data
+            payload = {view_class.listing_key: rows}
+            for renderer in [JSONRenderer(), ColumnarRenderer()]:
+                name = "%s %s" % (label, renderer.format)
+                start = perf_counter()
+                content = renderer.render(payload, renderer_context={'view': view_class()})
+                self.report(name, count, perf_counter() - start)
+                self.stdout.write("%-32s %8d bytes %8d gzipped" % (name, len(content), len(gzip.compress(content))))
@@ -0,0 +1,69 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from listing.blobs import picture_storage
+from listing.models import Donation
+from listing.thumbnails import sizes, thumbnail_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Move donation pictures stored before content addressing to their "
+        "content-addressed name, keeping one file per distinct picture, and "
+        "report the space reclaimed. Safe to run again, pictures already "
+        "moved are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        storage = picture_storage()
+        batch_size = options['batch_size']
+        moved = missing = 0
+        freed = written = 0
+        last_id = 0
+        while True:
+            donations = list(
+                Donation.objects.filter(donation_id__gt=last_id)
+                .order_by('donation_id')
+                .only('donation_id', 'picture')[:batch_size])
+            if not donations:
+                break
+            last_id = donations[-1].donation_id
+            for donation in donations:
+                name = donation.picture.name
+                if not name or storage.is_content_name(name):
+                    continue
+                if not storage.exists(name):
+                    missing += 1
+                    continue
+                size = storage.size(name)
+                with storage.open(name, 'rb') as picture:
+                    content = File(picture, name)
+                    new_name = storage.content_name(name, content)
+                    is_new = not storage.exists(new_name)
+                    with transaction.atomic():
+                        new_name = storage.save(name, content)
+                        Donation.objects.filter(donation_id=donation.donation_id).update(picture=new_name)
+                self.move_thumbnails(storage, name, new_name)
+                storage.delete(name)
+                moved += 1
+                freed += size
+                if is_new:
+                    written += storage.size(new_name)
+
+        self.stdout.write("Moved %d pictures, %d missing" % (moved, missing))
+        self.stdout.write("Reclaimed %d bytes (%d freed, %d written)" % (freed - written, freed, written))
+
+    def move_thumbnails(self, storage, name, new_name):
+        for label in sizes():
+            old = thumbnail_name(name, label)
+            if not storage.exists(old):
+                continue
+            new = thumbnail_name(new_name, label)
+            if not storage.exists(new):
+                with storage.open(old, 'rb') as thumbnail:
+                    storage.replace(new, File(thumbnail, new))
+            storage.delete(old)
@@ -0,0 +1,46 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from listing.models import Donation, expired_filter
+from listing.serializers import soft_delete_listings
+
+
+class Command(BaseCommand):
+    help = (
+        "Deactivate donations past their expiration_date, at most --batch-size "
+        "rows per UPDATE. Runs once, for cron, or with --loop every --interval "
+        "seconds until it is stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--loop', action='store_true')
+        parser.add_argument('--interval', type=float, default=60,
+            help="Seconds to sleep between sweeps with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            expired = self.sweep(options['batch_size'])
+            self.stdout.write("Deactivated %d expired donations" % expired)
+            if not options['loop']:
+                break
+            # don't hold on to a connection the database may have dropped while sleeping
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def sweep(self, batch_size):
+        """
+        Deactivate expired donations one batch (and one short transaction) at
+        a time until a batch comes back short
+        """
+        total = 0
+        while True:
+            now = datetime.now(tz=timezone.utc)
+            count = soft_delete_listings(Donation.objects.filter(expired_filter(now)), limit=batch_size)
+            total += count
+            if count < batch_size:
+                return total
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from listing.models import Donation
+from listing.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = "Generate the missing thumbnails of donation pictures, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        done = 0
+        last_id = 0
+        while True:
+            donation_ids = list(
+                Donation.objects.filter(thumbnails_ready=False, donation_id__gt=last_id)
+                .order_by('donation_id')
+                .values_list('donation_id', flat=True)[:batch_size])
+            if not donation_ids:
+                break
+            done += len(generate_thumbnails(donation_ids))
+            last_id = donation_ids[-1]
+        self.stdout.write("Generated thumbnails for %d donations" % done)
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from listing.matching import match_requests
+from listing.models import MatchCandidate, Request, active_filter
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the request to donation match candidates from scratch. "
+        "Only needed to fill the table for listings created before matching "
+        "existed, or after changing LISTING_MATCH_RADIUS_KM or "
+        "LISTING_MATCH_CANDIDATES: it is otherwise kept up to date as "
+        "listings are created and deactivated."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = datetime.now(tz=timezone.utc)
+        requests = (Request.objects.filter(active_filter(now), trait_mask__gt=0)
+            .values_list('request_id', flat=True).order_by('request_id'))
+        with transaction.atomic():
+            before = MatchCandidate.objects.count()
+            MatchCandidate.objects.all().delete()
+            last_id = 0
+            while True:
+                batch = list(requests.filter(request_id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1]
+                match_requests(batch)
+            created = MatchCandidate.objects.count()
+        self.stdout.write("Rebuilt match candidates: %d before, %d now" % (before, created))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from listing import stats
+from listing.models import ListingCounter, ListingType, TraitType
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-organization listing counters behind "
+        "/api/listing/stats/ from the listings, report the ones that drifted "
+        "and store the recomputed values. Also fills the table for listings "
+        "created before the counters existed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+            help='Only report the drift, leave the counters as they are')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if not options['dry_run']:
+                # listing writers wait until the counters are rewritten instead
+                # of updating rows that are about to be replaced
+                with connection.cursor() as cursor:
+                    cursor.execute("LOCK TABLE %s IN EXCLUSIVE MODE" % connection.ops.quote_name(
+                        ListingCounter._meta.db_table))
+            expected = stats.compute()
+            current = stats.stored()
+            drifted = sorted(key for key in expected.keys() | current.keys()
+                if expected.get(key, [0, 0]) != current.get(key, [0, 0]))
+            for org_id, listing_type, trait in drifted:
+                key = (org_id, listing_type, trait)
+                self.stdout.write("org %d %s %s: stored %d active / %d inactive, counted %d / %d" % (
+                    org_id,
+                    ListingType(listing_type).label,
+                    "all traits" if trait == stats.TOTAL else "trait " + TraitType(trait).label,
+                    *current.get(key, [0, 0]),
+                    *expected.get(key, [0, 0])))
+            if not options['dry_run'] and drifted:
+                ListingCounter.objects.all().delete()
+                ListingCounter.objects.bulk_create([
+                    ListingCounter(organization_id=org_id, listing_type=listing_type, trait=trait,
+                        active=active, inactive=inactive)
+                    for (org_id, listing_type, trait), (active, inactive) in sorted(expected.items())
+                ], batch_size=1000)
+        self.stdout.write("%d of %d counters drifted%s" % (
+            len(drifted), len(expected), " (dry run)" if options['dry_run'] else ""))
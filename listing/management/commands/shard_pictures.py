@@ -0,0 +1,79 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from listing.blobs import picture_storage
+from listing.models import Donation, PictureBlob
+from listing.thumbnails import sizes, thumbnail_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Move content-addressed donation pictures from the flat donations/ "
+        "directory to the sharded donations/ab/cd/ layout, in batches of "
+        "donations. Each picture is copied, then the donations using it are "
+        "updated, then the old file is deleted, so the command can be "
+        "stopped at any point and run again. --after resumes past the last "
+        "donation_id it printed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--after', type=int, default=0,
+            help="Only look at donations with a larger donation_id")
+
+    def handle(self, *args, **options):
+        storage = picture_storage()
+        batch_size = options['batch_size']
+        last_id = options['after']
+        moved = 0
+        while True:
+            batch = list(
+                Donation.objects.filter(donation_id__gt=last_id)
+                .order_by('donation_id')
+                .values_list('donation_id', 'picture')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            names = {name for _, name in batch if name and storage.is_content_name(name)}
+            for name in sorted(names):
+                new_name = storage.sharded_name(name)
+                if new_name != name:
+                    self.move(storage, name, new_name)
+                    moved += 1
+            self.stdout.write("Done up to donation_id %d" % last_id)
+
+        self.stdout.write("Moved %d pictures" % moved)
+
+    def move(self, storage, name, new_name):
+        # copy first: if the command stops before the update the donations
+        # still point at a file that exists
+        self.copy(storage, name, new_name)
+        for label in sizes():
+            old = thumbnail_name(name, label)
+            if storage.exists(old):
+                self.copy(storage, old, thumbnail_name(new_name, label))
+
+        with transaction.atomic():
+            # every donation using the picture, not just the ones in this batch
+            Donation.objects.filter(picture=name).update(picture=new_name)
+            blob = PictureBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None:
+                # the same picture may have been uploaded again since the layout changed
+                merged = PictureBlob.objects.filter(name=new_name).update(refcount=F('refcount') + blob.refcount)
+                if merged:
+                    blob.delete()
+                else:
+                    PictureBlob.objects.filter(name=name).update(name=new_name)
+
+        storage.delete(name)
+        for label in sizes():
+            storage.delete(thumbnail_name(name, label))
+
+    @staticmethod
+    def copy(storage, name, new_name):
+        if storage.exists(new_name) or not storage.exists(name):
+            return
+        with storage.open(name, 'rb') as source:
+            storage.replace(new_name, File(source, new_name))
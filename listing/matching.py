@@ -0,0 +1,175 @@
+"""
+Request to donation matching.
+
+A donation is a candidate for a request when both are active, the donation
+has not expired, they share at least one trait and, when both organizations
+have a location, they are at most LISTING_MATCH_RADIUS_KM apart.
+MatchCandidate keeps the best LISTING_MATCH_CANDIDATES of them per request,
+in the order /api/listing/requests/<id>/matches/ returns them.
+
+The table is maintained from the listing signals. Pairing runs once the
+writing transaction commits: the listing writes end holding the change feed
+lock (see listing.changes), and pairing must not hold up every other write.
+A located listing is only paired with the listings of the organizations
+around it (organizations_near, on the geohash index) and of the ones without
+a location. A new request gets its best donations from one query, a new
+donation is paired with the matching requests nearby and those requests are
+trimmed back to their best candidates. A deactivated donation loses its rows
+in the writing transaction and the requests it was a candidate of are
+refilled after the commit. The rebuild_matches command recomputes the table
+from scratch, and repairs it after a pairing that failed: by then the
+listing is committed, so the failure is logged rather than raised to the
+client.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, IntegerField, Q, Value, When
+from django.dispatch import receiver
+from django.utils import timezone
+
+from identity.models import Organization, organizations_near
+from listing.models import Donation, MatchCandidate, Request, active_filter, masks_matching
+from listing.signals import listings_created, listings_deactivated
+
+logger = logging.getLogger(__name__)
+
+# best first, the order of the matches endpoint
+CANDIDATE_ORDERING = (
+    '-trait_overlap',
+    F('donation__expiration_date').asc(nulls_last=True),
+    F('distance_km').asc(nulls_last=True),
+    'donation_id',
+)
+
+def unexpired_filter(now):
+    return Q(expiration_date__isnull=True) | Q(expiration_date__gt=now)
+
+def shared_traits(mask, other_mask):
+    return bin(mask & other_mask).count('1')
+
+def union_mask(masks):
+    mask = 0
+    for listing_mask in masks:
+        mask |= listing_mask
+    return mask
+
+def nearby(org_id):
+    """
+    Filter on the organization of the listings that can match a listing of
+    org_id, and their {organization id: distance in km}. Listings of
+    organizations without a location match any distance
+    """
+    location = Organization.objects.filter(id=org_id).values_list('latitude', 'longitude').first()
+    if location is None or None in location:
+        return Q(), {}
+    distances = dict(organizations_near(*location, settings.LISTING_MATCH_RADIUS_KM))
+    unlocated = Q(organization__latitude__isnull=True) | Q(organization__longitude__isnull=True)
+    return Q(organization_id__in=list(distances)) | unlocated, distances
+
+def trim(request_ids):
+    """
+    Delete the candidates of the requests beyond their best LISTING_MATCH_CANDIDATES
+    """
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM {candidates} WHERE id IN ("
+            " SELECT id FROM ("
+            "  SELECT c.id, row_number() OVER (PARTITION BY c.request_id ORDER BY c.trait_overlap DESC,"
+            "   d.expiration_date ASC NULLS LAST, c.distance_km ASC NULLS LAST, c.donation_id) AS position"
+            "  FROM {candidates} c JOIN {donations} d ON d.donation_id = c.donation_id"
+            "  WHERE c.request_id = ANY(%s)"
+            " ) ranked WHERE position > %s)".format(
+                candidates=qn(MatchCandidate._meta.db_table), donations=qn(Donation._meta.db_table)),
+            [sorted(request_ids), settings.LISTING_MATCH_CANDIDATES])
+
+def save(candidates):
+    if not candidates:
+        return
+    with transaction.atomic():
+        MatchCandidate.objects.bulk_create(candidates, batch_size=1000, ignore_conflicts=True)
+        trim({candidate.request_id for candidate in candidates})
+
+def match_requests(request_ids):
+    """
+    Store the best candidates of the active requests, one query each
+    """
+    now = datetime.now(tz=timezone.utc)
+    requests = (Request.objects.filter(active_filter(now), request_id__in=request_ids, trait_mask__gt=0)
+        .values_list('request_id', 'organization_id', 'trait_mask'))
+    candidates = []
+    for request_id, org_id, request_mask in requests:
+        near, distances = nearby(org_id)
+        masks = masks_matching(request_mask)
+        # unlocated requests have no distance to order by
+        distance = (Case(*[When(organization_id=org, then=Value(km)) for org, km in distances.items()],
+            default=None, output_field=FloatField()) if distances else Value(None, output_field=FloatField()))
+        donations = (Donation.objects.filter(active_filter(now), unexpired_filter(now), near, trait_mask__in=masks)
+            .annotate(
+                overlap=Case(*[When(trait_mask=mask, then=Value(shared_traits(mask, request_mask))) for mask in masks],
+                    output_field=IntegerField()),
+                distance=distance)
+            .order_by('-overlap', F('expiration_date').asc(nulls_last=True),
+                *([F('distance').asc(nulls_last=True)] if distances else []), 'donation_id')
+            .values_list('donation_id', 'overlap', 'distance')[:settings.LISTING_MATCH_CANDIDATES])
+        candidates.extend(
+            MatchCandidate(request_id=request_id, donation_id=donation_id, trait_overlap=overlap, distance_km=distance)
+            for donation_id, overlap, distance in donations)
+    save(candidates)
+
+def match_donations(donation_ids):
+    """
+    Pair the active, unexpired donations with the matching requests nearby
+    """
+    now = datetime.now(tz=timezone.utc)
+    by_org = defaultdict(list)
+    for donation_id, org_id, mask in (
+            Donation.objects.filter(active_filter(now), unexpired_filter(now), donation_id__in=donation_ids,
+                trait_mask__gt=0).values_list('donation_id', 'organization_id', 'trait_mask')):
+        by_org[org_id].append((donation_id, mask))
+    candidates = []
+    for org_id, donations in by_org.items():
+        near, distances = nearby(org_id)
+        requests = (Request.objects.filter(active_filter(now), near,
+                trait_mask__in=masks_matching(union_mask(mask for _, mask in donations)))
+            .values_list('request_id', 'organization_id', 'trait_mask'))
+        for request_id, request_org, request_mask in requests:
+            for donation_id, donation_mask in donations:
+                overlap = shared_traits(request_mask, donation_mask)
+                if overlap:
+                    candidates.append(MatchCandidate(request_id=request_id, donation_id=donation_id,
+                        trait_overlap=overlap, distance_km=distances.get(request_org)))
+    save(candidates)
+
+def match_on_commit(match, ids):
+    def run():
+        try:
+            match(ids)
+        except Exception:
+            logger.exception("%s(%s) failed, run rebuild_matches to repair the match candidates",
+                match.__name__, sorted(ids))
+    transaction.on_commit(run)
+
+@receiver(listings_created)
+def add_candidates(sender, listings, **kwargs):
+    ids = [listing.pk for listing in listings if listing.trait_mask]
+    if not ids:
+        return
+    match_on_commit(match_donations if sender is Donation else match_requests, ids)
+
+@receiver(listings_deactivated)
+def remove_candidates(sender, listings, **kwargs):
+    ids = [listing.pk for listing in listings]
+    if sender is Request:
+        MatchCandidate.objects.filter(request_id__in=ids).delete()
+        return
+    candidates = MatchCandidate.objects.filter(donation_id__in=ids)
+    request_ids = set(candidates.values_list('request_id', flat=True))
+    candidates.delete()
+    if request_ids:
+        # let the next best donations take the freed places
+        match_on_commit(match_requests, request_ids)
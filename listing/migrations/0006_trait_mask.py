@@ -0,0 +1,49 @@
+# Generated by Django 3.2.7 on 2026-10-18 12:39
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_trait_mask(apps, schema_editor):
+    # one set-based UPDATE per trait type instead of touching listings one by one
+    Donation = apps.get_model('listing', 'Donation')
+    Request = apps.get_model('listing', 'Request')
+    DonationTraits = apps.get_model('listing', 'DonationTraits')
+    RequestTraits = apps.get_model('listing', 'RequestTraits')
+    for trait in DonationTraits.objects.values_list('trait', flat=True).distinct():
+        Donation.objects.filter(
+            donation_id__in=DonationTraits.objects.filter(trait=trait).values('donation_id')
+        ).update(trait_mask=F('trait_mask').bitor(1 << trait))
+    for trait in RequestTraits.objects.values_list('trait', flat=True).distinct():
+        Request.objects.filter(
+            request_id__in=RequestTraits.objects.filter(trait=trait).values('request_id')
+        ).update(trait_mask=F('trait_mask').bitor(1 << trait))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0005_request_requesttraits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donation',
+            name='trait_mask',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='request',
+            name='trait_mask',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='donation',
+            index=models.Index(fields=['trait_mask', 'creation_time', 'donation_id'], name='donation_trait_mask_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['trait_mask', 'creation_time', 'request_id'], name='request_trait_mask_idx'),
+        ),
+        migrations.RunPython(backfill_trait_mask, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.7 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0006_trait_mask'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='donation',
+            index=models.Index(condition=models.Q(('deactivation_time__isnull', True)), fields=['creation_time', 'donation_id'], name='donation_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='donation',
+            index=models.Index(condition=models.Q(('deactivation_time__isnull', True)), fields=['organization', 'creation_time', 'donation_id'], name='donation_active_org_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='donation',
+            index=models.Index(condition=models.Q(('deactivation_time__isnull', False)), fields=['deactivation_time'], name='donation_deactivated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('deactivation_time__isnull', True)), fields=['creation_time', 'request_id'], name='request_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('deactivation_time__isnull', True)), fields=['organization', 'creation_time', 'request_id'], name='request_active_org_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('deactivation_time__isnull', False)), fields=['deactivation_time'], name='request_deactivated_idx'),
+        ),
+    ]
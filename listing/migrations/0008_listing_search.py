@@ -0,0 +1,55 @@
+# Generated by Django 3.2.7 on 2026-10-18 12:48
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# keep search_vector in sync with description on every insert or update,
+# including bulk_create and queryset.update()
+TRIGGER_SQL = """
+CREATE TRIGGER {table}_search_vector_update
+BEFORE INSERT OR UPDATE OF description ON {table}
+FOR EACH ROW EXECUTE PROCEDURE
+tsvector_update_trigger(search_vector, 'pg_catalog.english', description);
+UPDATE {table} SET search_vector = to_tsvector('pg_catalog.english', description);
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS {table}_search_vector_update ON {table};
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0007_active_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donation',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='request',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='donation',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='donation_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='request_search_idx'),
+        ),
+        migrations.RunSQL(
+            TRIGGER_SQL.format(table='listing_donation'),
+            DROP_TRIGGER_SQL.format(table='listing_donation'),
+        ),
+        migrations.RunSQL(
+            TRIGGER_SQL.format(table='listing_request'),
+            DROP_TRIGGER_SQL.format(table='listing_request'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 12:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0008_listing_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donation',
+            name='thumbnails_ready',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.7 on 2026-10-18 12:56
+
+from django.db import migrations, models
+import listing.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0009_donation_thumbnails_ready'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PictureBlob',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='donation',
+            name='picture',
+            field=models.ImageField(storage=listing.storage.ContentAddressedStorage(), upload_to='donations/'),
+        ),
+    ]
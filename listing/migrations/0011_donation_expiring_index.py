@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-18 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0010_picture_blobs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='donation',
+            index=models.Index(condition=models.Q(('deactivation_time__isnull', True), ('expiration_date__isnull', False)), fields=['expiration_date'], name='donation_expiring_idx'),
+        ),
+    ]
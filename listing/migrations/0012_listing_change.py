@@ -0,0 +1,24 @@
+# Generated by Django 3.2.7 on 2026-10-18 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0011_donation_expiring_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('listing_type', models.IntegerField(choices=[(0, 'donation'), (1, 'request')])),
+                ('listing_id', models.BigIntegerField()),
+                ('organization_id', models.BigIntegerField()),
+                ('action', models.IntegerField(choices=[(0, 'created'), (1, 'deactivated')])),
+                ('time', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0012_listing_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listingchange',
+            name='trait_mask',
+            field=models.IntegerField(default=0),
+        ),
+    ]
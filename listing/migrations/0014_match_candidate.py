@@ -0,0 +1,28 @@
+# Generated by Django 3.2.7 on 2026-10-18 13:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0013_listing_change_trait_mask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trait_overlap', models.IntegerField()),
+                ('distance_km', models.FloatField(null=True)),
+                ('donation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='listing.donation')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='listing.request')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='matchcandidate',
+            constraint=models.UniqueConstraint(fields=('request', 'donation'), name='match_candidate_unique'),
+        ),
+    ]
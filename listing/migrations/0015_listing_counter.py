@@ -0,0 +1,44 @@
+# Generated by Django 3.2.7 on 2026-10-18 13:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_counters(apps, schema_editor):
+    """
+    Count the listings created before the counters, from then on the listing
+    signals keep them up to date
+    """
+    from listing import stats
+    from listing.models import ListingType
+    stats.apply(stats.compute({
+        apps.get_model('listing', 'Donation'): ListingType.DONATION,
+        apps.get_model('listing', 'Request'): ListingType.REQUEST,
+    }))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('identity', '0006_organization_location'),
+        ('listing', '0014_match_candidate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing_type', models.IntegerField(choices=[(0, 'donation'), (1, 'request')])),
+                ('trait', models.IntegerField()),
+                ('active', models.BigIntegerField(default=0)),
+                ('inactive', models.BigIntegerField(default=0)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='identity.organization')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='listingcounter',
+            constraint=models.UniqueConstraint(fields=('organization', 'listing_type', 'trait'), name='listing_counter_unique'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
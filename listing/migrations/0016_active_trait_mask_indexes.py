@@ -0,0 +1,29 @@
+# Generated by Django 3.2.7 on 2026-10-18 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0015_listing_counter'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='donation',
+            name='donation_trait_mask_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='request',
+            name='request_trait_mask_idx',
+        ),
+        migrations.AddIndex(
+            model_name='donation',
+            index=models.Index(condition=models.Q(('deactivation_time__isnull', True)), fields=['trait_mask', 'creation_time', 'donation_id'], name='donation_trait_mask_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('deactivation_time__isnull', True)), fields=['trait_mask', 'creation_time', 'request_id'], name='request_trait_mask_idx'),
+        ),
+    ]
@@ -1,19 +1,104 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from identity.models import Organization
+from listing.storage import ContentAddressedStorage
 from django.utils.translation import gettext_lazy as _
 
 class TraitType(models.IntegerChoices):
     CANS = 0,_('is_cans')# one user should have only one pending application
     PERISHABLE = 1,_('is_perishable')
 
+# text search configuration of the search_vector triggers (migration 0008),
+# queries must use the same one
+SEARCH_CONFIG = 'english'
+
+def trait_mask(traits):
+    """
+    Pack a list of TraitType values into the bitmask stored on listings
+    """
+    mask = 0
+    for trait in traits:
+        mask |= 1 << int(trait)
+    return mask
+
+def mask_traits(mask):
+    """
+    The TraitType values packed in a trait_mask
+    """
+    return [trait for trait in TraitType.values if mask & (1 << trait)]
+
+def masks_matching(mask, match_all=False):
+    """
+    Every stored trait_mask value that has all (or any) of the bits in mask.
+    There are only 2^len(TraitType) possible masks, so the trait filter can be
+    a plain IN on the indexed column instead of a bitwise expression
+    """
+    all_masks = range(1 << len(TraitType.values))
+    if match_all:
+        return [m for m in all_masks if m & mask == mask]
+    return [m for m in all_masks if m & mask]
+
+def active_filter(now):
+    """
+    Listings that are not deactivated at now. Spelled out as IS NULL OR > now
+    rather than NOT <= now so each branch lines up with one of the partial
+    indexes without relying on the planner to rewrite the negation
+    """
+    return models.Q(deactivation_time__isnull=True) | models.Q(deactivation_time__gt=now)
+
+def inactive_filter(now):
+    return models.Q(deactivation_time__lte=now)
+
+def expired_filter(now):
+    """
+    Donations past their expiration_date that are not deactivated yet. The
+    expire_donations command deactivates them, so the listing queries only
+    need to look at deactivation_time
+    """
+    return models.Q(deactivation_time__isnull=True, expiration_date__lte=now)
+
 class Donation(models.Model):
     donation_id = models.BigAutoField(primary_key=True)
     organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
     description = models.TextField()
-    picture = models.ImageField(upload_to='donations/', blank=False)
+    picture = models.ImageField(upload_to='donations/', storage=ContentAddressedStorage(), blank=False)
+    # set once the thumbnails of picture are written, see listing.thumbnails
+    thumbnails_ready = models.BooleanField(default=False)
     expiration_date = models.DateTimeField(null=True, blank=True, default=None)
     creation_time = models.DateTimeField(auto_now_add=True)
     deactivation_time = models.DateTimeField(null=True, blank=True, default=None)
+    # denormalized copy of the DonationTraits rows, see trait_mask()
+    trait_mask = models.IntegerField(default=0)
+    # maintained by a database trigger from description, see migration 0008
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # partial indexes for the "active" listing queries, see active_filter()
+            models.Index(fields=['trait_mask', 'creation_time', 'donation_id'],
+                condition=models.Q(deactivation_time__isnull=True), name='donation_trait_mask_idx'),
+            models.Index(fields=['creation_time', 'donation_id'],
+                condition=models.Q(deactivation_time__isnull=True), name='donation_active_idx'),
+            models.Index(fields=['organization', 'creation_time', 'donation_id'],
+                condition=models.Q(deactivation_time__isnull=True), name='donation_active_org_idx'),
+            models.Index(fields=['deactivation_time'],
+                condition=models.Q(deactivation_time__isnull=False), name='donation_deactivated_idx'),
+            # only the rows the expiration sweeper still has to look at, see expire_donations
+            models.Index(fields=['expiration_date'],
+                condition=models.Q(deactivation_time__isnull=True, expiration_date__isnull=False),
+                name='donation_expiring_idx'),
+            GinIndex(fields=['search_vector'], name='donation_search_idx'),
+        ]
+
+class PictureBlob(models.Model):
+    """
+    One stored picture file and the number of donations that use it, see
+    listing.blobs. Pictures stored before content addressing have no row
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
 
 class DonationTraits(models.Model):
     trait = models.IntegerField(
@@ -27,6 +112,24 @@ class Request(models.Model):
     description = models.TextField()
     creation_time = models.DateTimeField(auto_now_add=True)
     deactivation_time = models.DateTimeField(null=True, blank=True, default=None)
+    # denormalized copy of the RequestTraits rows, see trait_mask()
+    trait_mask = models.IntegerField(default=0)
+    # maintained by a database trigger from description, see migration 0008
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # partial indexes for the "active" listing queries, see active_filter()
+            models.Index(fields=['trait_mask', 'creation_time', 'request_id'],
+                condition=models.Q(deactivation_time__isnull=True), name='request_trait_mask_idx'),
+            models.Index(fields=['creation_time', 'request_id'],
+                condition=models.Q(deactivation_time__isnull=True), name='request_active_idx'),
+            models.Index(fields=['organization', 'creation_time', 'request_id'],
+                condition=models.Q(deactivation_time__isnull=True), name='request_active_org_idx'),
+            models.Index(fields=['deactivation_time'],
+                condition=models.Q(deactivation_time__isnull=False), name='request_deactivated_idx'),
+            GinIndex(fields=['search_vector'], name='request_search_idx'),
+        ]
 
 class RequestTraits(models.Model):
     trait = models.IntegerField(
@@ -34,3 +137,61 @@ class RequestTraits(models.Model):
         blank=False)
     request = models.ForeignKey('Request', on_delete=models.CASCADE)
 
+class ListingType(models.IntegerChoices):
+    DONATION = 0,_('donation')
+    REQUEST = 1,_('request')
+
+class ChangeAction(models.IntegerChoices):
+    CREATED = 0,_('created')
+    DEACTIVATED = 1,_('deactivated')
+
+class ListingChange(models.Model):
+    """
+    One row per listing created or deactivated, numbered by seq in commit
+    order, see listing.changes. Clients sync through /api/listing/changes/
+    """
+    seq = models.BigAutoField(primary_key=True)
+    listing_type = models.IntegerField(choices=ListingType.choices)
+    listing_id = models.BigIntegerField()
+    # kept as a plain value, the row outlives the listing if it is hard deleted
+    organization_id = models.BigIntegerField()
+    action = models.IntegerField(choices=ChangeAction.choices)
+    time = models.DateTimeField()
+    # the listing's trait_mask, so subscribers can filter on traits without a join
+    trait_mask = models.IntegerField(default=0)
+
+class MatchCandidate(models.Model):
+    """
+    A donation that could fill an active request, kept up to date as
+    listings are created and deactivated, see listing.matching
+    """
+    request = models.ForeignKey('Request', on_delete=models.CASCADE)
+    donation = models.ForeignKey('Donation', on_delete=models.CASCADE)
+    # number of traits the request asks for that the donation has
+    trait_overlap = models.IntegerField()
+    # between the two organizations, None when either has no location
+    distance_km = models.FloatField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['request', 'donation'], name='match_candidate_unique'),
+        ]
+
+class ListingCounter(models.Model):
+    """
+    Active and inactive listings of one organization, listing type and trait
+    (TOTAL: all of them, whatever their traits), kept up to date as listings
+    are created and deactivated, see listing.stats
+    """
+    TOTAL = -1
+
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
+    listing_type = models.IntegerField(choices=ListingType.choices)
+    trait = models.IntegerField()
+    active = models.BigIntegerField(default=0)
+    inactive = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['organization', 'listing_type', 'trait'], name='listing_counter_unique'),
+        ]
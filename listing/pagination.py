@@ -0,0 +1,172 @@
+import json
+import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a fixed, unique ordering such as
+    (creation_time, donation_id). A page is fetched with a WHERE on the
+    position of the last row seen instead of an OFFSET, so every page costs
+    the same no matter how deep it is, and rows inserted while a client is
+    paging never shift the pages it has not read yet.
+    """
+    page_size = getattr(settings, 'LISTING_PAGE_SIZE', 100)
+    max_page_size = getattr(settings, 'LISTING_MAX_PAGE_SIZE', 1000)
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    invalid_page_size_message = 'Invalid page_size parameter value'
+
+    def __init__(self, ordering):
+        # ordering is a list of field names, the last one must be unique
+        self.ordering = tuple(ordering)
+        self.next_cursor = None
+        self.prev_cursor = None
+
+    @classmethod
+    def is_requested(cls, request):
+        """
+        Pagination is opt-in so clients reading the full list keep working
+        """
+        params = request.query_params
+        return cls.cursor_query_param in params or cls.page_size_query_param in params
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param, None)
+        if value is None:
+            return self.page_size
+        try:
+            page_size = int(value)
+        except ValueError:
+            raise ValidationError(self.invalid_page_size_message)
+        if page_size <= 0:
+            raise ValidationError(self.invalid_page_size_message)
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, row, reverse):
+        position = []
+        for field in self.ordering:
+            # model instances, or values() dicts
+            name = field.lstrip('-')
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            position.append(value)
+        raw = json.dumps({'p': position, 'r': reverse}, separators=(',', ':'))
+        return urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    @staticmethod
+    def ordering_field(queryset, name):
+        """
+        The model field or annotation output field an ordering name sorts on
+        """
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    @staticmethod
+    def position_value(field, value):
+        """
+        The cursor value as a value of the ordering field, None if it is not one
+        """
+        if isinstance(field, models.DateTimeField):
+            if not isinstance(value, str):
+                return None
+            try:
+                return parse_datetime(value)
+            except ValueError:
+                return None
+        # bool is an int, but never a position
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        if isinstance(field, models.IntegerField):
+            return value if isinstance(value, int) else None
+        if isinstance(field, models.FloatField):
+            return float(value) if math.isfinite(value) else None
+        return None
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param, None)
+        if encoded is None:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            position = cursor['p']
+            reverse = bool(cursor['r'])
+        except (BinasciiError, UnicodeEncodeError, ValueError, KeyError, TypeError):
+            raise ValidationError(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise ValidationError(self.invalid_cursor_message)
+
+        values = []
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            value = self.position_value(self.ordering_field(queryset, name), value)
+            if value is None:
+                raise ValidationError(self.invalid_cursor_message)
+            values.append((name, field.startswith('-'), value))
+        return values, reverse
+
+    @staticmethod
+    def position_filter(values, reverse):
+        """
+        Build a >= x AND ((a > x) OR (a = x AND b > y) ...) for the keyset
+        position. The OR alone gives the planner no range to start an index
+        scan at, it would filter or sort its way past every earlier row; the
+        redundant bound on the leading column does, so deep pages stay index
+        range scans
+        """
+        condition = Q()
+        for i, (name, descending, value) in enumerate(values):
+            lookup = 'lt' if descending != reverse else 'gt'
+            term = Q(**{name + '__' + lookup: value})
+            for prev_name, _, prev_value in values[:i]:
+                term &= Q(**{prev_name: prev_value})
+            condition |= term
+        name, descending, value = values[0]
+        bound = Q(**{name + ('__lte' if descending != reverse else '__gte'): value})
+        return bound & condition
+
+    def order_queryset(self, queryset, reverse=False):
+        if not reverse:
+            return queryset.order_by(*self.ordering)
+        flipped = [f[1:] if f.startswith('-') else '-' + f for f in self.ordering]
+        return queryset.order_by(*flipped)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request, queryset)
+        if values is not None:
+            queryset = queryset.filter(self.position_filter(values, reverse))
+
+        # fetch one extra row to know if there is another page in this direction
+        rows = list(self.order_queryset(queryset, reverse)[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        self.next_cursor = None
+        self.prev_cursor = None
+        if rows:
+            if has_more or reverse:
+                self.next_cursor = self.encode_cursor(rows[-1], False)
+            if (has_more and reverse) or (values is not None and not reverse):
+                self.prev_cursor = self.encode_cursor(rows[0], True)
+        return rows
+
+    def get_paginated_data(self, key, data):
+        return {
+            key: data,
+            'next': self.next_cursor,
+            'prev': self.prev_cursor,
+        }
@@ -0,0 +1,52 @@
+"""
+Columnar representation of the listing lists, ?format=columnar on
+/api/listing/donations/ and /api/listing/requests/.
+
+Instead of one object per listing, the list becomes one array per field,
+so key names are written once per response instead of once per row:
+
+    {"donations": {
+        "count": 2,
+        "columns": {"donation_id": [4, 7], "organization_id": [0, 0], "traits": [0, 1], ...},
+        "dictionaries": {"organization_id": [12], "traits": [[0], [0, 1]]}},
+     "next": ..., "prev": ...}
+
+organization_id and traits repeat few distinct values, so they are
+dictionary encoded: their columns hold indexes into "dictionaries". The
+views still build (and cache) the row representation, it is transposed here
+at render time; fields= applies as usual.
+"""
+from rest_framework.renderers import JSONRenderer
+
+DICTIONARY_FIELDS = ('organization_id', 'traits')
+
+def columns(rows):
+    fields = list(rows[0]) if rows else []
+    columns = {field: [row[field] for row in rows] for field in fields}
+    dictionaries = {}
+    for field in DICTIONARY_FIELDS:
+        if field not in columns:
+            continue
+        codes = {}
+        values = []
+        column = []
+        for value in columns[field]:
+            key = tuple(value) if isinstance(value, list) else value
+            code = codes.get(key)
+            if code is None:
+                code = codes[key] = len(values)
+                values.append(value)
+            column.append(code)
+        columns[field] = column
+        dictionaries[field] = values
+    return {"count": len(rows), "columns": columns, "dictionaries": dictionaries}
+
+class ColumnarRenderer(JSONRenderer):
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        key = getattr((renderer_context or {}).get('view'), 'listing_key', None)
+        # error bodies are rendered as they are
+        if isinstance(data, dict) and isinstance(data.get(key), list):
+            data = {**data, key: columns(data[key])}
+        return super().render(data, accepted_media_type, renderer_context)
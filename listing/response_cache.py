@@ -0,0 +1,99 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import receiver
+
+from listing.models import Donation, Request
+from listing.signals import listings_created, listings_deactivated
+
+CACHE_PREFIX = 'listing:response'
+HITS_KEY = CACHE_PREFIX + ':hits'
+MISSES_KEY = CACHE_PREFIX + ':misses'
+
+ENDPOINTS = {
+    Donation: 'donations',
+    Request: 'requests',
+}
+
+def timeout():
+    return getattr(settings, 'LISTING_CACHE_TIMEOUT', 300)
+
+def generation_key(endpoint, org_id):
+    return "%s:%s:%s:generation" % (CACHE_PREFIX, endpoint, org_id)
+
+def incr(key):
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # evicted between add and incr
+        cache.set(key, 1, timeout=None)
+        return 1
+
+def response_key(endpoint, request):
+    """
+    Cached responses are keyed by endpoint, org_id and status plus a hash of
+    the rest of the query string (pagination, traits, ...) and the accepted
+    media type. The org's generation number is part of the key, so bumping
+    it drops every cached response for that org at once
+    """
+    params = request.query_params
+    org_id = params.get('org_id', 'all')
+    try:
+        # the view takes org_id=01 or org_id=+1 for org 1, and so must the
+        # generation, invalidate() only knows the org's id
+        org_id = str(int(org_id))
+    except ValueError:
+        # not an org id, the view rejects it and nothing is stored
+        pass
+    listing_status = params.get('status', 'any')
+    generation = cache.get(generation_key(endpoint, org_id), 0)
+    # the ETag differs between renderers, see ListingView.get_validators
+    query = md5((request.get_full_path() + "|" + request.accepted_media_type).encode('utf-8')).hexdigest()
+    return "%s:%s:%s:%s:%s:%s" % (CACHE_PREFIX, endpoint, org_id, listing_status, generation, query)
+
+def lookup(endpoint, request):
+    """
+    Return the cache key of this request and its cached (etag, data, status),
+    if any. A miss stores its response under that key: taken
+    before the rows are read, it holds the generation those rows belong to,
+    so an invalidation that happens meanwhile is not overwritten with them
+    """
+    key = response_key(endpoint, request)
+    entry = cache.get(key)
+    incr(HITS_KEY if entry is not None else MISSES_KEY)
+    return key, entry
+
+def store(key, etag, data, status_code):
+    cache.set(key, (etag, data, status_code), timeout())
+
+def invalidate(endpoint, org_ids):
+    """
+    Drop the cached responses of the given orgs and of the unfiltered listing
+    """
+    for org_id in set(str(org_id) for org_id in org_ids) | {'all'}:
+        incr(generation_key(endpoint, org_id))
+
+def stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / total if total else None,
+    }
+
+@receiver(listings_created)
+@receiver(listings_deactivated)
+def invalidate_listings(sender, listings, **kwargs):
+    endpoint = ENDPOINTS.get(sender)
+    if endpoint is None:
+        return
+    org_ids = [listing.organization_id for listing in listings]
+    # invalidate right away, and again once the write is visible, so a read
+    # racing the transaction cannot cache the old rows for the full timeout
+    invalidate(endpoint, org_ids)
+    transaction.on_commit(lambda: invalidate(endpoint, org_ids))
@@ -1,12 +1,118 @@
 from datetime import datetime
+from django.db import connection, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.manager import BaseManager
 from django.utils import timezone
 from rest_framework import serializers
 
 from identity.models import Organization
-from listing.models import TraitType, Donation, DonationTraits, Request, RequestTraits
+from listing.models import TraitType, Donation, DonationTraits, Request, RequestTraits, active_filter, trait_mask
+from listing.images import normalize_picture
+from listing.signals import listings_created, listings_deactivated
+from listing.thumbnails import thumbnail_urls
+
+def soft_delete_listings(queryset, limit=None):
+    """
+    Deactivate every still active listing in queryset (at most limit of them)
+    with a single UPDATE ... RETURNING and return how many rows changed. The
+    returned rows are handed to the listings_deactivated receivers
+    """
+    model = queryset.model
+    now = datetime.now(tz=timezone.utc)
+    qn = connection.ops.quote_name
+    pk_column = model._meta.pk.column
+    # from_db() takes the values in model field order
+    returned_fields = [field for field in model._meta.concrete_fields
+        if field.attname in (model._meta.pk.attname, 'organization_id', 'deactivation_time', 'trait_mask')]
+    queryset = queryset.filter(active_filter(now)).values('pk')
+    if limit is not None:
+        queryset = queryset[:limit]
+    subquery, params = queryset.query.sql_with_params()
+    # the active check is repeated on the updated row itself: a concurrent
+    # deactivation of the same rows makes this UPDATE wait on the row lock,
+    # and after the wait Postgres rechecks this condition (not the subquery)
+    # against the committed row, so the row is not deactivated twice
+    sql = "UPDATE %s SET %s = %%s WHERE %s IN (%s) AND (%s IS NULL OR %s > %%s) RETURNING %s" % (
+        qn(model._meta.db_table),
+        qn('deactivation_time'),
+        qn(pk_column),
+        subquery,
+        qn('deactivation_time'),
+        qn('deactivation_time'),
+        ", ".join(qn(field.column) for field in returned_fields),
+    )
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [now] + list(params) + [now])
+            rows = cursor.fetchall()
+        field_names = [field.attname for field in returned_fields]
+        listings = [model.from_db(connection.alias, field_names, row) for row in rows]
+        if listings:
+            listings_deactivated.send(sender=model, listings=listings)
+    return len(listings)
+
+class OrganizationField(serializers.PrimaryKeyRelatedField):
+    """
+    org_id field that uses the organizations preloaded by
+    ListingListSerializer instead of running one query per item
+    """
+    def to_internal_value(self, data):
+        organizations = self.context.get('organizations', None)
+        if organizations is not None:
+            try:
+                return organizations[int(data)]
+            except (KeyError, ValueError, TypeError):
+                pass
+        return super().to_internal_value(data)
+
+class ListingListSerializer(serializers.ListSerializer):
+    """
+    many=True serializer for listings. Loads the traits of every row on the
+    page with a single prefetch query before the rows are represented, so
+    the number of queries does not grow with the number of rows
+    """
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, BaseManager) else data
+        listings = list(iterable)
+        if self.child.wants('traits'):
+            trait_prefetch = Prefetch(
+                self.child.trait_related_name,
+                queryset=self.child.trait_model.objects.order_by('id'))
+            prefetch_related_objects(listings, trait_prefetch)
+        return [self.child.to_representation(item) for item in listings]
+
+    def to_internal_value(self, data):
+        # load the organizations of every item with one query
+        if isinstance(data, list):
+            org_ids = set()
+            for item in data:
+                try:
+                    org_ids.add(int(item.get('org_id')))
+                except (AttributeError, ValueError, TypeError):
+                    pass
+            self.context['organizations'] = Organization.objects.in_bulk(org_ids)
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        """
+        Insert every listing and all of their traits with one bulk INSERT each,
+        in a single transaction
+        """
+        child = self.child
+        with transaction.atomic():
+            listings = child.listing_model.objects.bulk_create(
+                [child.build_listing(item) for item in validated_data])
+            traits = []
+            for listing, item in zip(listings, validated_data):
+                # dict.fromkeys drops repeat trait entries and keeps the order
+                for trait in dict.fromkeys(item.get('traits', [])):
+                    traits.append(child.trait_model(**{child.trait_listing_field: listing, 'trait': trait}))
+            child.trait_model.objects.bulk_create(traits)
+            listings_created.send(sender=child.listing_model, listings=listings)
+        return listings
 
 class DonationSerializer(serializers.Serializer):
-    org_id = serializers.PrimaryKeyRelatedField(required=True, queryset=Organization.objects.all()) # required
+    org_id = OrganizationField(required=True, queryset=Organization.objects.all()) # required
     picture = serializers.ImageField(allow_empty_file=False, use_url=True) # required
     description = serializers.CharField()
     expiration_date = serializers.DateTimeField()
@@ -15,36 +121,77 @@ class DonationSerializer(serializers.Serializer):
         child=serializers.ChoiceField(choices=TraitType)
     )
 
+    listing_model = Donation
+    trait_model = DonationTraits
+    trait_listing_field = 'donation'
+    trait_related_name = 'donationtraits_set'
+    # representation key -> model fields it reads, for fields= (see ListingView)
+    representation_columns = {
+        'donation_id': ['donation_id'],
+        'description': ['description'],
+        'expiration_date': ['expiration_date'],
+        'organization_id': ['organization'],
+        'picture': ['picture'],
+        'thumbnails': ['picture', 'thumbnails_ready'],
+        'traits': [],
+    }
+
+    class Meta:
+        list_serializer_class = ListingListSerializer
+
+    def wants(self, key):
+        """
+        Whether key is part of the representation. The "fields" context entry
+        restricts it to a subset of representation_columns
+        """
+        fields = self.context.get('fields', None)
+        return fields is None or key in fields
+
     def soft_delete(self, instance):
         """
-        Update operation right now only support soft delete
+        Update operation right now only support soft delete. Goes through
+        soft_delete_listings, so the signal is sent in the same transaction
+        and a listing that is already inactive is left as it is
         """
-        instance.deactivation_time = datetime.now(tz=timezone.utc) # TODO: Could expend to take incoming value later
-        instance.save()
+        soft_delete_listings(type(instance).objects.filter(pk=instance.pk))
+        instance.refresh_from_db(fields=['deactivation_time'])
 
         return instance
 
-    def create(self, validated_data):
+    def build_listing(self, validated_data):
+        """
+        Unsaved donation for the validated data, shared with the bulk create
+        """
         org = validated_data.get('org_id', None)
         picture = validated_data.get('picture', None)
+        if picture is not None:
+            picture = normalize_picture(picture)
         description = validated_data.get('description', "")
         expiration_date = validated_data.get('expiration_date', None)
+        traits = validated_data.get('traits', [])
 
-        # create the donation listing
-        donation = Donation.objects.create(
+        return Donation(
             organization = org,
             picture = picture,
             description = description,
             expiration_date = expiration_date,
-            deactivation_time=None
+            deactivation_time=None,
+            trait_mask=trait_mask(traits)
         )
 
-        # add the traits
-        traits = validated_data.get('traits', [])
-        for trait in traits:
-            # do this so there are no repeat trait entries
-            DonationTraits.objects.get_or_create(donation=donation, trait=trait)
-        
+    def create(self, validated_data):
+        with transaction.atomic():
+            # create the donation listing
+            donation = self.build_listing(validated_data)
+            donation.save()
+
+            # add the traits
+            traits = validated_data.get('traits', [])
+            for trait in traits:
+                # do this so there are no repeat trait entries
+                DonationTraits.objects.get_or_create(donation=donation, trait=trait)
+
+            listings_created.send(sender=Donation, listings=[donation])
         return donation
 
     def save(self):
@@ -65,52 +212,97 @@ class DonationSerializer(serializers.Serializer):
         Take in a donation instance
         """
         rep = dict()
-        rep['donation_id'] = instance.donation_id
-        rep['description'] = instance.description
-        rep['expiration_date'] = instance.expiration_date
-        rep['organization_id'] = instance.organization.id
-        rep['picture'] = instance.picture.url
-        trait_list = []
-        traits = list(DonationTraits.objects.filter(donation=instance))
-        for trait in traits:
-            trait_list.append(trait.trait)
-        rep['traits'] = trait_list
+        if self.wants('donation_id'):
+            rep['donation_id'] = instance.donation_id
+        if self.wants('description'):
+            rep['description'] = instance.description
+        if self.wants('expiration_date'):
+            rep['expiration_date'] = instance.expiration_date
+        if self.wants('organization_id'):
+            rep['organization_id'] = instance.organization_id
+        if self.wants('picture'):
+            rep['picture'] = instance.picture.url
+        if self.wants('thumbnails'):
+            rep['thumbnails'] = thumbnail_urls(instance.picture, instance.thumbnails_ready)
+        if self.wants('traits'):
+            trait_list = []
+            # served from the prefetch cache when called through ListingListSerializer
+            traits = instance.donationtraits_set.all()
+            for trait in traits:
+                trait_list.append(trait.trait)
+            rep['traits'] = trait_list
         return rep
 
 class RequestSerializer(serializers.Serializer):
-    org_id = serializers.PrimaryKeyRelatedField(required=True, queryset=Organization.objects.all()) # required
+    org_id = OrganizationField(required=True, queryset=Organization.objects.all()) # required
     description = serializers.CharField()
     deactivation_time = serializers.DateTimeField(required=False)
     traits = serializers.ListField(
         child=serializers.ChoiceField(choices=TraitType)
     )
 
+    listing_model = Request
+    trait_model = RequestTraits
+    trait_listing_field = 'request'
+    trait_related_name = 'requesttraits_set'
+    # representation key -> model fields it reads, for fields= (see ListingView)
+    representation_columns = {
+        'request_id': ['request_id'],
+        'description': ['description'],
+        'organization_id': ['organization'],
+        'traits': [],
+    }
+
+    class Meta:
+        list_serializer_class = ListingListSerializer
+
+    def wants(self, key):
+        """
+        Whether key is part of the representation. The "fields" context entry
+        restricts it to a subset of representation_columns
+        """
+        fields = self.context.get('fields', None)
+        return fields is None or key in fields
+
     def soft_delete(self, instance):
         """
-        Update operation right now only support soft delete
+        Update operation right now only support soft delete. Goes through
+        soft_delete_listings, so the signal is sent in the same transaction
+        and a listing that is already inactive is left as it is
         """
-        instance.deactivation_time = datetime.now(tz=timezone.utc) # TODO: Could expend to take incoming value later
-        instance.save()
+        soft_delete_listings(type(instance).objects.filter(pk=instance.pk))
+        instance.refresh_from_db(fields=['deactivation_time'])
 
         return instance
 
-    def create(self, validated_data):
+    def build_listing(self, validated_data):
+        """
+        Unsaved request for the validated data, shared with the bulk create
+        """
         org = validated_data.get('org_id', None)
         description = validated_data.get('description', "")
+        traits = validated_data.get('traits', [])
 
-        # create the request listing
-        request = Request.objects.create(
+        return Request(
             organization = org,
             description = description,
-            deactivation_time=None
+            deactivation_time=None,
+            trait_mask=trait_mask(traits)
         )
 
-        # add the traits
-        traits = validated_data.get('traits', [])
-        for trait in traits:
-            # do this so there are no repeat trait entries
-            RequestTraits.objects.get_or_create(request=request, trait=trait)
-        
+    def create(self, validated_data):
+        with transaction.atomic():
+            # create the request listing
+            request = self.build_listing(validated_data)
+            request.save()
+
+            # add the traits
+            traits = validated_data.get('traits', [])
+            for trait in traits:
+                # do this so there are no repeat trait entries
+                RequestTraits.objects.get_or_create(request=request, trait=trait)
+
+            listings_created.send(sender=Request, listings=[request])
         return request
 
     def save(self):
@@ -131,14 +323,19 @@ class RequestSerializer(serializers.Serializer):
         Take in a request instance
         """
         rep = dict()
-        rep['request_id'] = instance.request_id
-        rep['description'] = instance.description
-        rep['organization_id'] = instance.organization.id
-        trait_list = []
-        traits = list(RequestTraits.objects.filter(request=instance))
-        for trait in traits:
-            trait_list.append(trait.trait)
-        rep['traits'] = trait_list
+        if self.wants('request_id'):
+            rep['request_id'] = instance.request_id
+        if self.wants('description'):
+            rep['description'] = instance.description
+        if self.wants('organization_id'):
+            rep['organization_id'] = instance.organization_id
+        if self.wants('traits'):
+            trait_list = []
+            # served from the prefetch cache when called through ListingListSerializer
+            traits = instance.requesttraits_set.all()
+            for trait in traits:
+                trait_list.append(trait.trait)
+            rep['traits'] = trait_list
         return rep
 
 
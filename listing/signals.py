@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent by the listing serializers after listings are created or soft deleted.
+# sender is the listing model (Donation or Request) and listings is the list
+# of affected instances. Both are sent inside the writing transaction.
+listings_created = Signal()
+listings_deactivated = Signal()
@@ -0,0 +1,102 @@
+"""
+Per-organization listing counts, served by /api/listing/stats/.
+
+ListingCounter keeps, for each organization, listing type and trait, how
+many listings are active and how many are deactivated, plus a TOTAL row for
+all the listings of the type. The listing signals adjust the rows in the
+writing transaction, so the counts commit or roll back with the listings
+they count and the endpoint reads a handful of rows instead of the lists.
+
+Listings written without the signals (hard deletes, raw SQL) make the
+counters drift: the reconcile_listing_stats command recomputes them from the
+listings and reports the difference. Like the status filter of the listing
+endpoints, a donation counts as active until it is deactivated, expired ones
+until expire_donations gets to them.
+"""
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Count, Q
+from django.dispatch import receiver
+
+from listing.changes import LISTING_TYPES
+from listing.models import ListingCounter, ListingType, TraitType, mask_traits
+from listing.signals import listings_created, listings_deactivated
+
+TOTAL = ListingCounter.TOTAL
+
+def add(counts, org_id, listing_type, mask, active, inactive):
+    for trait in [TOTAL, *mask_traits(mask)]:
+        count = counts[(org_id, listing_type, trait)]
+        count[0] += active
+        count[1] += inactive
+
+def apply(counts):
+    """
+    Add {(organization_id, listing_type, trait): [active, inactive]} deltas
+    to the counters with one upsert. Rows are written in key order, so
+    concurrent writers lock them in the same order and cannot deadlock
+    """
+    if not counts:
+        return
+    rows = sorted(counts.items())
+    table = ListingCounter._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO {table} (organization_id, listing_type, trait, active, inactive) VALUES {values} "
+            "ON CONFLICT (organization_id, listing_type, trait) DO UPDATE SET "
+            "active = {table}.active + EXCLUDED.active, "
+            "inactive = {table}.inactive + EXCLUDED.inactive".format(
+                table=table, values=", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))),
+            [value for key, (active, inactive) in rows for value in (*key, active, inactive)])
+
+def count(model, listings, active, inactive):
+    counts = defaultdict(lambda: [0, 0])
+    for listing in listings:
+        add(counts, listing.organization_id, LISTING_TYPES[model], listing.trait_mask, active, inactive)
+    apply(counts)
+
+@receiver(listings_created)
+def count_created(sender, listings, **kwargs):
+    count(sender, listings, 1, 0)
+
+@receiver(listings_deactivated)
+def count_deactivated(sender, listings, **kwargs):
+    count(sender, listings, -1, 1)
+
+def compute(listing_types=LISTING_TYPES):
+    """
+    The counters recomputed from the listings, one grouped query per listing
+    type. The migration that adds the counters passes its historical models
+    """
+    counts = defaultdict(lambda: [0, 0])
+    for model, listing_type in listing_types.items():
+        rows = (model.objects.order_by().values('organization_id', 'trait_mask').annotate(
+            active=Count('pk', filter=Q(deactivation_time__isnull=True)),
+            inactive=Count('pk', filter=Q(deactivation_time__isnull=False))))
+        for row in rows:
+            add(counts, row['organization_id'], listing_type, row['trait_mask'], row['active'], row['inactive'])
+    return counts
+
+def stored():
+    return {
+        (org_id, listing_type, trait): [active, inactive]
+        for org_id, listing_type, trait, active, inactive in ListingCounter.objects.values_list(
+            'organization_id', 'listing_type', 'trait', 'active', 'inactive')
+    }
+
+def organization_stats(org_id):
+    counters = {
+        (listing_type, trait): (active, inactive)
+        for listing_type, trait, active, inactive in ListingCounter.objects.filter(organization_id=org_id)
+            .values_list('listing_type', 'trait', 'active', 'inactive')
+    }
+    data = {"organization_id": org_id}
+    for listing_type in ListingType.values:
+        active, inactive = counters.get((listing_type, TOTAL), (0, 0))
+        traits = []
+        for trait in TraitType.values:
+            trait_active, trait_inactive = counters.get((listing_type, trait), (0, 0))
+            traits.append({"trait": trait, "active": trait_active, "inactive": trait_inactive})
+        data[ListingType(listing_type).label + "s"] = {"active": active, "inactive": inactive, "traits": traits}
+    return data
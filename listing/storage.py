@@ -0,0 +1,87 @@
+import os
+import re
+from hashlib import sha256
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CONTENT_NAME = re.compile(r'^[0-9a-f]{64}$')
+# files are spread over SHARD_LEVELS levels of directories named after the
+# leading hash characters, SHARD_WIDTH characters each: donations/ab/cd/abcd...jpg
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names every saved file after the sha256 of its
+    content: donations/photo.jpg is stored as donations/ab/cd/<sha256>.jpg,
+    the subdirectories keep any one directory small. When a file with the
+    same content is already stored the write is skipped and the existing
+    name is returned, so a photo uploaded for many donations is kept once.
+    Each save is counted in PictureBlob (see listing.blobs), the blob is
+    deleted when the last donation using it is deleted
+    """
+
+    @staticmethod
+    def content_hash(content):
+        digest = sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest()
+
+    def content_name(self, name, content):
+        directory, filename = os.path.split(name)
+        _, ext = os.path.splitext(filename)
+        return self.sharded_name(os.path.join(directory, self.content_hash(content) + ext.lower()))
+
+    @staticmethod
+    def shards(filename):
+        return [filename[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+
+    def sharded_name(self, name):
+        """
+        donations/abcd...jpg -> donations/ab/cd/abcd...jpg, names that are
+        already sharded are returned unchanged
+        """
+        directory, filename = os.path.split(name)
+        shards = self.shards(filename)
+        parts = directory.split('/')
+        if parts[-SHARD_LEVELS:] == shards:
+            return name
+        return os.path.join(directory, *shards, filename)
+
+    @staticmethod
+    def is_content_name(name):
+        root, _ = os.path.splitext(os.path.basename(name))
+        return CONTENT_NAME.match(root) is not None
+
+    def save(self, name, content, max_length=None):
+        from listing import blobs
+
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.generate_filename(self.content_name(name, content))
+        # counted first: the blob row stays locked until this transaction
+        # ends, so the file cannot be deleted between the check and the
+        # commit, and a file deleted before the count is written again
+        blobs.retain(name, content.size)
+        if not self.exists(name):
+            super().save(name, content, max_length)
+        return name
+
+    def replace(self, name, content):
+        """
+        Write content at exactly name, overwriting what is there. For files
+        derived from a blob (thumbnails), which are named after the blob
+        rather than after their own content
+        """
+        if self.exists(name):
+            self.delete(name)
+        return super().save(name, content)
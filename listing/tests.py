@@ -1,24 +1,55 @@
+import asyncio
+import gzip
 import pytest
-from datetime import datetime
+import json
+from base64 import urlsafe_b64encode
+from datetime import datetime, timedelta
+from importlib import import_module
+from io import StringIO
 import tempfile
+import threading
+import time
 from PIL import Image
 from six import BytesIO
 
+from asgiref.sync import SyncToAsync, async_to_sync, sync_to_async
+from django.apps import apps
 from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from django.utils.http import http_date
 from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework import status
 
+from atfoc import middleware
+from atfoc.renderers import ORJSONRenderer
+from atfoc.middleware import CompressionMiddleware
 from identity.models import Organization, OrgStatus, UserProfile, OrgRole
-from listing.models import Donation, DonationTraits, Request, RequestTraits
+from listing import events, matching, response_cache, thumbnails
+from listing.fast_serializers import FastDonationSerializer, FastListingSerializer, FastRequestSerializer
+from listing.images import check_image_format, normalize_picture
+from listing.pagination import KeysetPagination
+from listing.models import ChangeAction, Donation, DonationTraits, ListingChange, ListingCounter, ListingType, MatchCandidate, PictureBlob, Request, RequestTraits, active_filter, expired_filter, masks_matching, trait_mask
+from listing.serializers import DonationSerializer, RequestSerializer, soft_delete_listings
+from listing.views import DonationView
 
 EMAIL="email@example.com"
 EMAIL_ADMIN="email-admin@example.com"
 PASSWORD="password"
 DONATION_URL="/api/listing/donations/"
 REQUEST_URL="/api/listing/requests/"
+CACHE_STATS_URL="/api/listing/cache/stats/"
+CHANGES_URL="/api/listing/changes/"
+DONATION_BULK_URL="/api/listing/donations/bulk/"
+REQUEST_BULK_URL="/api/listing/requests/bulk/"
 
 ORG_NAME="test_org"
 ORG_ADDRESS="333 East Campus Mall Madison, WI"
@@ -178,6 +209,111 @@ def test_create_request_fixture(db, init_request_listing, organization):
     assert request_get.organization.id == organization.id
     assert request_get.description == REQUEST_DESCRIPTION
 
+"""
+Tests for the many=True serializers
+"""
+def count_serializer_queries(serializer_class, queryset):
+    with CaptureQueriesContext(connection) as context:
+        data = serializer_class(queryset, many=True).data
+    return len(context.captured_queries), data
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_donation_serializer_query_count_flat(db, organization, picture):
+    def add_donations(count):
+        for _ in range(count):
+            donation = Donation.objects.create(
+                organization = organization,
+                description = DONATION_DESCRIPTION,
+                picture = picture,
+                expiration_date = DONATION_EXPIREATION,
+            )
+            DonationTraits.objects.create(trait=0, donation=donation)
+            DonationTraits.objects.create(trait=1, donation=donation)
+
+    add_donations(2)
+    few_queries, _ = count_serializer_queries(DonationSerializer, Donation.objects.all())
+    add_donations(20)
+    many_queries, data = count_serializer_queries(DonationSerializer, Donation.objects.all())
+
+    assert few_queries == many_queries
+    assert len(data) == 22
+    for rep in data:
+        assert rep["organization_id"] == organization.id
+        assert rep["traits"] == [0, 1]
+
+def test_request_serializer_query_count_flat(db, organization):
+    def add_requests(count):
+        for _ in range(count):
+            request = Request.objects.create(
+                organization = organization,
+                description = REQUEST_DESCRIPTION,
+            )
+            RequestTraits.objects.create(trait=1, request=request)
+
+    add_requests(2)
+    few_queries, _ = count_serializer_queries(RequestSerializer, Request.objects.all())
+    add_requests(20)
+    many_queries, data = count_serializer_queries(RequestSerializer, Request.objects.all())
+
+    assert few_queries == many_queries
+    assert [rep["traits"] for rep in data] == [[1]] * 22
+
+"""
+Tests for the active listing indexes
+"""
+@pytest.fixture
+def seeded_listings(db, organization):
+    """
+    Seed enough listings, most of them deactivated, for the planner to prefer indexes
+    """
+    now = datetime.now(tz=timezone.utc)
+    orgs = [organization] + [
+        Organization.objects.create(
+            name = ORG_NAME,
+            address = ORG_ADDRESS,
+            email = ORG_EMAIL,
+            phone = ORG_PHONE,
+            url = ORG_URL,
+        ) for _ in range(9)
+    ]
+    Donation.objects.bulk_create([
+        Donation(
+            organization = orgs[i % len(orgs)],
+            description = DONATION_DESCRIPTION,
+            picture = "donations/" + DONATION_PIC_NAME,
+            deactivation_time = None if i % 50 == 0 else now,
+            trait_mask = i % 4,
+        ) for i in range(10000)
+    ], batch_size=2000)
+    Request.objects.bulk_create([
+        Request(
+            organization = orgs[i % len(orgs)],
+            description = REQUEST_DESCRIPTION,
+            deactivation_time = None if i % 50 == 0 else now,
+            trait_mask = i % 4,
+        ) for i in range(10000)
+    ], batch_size=2000)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE listing_donation, listing_request")
+    return orgs
+
+def test_active_listing_queries_use_indexes(db, seeded_listings):
+    now = datetime.now(tz=timezone.utc)
+    org = seeded_listings[3]
+    queries = [
+        Donation.objects.filter(active_filter(now)).order_by('creation_time', 'donation_id'),
+        Donation.objects.filter(organization=org).filter(active_filter(now)).order_by('creation_time', 'donation_id'),
+        Request.objects.filter(active_filter(now)).order_by('creation_time', 'request_id'),
+        Request.objects.filter(organization=org).filter(active_filter(now)).order_by('creation_time', 'request_id'),
+        Donation.objects.filter(active_filter(now), trait_mask__in=masks_matching(trait_mask([0])))
+            .order_by('creation_time', 'donation_id'),
+        Request.objects.filter(active_filter(now), trait_mask__in=masks_matching(trait_mask([0, 1]), match_all=True))
+            .order_by('creation_time', 'request_id'),
+    ]
+    for queryset in queries:
+        for plan in [queryset.explain(), queryset[:101].explain()]:
+            assert "Seq Scan" not in plan, plan
+
 """
 Tests for GET /api/listing/donations/
 """
@@ -194,6 +330,7 @@ def test_get_donation_listing_all(client, db,
                 "expiration_date":donation.expiration_date,
                 "organization_id": donation.organization.id,
                 "picture":donation.picture.url,
+                "thumbnails": {"small": donation.picture.url, "medium": donation.picture.url},
                 "traits": [] # no traits
             },
             {
@@ -202,6 +339,7 @@ def test_get_donation_listing_all(client, db,
                 "expiration_date":donation2.expiration_date,
                 "organization_id": donation2.organization.id,
                 "picture":donation2.picture.url,
+                "thumbnails": {"small": donation2.picture.url, "medium": donation2.picture.url},
                 "traits": [0]
             }
         ]
@@ -221,6 +359,7 @@ def test_get_donation_listing_filter_by_org(client, db, affiliated_non_admin_use
                 "expiration_date":donation.expiration_date,
                 "organization_id": donation.organization.id,
                 "picture":donation.picture.url,
+                "thumbnails": {"small": donation.picture.url, "medium": donation.picture.url},
                 "traits": [] # no traits
             }
         ]
@@ -240,6 +379,7 @@ def test_get_donation_listing_filter_by_status(client, db, affiliated_non_admin_
                 "expiration_date":donation.expiration_date,
                 "organization_id": donation.organization.id,
                 "picture":donation.picture.url,
+                "thumbnails": {"small": donation.picture.url, "medium": donation.picture.url},
                 "traits": [] # no traits
             }
         ]
@@ -260,6 +400,379 @@ def test_get_donation_listing_empty(client, db, affiliated_non_admin_user_token)
     response = client.get(DONATION_URL + "?status=inactive", HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key)
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_get_donation_listing_paginated(client, db, affiliated_non_admin_user_token, organization, picture):
+    donations = [
+        Donation.objects.create(
+            organization = organization,
+            description = DONATION_DESCRIPTION + str(i),
+            picture = picture,
+            expiration_date = DONATION_EXPIREATION,
+        ) for i in range(5)
+    ]
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+
+    response = client.get(DONATION_URL + "?page_size=2", HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_200_OK
+    assert [d["donation_id"] for d in response.data["donations"]] == [d.donation_id for d in donations[:2]]
+    assert response.data["prev"] is None
+
+    # a listing created while paging is appended at the end and does not shift pages
+    Donation.objects.create(
+        organization = organization,
+        description = DONATION_DESCRIPTION,
+        picture = picture,
+        expiration_date = DONATION_EXPIREATION,
+    )
+    response = client.get(DONATION_URL + "?page_size=2&cursor=" + response.data["next"], HTTP_AUTHORIZATION=auth)
+    assert [d["donation_id"] for d in response.data["donations"]] == [d.donation_id for d in donations[2:4]]
+
+    # walking back returns the first page again
+    prev_response = client.get(DONATION_URL + "?page_size=2&cursor=" + response.data["prev"], HTTP_AUTHORIZATION=auth)
+    assert [d["donation_id"] for d in prev_response.data["donations"]] == [d.donation_id for d in donations[:2]]
+    assert prev_response.data["prev"] is None
+
+    response = client.get(DONATION_URL + "?page_size=2&cursor=" + response.data["next"], HTTP_AUTHORIZATION=auth)
+    assert len(response.data["donations"]) == 2
+    assert response.data["next"] is None
+
+def test_get_donation_listing_paginated_invalid_cursor(client, db, affiliated_non_admin_user_token, init_donation_listing):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(DONATION_URL + "?cursor=fake", HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    now = timezone.now().isoformat()
+    for position in [[1, None], [now, None], [now, "1"], [now, 1.5], [now, True], [None, 1]]:
+        cursor = urlsafe_b64encode(json.dumps({"p": position, "r": False}).encode('ascii')).decode('ascii')
+        response = client.get(DONATION_URL, {"cursor": cursor}, HTTP_AUTHORIZATION=auth)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data == {"message": "Invalid cursor"}
+
+def test_paginated_listing_query_uses_index_range(db, seeded_listings):
+    now = datetime.now(tz=timezone.utc)
+    queryset = Donation.objects.filter(active_filter(now))
+    deep = queryset.order_by('creation_time', 'donation_id')[150]
+    paginator = KeysetPagination(['creation_time', 'donation_id'])
+    page = paginator.order_queryset(queryset.filter(paginator.position_filter(
+        [('creation_time', False, deep.creation_time), ('donation_id', False, deep.donation_id)], False)))[:101]
+    plan = page.explain()
+    # the scan starts at the cursor instead of filtering out the earlier rows
+    assert "Index Cond: (creation_time >=" in plan, plan
+
+def test_get_donation_listing_paginated_invalid_page_size(client, db, affiliated_non_admin_user_token, init_donation_listing):
+    response = client.get(DONATION_URL + "?page_size=0", HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.fixture
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def trait_donations(db, organization, picture):
+    """
+    Create one donation per trait combination, keyed by the trait list
+    """
+    donations = {}
+    for traits in [(), (0,), (1,), (0, 1)]:
+        donation = Donation.objects.create(
+            organization = organization,
+            description = DONATION_DESCRIPTION,
+            picture = picture,
+            expiration_date = DONATION_EXPIREATION,
+            trait_mask = trait_mask(traits),
+        )
+        for trait in traits:
+            DonationTraits.objects.create(trait=trait, donation=donation)
+        donations[traits] = donation
+    return donations
+
+def test_get_donation_listing_filter_by_traits_any(client, db, affiliated_non_admin_user_token, trait_donations):
+    response = client.get(DONATION_URL + "?traits=0,1", HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key)
+    expected = [trait_donations[t].donation_id for t in [(0,), (1,), (0, 1)]]
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [d["donation_id"] for d in response.data["donations"]] == expected
+
+def test_get_donation_listing_filter_by_traits_all(client, db, affiliated_non_admin_user_token, trait_donations):
+    response = client.get(DONATION_URL + "?traits=0,1&traits_match=all", HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [d["donation_id"] for d in response.data["donations"]] == [trait_donations[(0, 1)].donation_id]
+    assert response.data["donations"][0]["traits"] == [0, 1]
+
+def test_get_donation_listing_filter_by_traits_invalid(client, db, affiliated_non_admin_user_token):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    assert client.get(DONATION_URL + "?traits=7", HTTP_AUTHORIZATION=auth).status_code == status.HTTP_400_BAD_REQUEST
+    assert client.get(DONATION_URL + "?traits=fake", HTTP_AUTHORIZATION=auth).status_code == status.HTTP_400_BAD_REQUEST
+    assert client.get(DONATION_URL + "?traits=0&traits_match=some", HTTP_AUTHORIZATION=auth).status_code == status.HTTP_400_BAD_REQUEST
+
+def test_trait_mask_backfill(db, init_donation_listing2, init_request_listing2):
+    migration = import_module('listing.migrations.0006_trait_mask')
+    Donation.objects.update(trait_mask=0)
+    Request.objects.update(trait_mask=0)
+
+    migration.backfill_trait_mask(apps, None)
+
+    assert Donation.objects.get(donation_id=init_donation_listing2.donation_id).trait_mask == trait_mask([0])
+    assert Request.objects.get(request_id=init_request_listing2.request_id).trait_mask == trait_mask([0])
+
+def test_get_donation_listing_not_modified(client, db, affiliated_non_admin_user_token, init_donation_listing):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    url = DONATION_URL + "?status=active"
+    response = client.get(url, HTTP_AUTHORIZATION=auth)
+    etag = response["ETag"]
+
+    assert response.status_code == status.HTTP_200_OK
+
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(url, HTTP_AUTHORIZATION=auth, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    # nothing is read from the trait table when the client copy is fresh
+    assert not any("listing_donationtraits" in q["sql"] for q in context.captured_queries)
+
+    # a different filter set has a different validator
+    response = client.get(DONATION_URL, HTTP_AUTHORIZATION=auth, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+
+    client.delete(DONATION_URL,
+        HTTP_AUTHORIZATION=auth,
+        data={"donation_id": init_donation_listing.donation_id},
+        content_type='application/json')
+    response = client.get(url, HTTP_AUTHORIZATION=auth, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+def test_get_donation_listing_modified_since(client, db, affiliated_non_admin_user_token, init_donation_listing,
+        init_donation_listing2):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    url = DONATION_URL + "?status=active"
+    response = client.get(url, HTTP_AUTHORIZATION=auth)
+    assert len(response.data["donations"]) == 2
+    assert not response.has_header("Last-Modified")
+
+    # deactivating the older listing moves no creation or deactivation time
+    # of the active ones, If-Modified-Since must not answer 304
+    client.delete(DONATION_URL,
+        HTTP_AUTHORIZATION=auth,
+        data={"donation_id": init_donation_listing.donation_id},
+        content_type='application/json')
+    response = client.get(url, HTTP_AUTHORIZATION=auth, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data["donations"]) == 1
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_get_donation_listing_cached(client, db, affiliated_non_admin_user_token, init_donation_listing):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    url = DONATION_URL + "?status=active&org_id=" + str(init_donation_listing.organization.id)
+    response = client.get(url, HTTP_AUTHORIZATION=auth)
+    assert len(response.data["donations"]) == 1
+
+    with CaptureQueriesContext(connection) as context:
+        cached_response = client.get(url, HTTP_AUTHORIZATION=auth)
+    assert not any("listing_donation" in q["sql"] for q in context.captured_queries)
+    assert cached_response.data == response.data
+    assert cached_response["ETag"] == response["ETag"]
+    assert response_cache.stats()["hits"] == 1
+    assert response_cache.stats()["misses"] == 1
+
+    # creating a listing for the org drops its cached responses
+    image = BytesIO()
+    Image.new('RGB', (100, 100)).save(image, 'JPEG')
+    client.post(DONATION_URL,
+        HTTP_AUTHORIZATION=auth,
+        data={
+            "org_id": init_donation_listing.organization.id,
+            "description": DONATION_DESCRIPTION,
+            "picture": SimpleUploadedFile(DONATION_PIC_NAME, image.getvalue()),
+            "expiration_date": DONATION_EXPIREATION,
+            "traits": [0],
+        })
+    response = client.get(url, HTTP_AUTHORIZATION=auth)
+    assert len(response.data["donations"]) == 2
+
+    # and so does deactivating one
+    client.delete(DONATION_URL,
+        HTTP_AUTHORIZATION=auth,
+        data={"donation_id": init_donation_listing.donation_id},
+        content_type='application/json')
+    response = client.get(url, HTTP_AUTHORIZATION=auth)
+    assert len(response.data["donations"]) == 1
+    assert response_cache.stats()["misses"] == 3
+
+def test_get_donation_listing_cached_after_invalidation(client, db, affiliated_non_admin_user_token, init_donation_listing,
+        monkeypatch):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    url = DONATION_URL + "?org_id=" + str(init_donation_listing.organization.id)
+    list_response = DonationView.list_response
+
+    def list_response_then_invalidate(view, request, listings):
+        response = list_response(view, request, listings)
+        # a writer commits after the rows were read, before they are stored
+        response_cache.invalidate("donations", [init_donation_listing.organization.id])
+        return response
+
+    monkeypatch.setattr(DonationView, "list_response", list_response_then_invalidate)
+    client.get(url, HTTP_AUTHORIZATION=auth)
+    monkeypatch.undo()
+
+    # the rows read before the invalidation are not served for the new generation
+    client.get(url, HTTP_AUTHORIZATION=auth)
+    assert response_cache.stats()["hits"] == 0
+    assert response_cache.stats()["misses"] == 2
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_get_donation_listing_cached_non_canonical_org_id(client, db, affiliated_non_admin_user_token, organization):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    url = DONATION_URL + "?org_id=0" + str(organization.id)
+    assert client.get(url, HTTP_AUTHORIZATION=auth).status_code == status.HTTP_204_NO_CONTENT
+
+    client.post(DONATION_URL, HTTP_AUTHORIZATION=auth, data={
+        "org_id": organization.id,
+        "description": DONATION_DESCRIPTION,
+        "picture": make_picture(),
+        "expiration_date": DONATION_EXPIREATION,
+        "traits": [0],
+    })
+    # the same generation as org_id=<id>, dropped by the create
+    assert len(client.get(url, HTTP_AUTHORIZATION=auth).data["donations"]) == 1
+
+def test_listing_cache_stats_admin_only(client, db, affiliated_non_admin_user_token):
+    response = client.get(CACHE_STATS_URL, HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key)
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    admin = User.objects.create_superuser(EMAIL_ADMIN, EMAIL_ADMIN, PASSWORD)
+    response = client.get(CACHE_STATS_URL, HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=admin).key)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {"hits": 0, "misses": 0, "hit_ratio": None}
+
+@override_settings(MEDIA_ROOT=(TEST_DIR), LISTING_STREAM_CHUNK_SIZE=2)
+def test_get_donation_listing_stream(client, db, affiliated_non_admin_user_token, trait_donations):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(DONATION_URL, HTTP_AUTHORIZATION=auth)
+    streamed = client.get(DONATION_URL + "?stream=true", HTTP_AUTHORIZATION=auth)
+
+    assert streamed.status_code == status.HTTP_200_OK
+    assert streamed.streaming
+    assert b"".join(streamed.streaming_content) == response.content
+    assert streamed["ETag"]
+
+def test_get_donation_listing_stream_empty(client, db, affiliated_non_admin_user_token):
+    response = client.get(DONATION_URL + "?stream=true", HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+@pytest.fixture
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def search_donations(db, organization, picture):
+    """
+    Create donations with different descriptions, keyed by description
+    """
+    descriptions = ["fresh apples", "canned beans", "apple pie with apples", "bread"]
+    Donation.objects.bulk_create([
+        Donation(
+            organization = organization,
+            description = description,
+            picture = picture,
+            expiration_date = DONATION_EXPIREATION,
+        ) for description in descriptions
+    ])
+    return {d.description: d for d in Donation.objects.all()}
+
+def test_get_donation_listing_search(client, db, affiliated_non_admin_user_token, search_donations):
+    response = client.get(DONATION_URL + "?q=apple", HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key)
+
+    assert response.status_code == status.HTTP_200_OK
+    # ranked, the description mentioning apples twice comes first
+    assert [d["description"] for d in response.data["donations"]] == ["apple pie with apples", "fresh apples"]
+
+def test_get_donation_listing_search_with_filters(client, db, affiliated_non_admin_user_token, search_donations, organization):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    Donation.objects.filter(description="fresh apples").update(deactivation_time=datetime.now(tz=timezone.utc))
+    response = client.get(DONATION_URL + "?q=apples&status=active&org_id=" + str(organization.id), HTTP_AUTHORIZATION=auth)
+
+    assert [d["description"] for d in response.data["donations"]] == ["apple pie with apples"]
+
+    response = client.get(DONATION_URL + "?q=oranges", HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+def test_get_donation_listing_search_paginated(client, db, affiliated_non_admin_user_token, search_donations):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(DONATION_URL + "?q=apple&page_size=1", HTTP_AUTHORIZATION=auth)
+    assert [d["description"] for d in response.data["donations"]] == ["apple pie with apples"]
+
+    response = client.get(DONATION_URL + "?q=apple&page_size=1&cursor=" + response.data["next"], HTTP_AUTHORIZATION=auth)
+    assert [d["description"] for d in response.data["donations"]] == ["fresh apples"]
+    assert response.data["next"] is None
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_get_donation_listing_search_paginated_ties(client, db, affiliated_non_admin_user_token, organization, picture):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    Donation.objects.bulk_create([
+        Donation(
+            organization = organization,
+            description = "fresh pears",
+            picture = picture,
+            expiration_date = DONATION_EXPIREATION,
+        ) for _ in range(5)
+    ])
+    # every row has the same rank, the pages go on by donation_id
+    seen = []
+    url = DONATION_URL + "?q=pears&page_size=2"
+    while url is not None:
+        response = client.get(url, HTTP_AUTHORIZATION=auth)
+        seen.extend(d["donation_id"] for d in response.data["donations"])
+        url = response.data["next"] and DONATION_URL + "?q=pears&page_size=2&cursor=" + response.data["next"]
+    assert seen == sorted(Donation.objects.values_list('donation_id', flat=True))
+
+def test_get_donation_listing_search_invalid(client, db, affiliated_non_admin_user_token):
+    response = client.get(DONATION_URL + "?q=", HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_get_donation_listing_near(client, db, affiliated_non_admin_user_token, organization, picture):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    # organization is ~1.4 km from the point, far_org ~120 km
+    organization.latitude, organization.longitude = 43.0747, -89.3841
+    organization.save()
+    near_org = Organization.objects.create(
+        name = ORG_NAME,
+        address = ORG_ADDRESS,
+        email = ORG_EMAIL,
+        phone = ORG_PHONE,
+        url = ORG_URL,
+        latitude = 43.0766,
+        longitude = -89.4125,
+    )
+    far_org = Organization.objects.create(
+        name = ORG_NAME,
+        address = ORG_ADDRESS,
+        email = ORG_EMAIL,
+        phone = ORG_PHONE,
+        url = ORG_URL,
+        latitude = 43.0389,
+        longitude = -87.9065,
+    )
+    for org in [organization, far_org, near_org]:
+        Donation.objects.create(
+            organization = org,
+            description = DONATION_DESCRIPTION,
+            picture = picture,
+            expiration_date = DONATION_EXPIREATION,
+        )
+
+    response = client.get(DONATION_URL + "?near=43.0731,-89.4012&radius=5", HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_200_OK
+    # closest organization first
+    assert [d["organization_id"] for d in response.data["donations"]] == [near_org.id, organization.id]
+
+    response = client.get(DONATION_URL + "?near=43.0731,-89.4012&radius=5&page_size=1", HTTP_AUTHORIZATION=auth)
+    response = client.get(DONATION_URL + "?near=43.0731,-89.4012&radius=5&page_size=1&cursor=" + response.data["next"], HTTP_AUTHORIZATION=auth)
+    assert [d["organization_id"] for d in response.data["donations"]] == [organization.id]
+
+    response = client.get(DONATION_URL + "?near=43.0731,-89.4012&radius=150", HTTP_AUTHORIZATION=auth)
+    assert [d["organization_id"] for d in response.data["donations"]] == [near_org.id, organization.id, far_org.id]
+
+def test_get_donation_listing_near_invalid(client, db, affiliated_non_admin_user_token):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    for query in ["?near=fake", "?near=43.0", "?near=95,0", "?near=43,-89&radius=-1", "?near=43,-89&radius=fake"]:
+        response = client.get(DONATION_URL + query, HTTP_AUTHORIZATION=auth)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
 """
 Tests for POST /api/listing/donations/
 """
@@ -290,6 +803,7 @@ def test_create_donation_listing_valid(client, db, affiliated_non_admin_user_tok
     assert created_donation.description == description
     assert created_donation.expiration_date == expiration_date
     assert [traits[0]["trait"],traits[1]["trait"]] == [trait1, trait2]
+    assert created_donation.trait_mask == trait_mask([trait1, trait2])
     assert created_donation.deactivation_time == None
 
 def test_create_donation_listing_org_invalid(client, db, affiliated_non_admin_user_token, picture):
@@ -312,6 +826,338 @@ def test_create_donation_listing_org_invalid(client, db, affiliated_non_admin_us
 
     assert response.status_code == status.HTTP_400_BAD_REQUEST
 
+"""
+Tests for POST /api/listing/donations/bulk/
+"""
+def make_picture():
+    image = BytesIO()
+    Image.new('RGB', (100, 100)).save(image, 'JPEG')
+    return SimpleUploadedFile(DONATION_PIC_NAME, image.getvalue())
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_bulk_create_donation_listing_valid(client, db, affiliated_non_admin_user_token, organization):
+    items = [
+        {
+            "org_id": organization.id,
+            "description": "bulk " + str(i),
+            "picture": "picture_" + str(i),
+            "expiration_date": DONATION_EXPIREATION.isoformat(),
+            "traits": [0, 1, 1],
+        } for i in range(3)
+    ]
+    post_data = {"donations": json.dumps(items)}
+    for i in range(3):
+        post_data["picture_" + str(i)] = make_picture()
+
+    with CaptureQueriesContext(connection) as context:
+        response = client.post(DONATION_BULK_URL,
+            HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key,
+            data=post_data)
+    inserts = [q["sql"] for q in context.captured_queries if q["sql"].startswith("INSERT INTO \"listing_")]
+
+    assert response.status_code == status.HTTP_201_CREATED
+    # the donations, their traits and their change feed rows
+    assert len(inserts) == 3
+    donation_ids = [item["donation_id"] for item in response.data["donations"]]
+    created = list(Donation.objects.filter(donation_id__in=donation_ids).order_by('donation_id'))
+    assert [d.description for d in created] == ["bulk 0", "bulk 1", "bulk 2"]
+    assert all(d.picture.name.startswith("donations/") for d in created)
+    assert all(d.trait_mask == trait_mask([0, 1]) for d in created)
+    assert DonationTraits.objects.filter(donation__in=created).count() == 6
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_bulk_create_donation_listing_invalid_item(client, db, affiliated_non_admin_user_token, organization):
+    items = [
+        {
+            "org_id": organization.id,
+            "description": "bulk",
+            "picture": "picture_0",
+            "expiration_date": DONATION_EXPIREATION.isoformat(),
+            "traits": [0],
+        },
+        {
+            "org_id": organization.id,
+            "description": "bulk",
+            "picture": "missing",
+            "expiration_date": DONATION_EXPIREATION.isoformat(),
+            "traits": [0],
+        },
+    ]
+    response = client.post(DONATION_BULK_URL,
+        HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key,
+        data={"donations": json.dumps(items), "picture_0": make_picture()})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["errors"][0] is None
+    assert "picture" in response.data["errors"][1]
+    assert not Donation.objects.exists()
+
+def test_bulk_create_donation_listing_missing_param(client, db, affiliated_non_admin_user_token):
+    response = client.post(DONATION_BULK_URL,
+        HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key,
+        data={"donations": "fake"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+"""
+Tests for the donation thumbnails
+"""
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_generate_thumbnails(db, organization):
+    image = BytesIO()
+    Image.new('RGB', (1000, 600)).save(image, 'JPEG')
+    donation = Donation.objects.create(
+        organization = organization,
+        description = DONATION_DESCRIPTION,
+        picture = SimpleUploadedFile(DONATION_PIC_NAME, image.getvalue()),
+        expiration_date = DONATION_EXPIREATION,
+    )
+
+    assert thumbnails.generate_thumbnails([donation.donation_id]) == [donation.donation_id]
+
+    donation.refresh_from_db()
+    assert donation.thumbnails_ready
+    storage = donation.picture.storage
+    with storage.open(thumbnails.thumbnail_name(donation.picture.name, "small")) as small:
+        assert Image.open(small).size == (128, 77)
+    rep = DonationSerializer(donation).data
+    assert rep["thumbnails"] == {
+        "small": storage.url(thumbnails.thumbnail_name(donation.picture.name, "small")),
+        "medium": storage.url(thumbnails.thumbnail_name(donation.picture.name, "medium")),
+    }
+    assert rep["thumbnails"]["small"] != rep["picture"]
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_generate_thumbnails_unreadable_picture(db, organization, caplog):
+    broken = Donation.objects.create(
+        organization = organization,
+        description = DONATION_DESCRIPTION,
+        picture = SimpleUploadedFile("broken.jpg", b"not a picture"),
+        expiration_date = DONATION_EXPIREATION,
+    )
+    donation = Donation.objects.create(
+        organization = organization,
+        description = DONATION_DESCRIPTION,
+        picture = make_picture(),
+        expiration_date = DONATION_EXPIREATION,
+    )
+
+    # the rest of the batch still gets its thumbnails
+    assert thumbnails.generate_thumbnails([broken.donation_id, donation.donation_id]) == [donation.donation_id]
+    assert list(Donation.objects.filter(thumbnails_ready=True).values_list('donation_id', flat=True)) == [
+        donation.donation_id]
+    assert "donation %s" % broken.donation_id in caplog.text
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_get_donation_listing_after_thumbnails(client, db, affiliated_non_admin_user_token, organization):
+    donation = Donation.objects.create(
+        organization = organization,
+        description = DONATION_DESCRIPTION,
+        picture = make_picture(),
+        expiration_date = DONATION_EXPIREATION,
+    )
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(DONATION_URL, {"org_id": organization.id}, HTTP_AUTHORIZATION=auth)
+    assert response.data["donations"][0]["thumbnails"]["small"] == donation.picture.url
+
+    thumbnails.generate_thumbnails([donation.donation_id])
+
+    # neither the cached response nor a 304 for the old ETag
+    response = client.get(DONATION_URL, {"org_id": organization.id}, HTTP_AUTHORIZATION=auth,
+        HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["donations"][0]["thumbnails"]["small"] == donation.picture.storage.url(
+        thumbnails.thumbnail_name(donation.picture.name, "small"))
+
+@override_settings(MEDIA_ROOT=(TEST_DIR), LISTING_THUMBNAIL_WORKERS=0)
+def test_create_donation_listing_schedules_thumbnails(client, db, affiliated_non_admin_user_token, organization,
+        django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(DONATION_URL,
+            HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key,
+            data={
+                "org_id": organization.id,
+                "description": DONATION_DESCRIPTION,
+                "picture": make_picture(),
+                "expiration_date": DONATION_EXPIREATION,
+                "traits": [0],
+            })
+
+    assert Donation.objects.get(donation_id=response.data["donation_id"]).thumbnails_ready
+
+"""
+Tests for the upload picture normalization
+"""
+@override_settings(MEDIA_ROOT=(TEST_DIR), LISTING_IMAGE_MAX_DIMENSION=300)
+def test_create_donation_listing_normalizes_picture(client, db, affiliated_non_admin_user_token, organization):
+    image = BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = 6  # orientation: rotate 90
+    exif[0x010f] = "test camera"
+    Image.new('RGBA', (1200, 900)).save(image, 'PNG', exif=exif.tobytes())
+
+    response = client.post(DONATION_URL,
+        HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key,
+        data={
+            "org_id": organization.id,
+            "description": DONATION_DESCRIPTION,
+            "picture": SimpleUploadedFile("upload.png", image.getvalue()),
+            "expiration_date": DONATION_EXPIREATION,
+            "traits": [0],
+        })
+
+    assert response.status_code == status.HTTP_201_CREATED
+    donation = Donation.objects.get(donation_id=response.data["donation_id"])
+    assert donation.picture.name.endswith(".jpg")
+    with donation.picture.open() as picture:
+        stored = Image.open(picture)
+        assert stored.format == "JPEG"
+        assert stored.mode == "RGB"
+        assert stored.size == (225, 300)
+        assert not stored.getexif()
+
+@override_settings(MEDIA_ROOT=(TEST_DIR), LISTING_IMAGE_MAX_DIMENSION=300)
+def test_normalize_picture_keeps_small_pictures(db):
+    picture = normalize_picture(make_picture())
+
+    assert picture.name == DONATION_PIC_NAME
+    assert Image.open(picture).size == (100, 100)
+
+def test_image_format_check():
+    assert check_image_format(None) == []
+    with override_settings(LISTING_IMAGE_FORMAT='GIF'):
+        assert [error.id for error in check_image_format(None)] == ['listing.E001']
+
+"""
+Tests for the content-addressed picture storage
+"""
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_same_picture_is_stored_once(db, organization, django_capture_on_commit_callbacks):
+    donations = [
+        Donation.objects.create(
+            organization = organization,
+            description = DONATION_DESCRIPTION,
+            picture = make_picture(),
+            expiration_date = DONATION_EXPIREATION,
+        ) for _ in range(2)]
+    name = donations[0].picture.name
+    storage = donations[0].picture.storage
+
+    assert donations[1].picture.name == name
+    assert storage.is_content_name(name)
+    digest = name.split("/")[-1][:64]
+    assert name == "donations/%s/%s/%s.jpg" % (digest[:2], digest[2:4], digest)
+    assert PictureBlob.objects.get(name=name).refcount == 2
+
+    with django_capture_on_commit_callbacks(execute=True):
+        donations[0].delete()
+    assert PictureBlob.objects.get(name=name).refcount == 1
+    assert storage.exists(name)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        donations[1].delete()
+    assert not PictureBlob.objects.filter(name=name).exists()
+    assert not storage.exists(name)
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_same_picture_uploaded_while_deleted(transactional_db, organization):
+    donation = Donation.objects.create(
+        organization = organization,
+        description = DONATION_DESCRIPTION,
+        picture = make_picture(),
+        expiration_date = DONATION_EXPIREATION,
+    )
+    name = donation.picture.name
+    uploaded = []
+
+    def upload_again():
+        try:
+            with transaction.atomic():
+                uploaded.append(Donation.objects.create(
+                    organization = organization,
+                    description = DONATION_DESCRIPTION,
+                    picture = make_picture(),
+                    expiration_date = DONATION_EXPIREATION,
+                ))
+        finally:
+            connection.close()
+
+    with transaction.atomic():
+        donation.delete()
+        other = threading.Thread(target=upload_again)
+        other.start()
+        # let the upload find the file and wait on the blob row of this release
+        time.sleep(0.5)
+    other.join()
+
+    assert uploaded[0].picture.name == name
+    assert PictureBlob.objects.get(name=name).refcount == 1
+    assert uploaded[0].picture.storage.exists(name)
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_dedupe_pictures(db, organization):
+    legacy_storage = FileSystemStorage()
+    image = BytesIO()
+    Image.new('RGB', (100, 100)).save(image, 'JPEG')
+    legacy_names = [legacy_storage.save("donations/legacy.jpg", ContentFile(image.getvalue())) for _ in range(2)]
+    legacy_storage.save(thumbnails.thumbnail_name(legacy_names[0], "small"), ContentFile(image.getvalue()))
+    donations = [
+        Donation.objects.create(
+            organization = organization,
+            description = DONATION_DESCRIPTION,
+            picture = name,
+            expiration_date = DONATION_EXPIREATION,
+        ) for name in legacy_names]
+
+    out = StringIO()
+    call_command("dedupe_pictures", stdout=out)
+
+    for donation in donations:
+        donation.refresh_from_db()
+    name = donations[0].picture.name
+    storage = donations[0].picture.storage
+    assert donations[1].picture.name == name
+    assert storage.is_content_name(name)
+    assert PictureBlob.objects.get(name=name).refcount == 2
+    assert storage.exists(thumbnails.thumbnail_name(name, "small"))
+    assert not any(legacy_storage.exists(legacy_name) for legacy_name in legacy_names)
+    assert "Moved 2 pictures" in out.getvalue()
+    assert "Reclaimed %d bytes" % len(image.getvalue()) in out.getvalue()
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_shard_pictures(db, organization):
+    storage = Donation._meta.get_field("picture").storage
+    image = BytesIO()
+    Image.new('RGB', (100, 120)).save(image, 'JPEG')
+    digest = storage.content_hash(ContentFile(image.getvalue()))
+    flat_name = FileSystemStorage().save("donations/%s.jpg" % digest, ContentFile(image.getvalue()))
+    FileSystemStorage().save(thumbnails.thumbnail_name(flat_name, "small"), ContentFile(image.getvalue()))
+    PictureBlob.objects.create(name=flat_name, size=len(image.getvalue()), refcount=2)
+    donations = [
+        Donation.objects.create(
+            organization = organization,
+            description = DONATION_DESCRIPTION,
+            picture = flat_name,
+            expiration_date = DONATION_EXPIREATION,
+        ) for _ in range(2)]
+
+    out = StringIO()
+    call_command("shard_pictures", "--batch-size", "1", stdout=out)
+
+    sharded_name = "donations/%s/%s/%s.jpg" % (digest[:2], digest[2:4], digest)
+    assert {Donation.objects.get(pk=d.pk).picture.name for d in donations} == {sharded_name}
+    assert storage.exists(sharded_name)
+    assert storage.exists(thumbnails.thumbnail_name(sharded_name, "small"))
+    assert not storage.exists(flat_name)
+    assert not storage.exists(thumbnails.thumbnail_name(flat_name, "small"))
+    assert PictureBlob.objects.get(name=sharded_name).refcount == 2
+    assert "Moved 1 pictures" in out.getvalue()
+
+    # running it again finds nothing left to move
+    out = StringIO()
+    call_command("shard_pictures", stdout=out)
+    assert "Moved 0 pictures" in out.getvalue()
+
 """
 Tests for DELETE /api/listing/donations/
 """
@@ -354,6 +1200,322 @@ def test_delete_donation_listing_missing_param(client, db, affiliated_non_admin_
 
     assert response.status_code == status.HTTP_400_BAD_REQUEST
 
+def test_delete_donation_listing_many(client, db, affiliated_non_admin_user_token, trait_donations):
+    donation_ids = [trait_donations[(0,)].donation_id, trait_donations[(1,)].donation_id]
+
+    with CaptureQueriesContext(connection) as context:
+        response = client.delete(DONATION_URL,
+            HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key,
+            data={"donation_ids": donation_ids + [0]},
+            content_type='application/json')
+    updates = [q["sql"] for q in context.captured_queries if q["sql"].startswith("UPDATE")]
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {"deactivated": 2}
+    assert len(updates) == 1
+    assert set(Donation.objects.filter(deactivation_time__isnull=False).values_list('donation_id', flat=True)) == set(donation_ids)
+
+    # already deactivated listings are not counted again
+    response = client.delete(DONATION_URL,
+        HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key,
+        data={"donation_ids": donation_ids},
+        content_type='application/json')
+    assert response.data == {"deactivated": 0}
+
+def test_delete_donation_listing_all_of_org(client, db, affiliated_non_admin_user_token, trait_donations, organization):
+    response = client.delete(DONATION_URL,
+        HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key,
+        data={"org_id": organization.id},
+        content_type='application/json')
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {"deactivated": len(trait_donations)}
+    assert not Donation.objects.filter(deactivation_time__isnull=True).exists()
+
+def test_delete_donation_listing_many_invalid(client, db, affiliated_non_admin_user_token):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.delete(DONATION_URL, HTTP_AUTHORIZATION=auth,
+        data={"donation_ids": ["fake"]}, content_type='application/json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = client.delete(DONATION_URL, HTTP_AUTHORIZATION=auth,
+        data={"org_id": "fake"}, content_type='application/json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+"""
+Tests for the expire_donations command
+"""
+def test_expire_donations(db, organization):
+    now = datetime.now(tz=timezone.utc)
+    expired = Donation.objects.bulk_create([
+        Donation(
+            organization = organization,
+            description = DONATION_DESCRIPTION,
+            picture = "donations/" + DONATION_PIC_NAME,
+            expiration_date = now - timedelta(days=1),
+        ) for _ in range(5)])
+    fresh = Donation.objects.create(
+        organization = organization,
+        description = DONATION_DESCRIPTION,
+        picture = "donations/" + DONATION_PIC_NAME,
+        expiration_date = now + timedelta(days=1),
+    )
+    forever = Donation.objects.create(
+        organization = organization,
+        description = DONATION_DESCRIPTION,
+        picture = "donations/" + DONATION_PIC_NAME,
+    )
+
+    out = StringIO()
+    with CaptureQueriesContext(connection) as context:
+        call_command("expire_donations", "--batch-size", "2", stdout=out)
+    updates = [q["sql"] for q in context.captured_queries if q["sql"].startswith("UPDATE")]
+
+    assert "Deactivated 5 expired donations" in out.getvalue()
+    assert len(updates) == 3
+    assert Donation.objects.filter(pk__in=[d.pk for d in expired], deactivation_time__isnull=True).count() == 0
+    assert Donation.objects.filter(pk__in=[fresh.pk, forever.pk], deactivation_time__isnull=True).count() == 2
+
+def test_expire_donations_query_uses_index(db, seeded_listings):
+    now = datetime.now(tz=timezone.utc)
+    plan = Donation.objects.filter(expired_filter(now)).filter(active_filter(now)).values('pk')[:1000].explain()
+    assert "donation_expiring_idx" in plan, plan
+
+"""
+Tests for fields= on GET /api/listing/donations/ and /api/listing/requests/
+"""
+def test_get_donation_listing_fields(client, db, affiliated_non_admin_user_token, init_donation_listing2):
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(DONATION_URL, {"fields": "donation_id,description,picture"},
+            HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key)
+    donation = init_donation_listing2
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {
+        "donations": [{
+            "donation_id": donation.donation_id,
+            "description": donation.description,
+            "picture": donation.picture.url,
+        }]
+    }
+    selects = [q["sql"] for q in context.captured_queries if "listing_donation" in q["sql"]]
+    assert not any("listing_donationtraits" in sql for sql in selects)
+    listing_select = [sql for sql in selects if sql.startswith("SELECT \"listing_donation\".\"donation_id\"")][-1]
+    assert "search_vector" not in listing_select
+    assert "expiration_date" not in listing_select
+
+def test_get_request_listing_fields(client, db, affiliated_non_admin_user_token, init_request_listing2):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(REQUEST_URL, {"fields": "request_id,traits", "page_size": 10}, HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["requests"] == [{"request_id": init_request_listing2.request_id, "traits": [0]}]
+
+    response = client.get(REQUEST_URL, {"fields": "request_id,picture"}, HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+"""
+Tests for listing.fast_serializers
+"""
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_fast_serializers_render_like_drf(db, init_donation_listing2, init_request_listing2):
+    Donation.objects.create(
+        organization=init_donation_listing2.organization,
+        description="ready",
+        picture=make_picture(),
+        thumbnails_ready=True,
+    )
+    renderer = JSONRenderer()
+    for serializer_class, fast_class in [
+            (DonationSerializer, FastDonationSerializer),
+            (RequestSerializer, FastRequestSerializer)]:
+        queryset = serializer_class.listing_model.objects.order_by("pk")
+        for fields in [None, {"description", "traits"}, set(serializer_class.representation_columns)]:
+            drf = serializer_class(queryset, many=True, context={'fields': fields}).data
+            fast = fast_class(fields)
+            assert renderer.render(fast.represent(queryset.values(*fast.columns()))) == renderer.render(drf)
+
+@override_settings(LISTING_CACHE_TIMEOUT=0)
+def test_fast_serializer_needs_getters():
+    class FastNothingSerializer(FastListingSerializer):
+        listing_model = Request
+
+    with pytest.raises(TypeError):
+        FastNothingSerializer()
+
+def test_get_listings_fast_serializer(client, db, affiliated_non_admin_user_token, init_donation_listing2, init_request_listing2):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    for url, params in [
+            (DONATION_URL, {}),
+            (DONATION_URL, {"fields": "donation_id,thumbnails"}),
+            (DONATION_URL, {"page_size": 1}),
+            (DONATION_URL, {"stream": "true"}),
+            (REQUEST_URL, {"page_size": 1})]:
+        response = client.get(url, params, HTTP_AUTHORIZATION=auth)
+        with override_settings(LISTING_FAST_SERIALIZER=True):
+            fast_response = client.get(url, params, HTTP_AUTHORIZATION=auth)
+        assert fast_response.status_code == response.status_code == status.HTTP_200_OK
+        assert b"".join(fast_response) == b"".join(response)
+
+"""
+Tests for the orjson and MessagePack renderers
+"""
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_get_donation_listing_orjson(client, db, affiliated_non_admin_user_token, init_donation_listing2):
+    pytest.importorskip("orjson")
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(DONATION_URL, HTTP_AUTHORIZATION=auth)
+    assert response["Content-Type"] == "application/json"
+
+    fast_response = client.get(DONATION_URL, HTTP_AUTHORIZATION=auth, HTTP_ACCEPT="application/json; encoder=orjson")
+    assert fast_response.status_code == status.HTTP_200_OK
+    assert fast_response["Content-Type"] == "application/json; encoder=orjson"
+    assert fast_response.content == response.content
+    assert fast_response["ETag"] != response["ETag"]
+    assert "Accept" in fast_response["Vary"]
+
+    # served from the response cache, with the ETag of its own representation
+    cached_response = client.get(DONATION_URL, HTTP_AUTHORIZATION=auth, HTTP_ACCEPT="application/json; encoder=orjson")
+    assert cached_response.content == response.content
+    not_modified = client.get(DONATION_URL, HTTP_AUTHORIZATION=auth,
+        HTTP_ACCEPT="application/json; encoder=orjson", HTTP_IF_NONE_MATCH=fast_response["ETag"])
+    assert not_modified.status_code == status.HTTP_304_NOT_MODIFIED
+
+def test_orjson_renderer_escapes_separators():
+    pytest.importorskip("orjson")
+    data = {"description": "line\u2028paragraph\u2029end", "emoji": "\u00e9\U0001f34e"}
+    assert ORJSONRenderer().render(data) == JSONRenderer().render(data)
+
+def test_get_request_listing_msgpack(client, db, affiliated_non_admin_user_token, init_request_listing2):
+    msgpack = pytest.importorskip("msgpack")
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(REQUEST_URL, HTTP_AUTHORIZATION=auth)
+    packed_response = client.get(REQUEST_URL, HTTP_AUTHORIZATION=auth, HTTP_ACCEPT="application/msgpack")
+    assert packed_response.status_code == status.HTTP_200_OK
+    assert packed_response["Content-Type"] == "application/msgpack"
+    assert msgpack.unpackb(packed_response.content) == json.loads(response.content)
+
+    response = client.get(REQUEST_URL, {"status": "unknown"}, HTTP_AUTHORIZATION=auth, HTTP_ACCEPT="application/msgpack")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert msgpack.unpackb(response.content) == {"message": "Invalid status parameter value"}
+
+"""
+Tests for format=columnar on GET /api/listing/donations/ and /api/listing/requests/
+"""
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_get_donation_listing_columnar(client, db, affiliated_non_admin_user_token, init_donation_listing2):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    second = Donation.objects.create(
+        organization=init_donation_listing2.organization,
+        description="second",
+        picture=make_picture(),
+    )
+    DonationTraits.objects.create(donation=second, trait=0)
+    DonationTraits.objects.create(donation=second, trait=1)
+    rows = client.get(DONATION_URL, HTTP_AUTHORIZATION=auth).json()["donations"]
+
+    response = client.get(DONATION_URL, {"format": "columnar"}, HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_200_OK
+    assert response["Content-Type"] == "application/json"
+    donations = response.json()["donations"]
+    assert donations["count"] == 2
+    assert donations["dictionaries"] == {
+        "organization_id": [init_donation_listing2.organization.id],
+        "traits": [[0], [0, 1]],
+    }
+    assert donations["columns"]["organization_id"] == [0, 0]
+    assert donations["columns"]["traits"] == [0, 1]
+    assert donations["columns"]["donation_id"] == [row["donation_id"] for row in rows]
+    assert donations["columns"]["picture"] == [row["picture"] for row in rows]
+    assert len(response.content) < len(json.dumps({"donations": rows}))
+
+    response = client.get(DONATION_URL, {"format": "columnar", "fields": "description", "page_size": 1},
+        HTTP_AUTHORIZATION=auth)
+    assert response.json()["donations"] == {
+        "count": 1,
+        "columns": {"description": [DONATION_DESCRIPTION]},
+        "dictionaries": {},
+    }
+    assert response.json()["next"] is not None
+
+def test_get_request_listing_columnar_invalid(client, db, affiliated_non_admin_user_token, init_request_listing2):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(REQUEST_URL, {"format": "columnar", "stream": "true"}, HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == {"message": "Invalid format parameter value"}
+
+    response = client.get(REQUEST_URL, {"format": "columnar", "status": "unknown"}, HTTP_AUTHORIZATION=auth)
+    assert response.json() == {"message": "Invalid status parameter value"}
+
+"""
+Tests for the response compression middleware
+"""
+@override_settings(MEDIA_ROOT=(TEST_DIR), COMPRESSION_MIN_SIZE=100)
+def test_get_donation_listing_compressed(client, db, affiliated_non_admin_user_token, init_donation_listing2, monkeypatch):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(DONATION_URL, HTTP_AUTHORIZATION=auth)
+    assert not response.has_header("Content-Encoding")
+    assert "Accept-Encoding" in response["Vary"]
+
+    calls = []
+    compress = middleware.compress
+    monkeypatch.setattr(middleware, "compress",
+        lambda encoding, content: calls.append(encoding) or compress(encoding, content))
+    for _ in range(2):
+        gzipped = client.get(DONATION_URL, HTTP_AUTHORIZATION=auth, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        assert gzipped["Content-Encoding"] == "gzip"
+        assert gzip.decompress(gzipped.content) == response.content
+        assert gzipped["ETag"] == "W/" + response["ETag"]
+    # the second response reused the cached compressed body
+    assert calls == ["gzip"]
+
+    not_modified = client.get(DONATION_URL, HTTP_AUTHORIZATION=auth, HTTP_ACCEPT_ENCODING="gzip",
+        HTTP_IF_NONE_MATCH=gzipped["ETag"])
+    assert not_modified.status_code == status.HTTP_304_NOT_MODIFIED
+
+    # browsable API pages show the user and a CSRF token, they are compressed every time
+    calls.clear()
+    for _ in range(2):
+        html = client.get(DONATION_URL, HTTP_AUTHORIZATION=auth, HTTP_ACCEPT_ENCODING="gzip", HTTP_ACCEPT="text/html")
+        assert html["Content-Encoding"] == "gzip"
+    assert calls == ["gzip", "gzip"]
+
+def test_compression_middleware(rf):
+    content = b'{"description": "test description"}' * 100
+
+    def respond(request_kwargs, response_class=HttpResponse, **response_kwargs):
+        get_response = lambda request: response_class(**response_kwargs)
+        return CompressionMiddleware(get_response)(rf.get("/", **request_kwargs))
+
+    response = respond({"HTTP_ACCEPT_ENCODING": "gzip"}, content=content, content_type="application/json")
+    assert response["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.content) == content
+
+    response = respond({"HTTP_ACCEPT_ENCODING": "gzip"}, response_class=StreamingHttpResponse,
+        streaming_content=iter([content, content]), content_type="application/json")
+    assert response["Content-Encoding"] == "gzip"
+    assert gzip.decompress(b"".join(response.streaming_content)) == content * 2
+
+    for request_kwargs, response_kwargs in [
+            ({"HTTP_ACCEPT_ENCODING": "gzip;q=0, identity"}, {"content": content}),
+            ({}, {"content": content}),
+            ({"HTTP_ACCEPT_ENCODING": "gzip"}, {"content": content[:100]}),
+            ({"HTTP_ACCEPT_ENCODING": "gzip"}, {"content": content, "content_type": "image/jpeg"})]:
+        response = respond(request_kwargs, **response_kwargs)
+        assert not response.has_header("Content-Encoding")
+        assert response.content == response_kwargs["content"]
+
+def test_compression_middleware_brotli(rf):
+    brotli = pytest.importorskip("brotli")
+    content = b'{"description": "test description"}' * 100
+    get_response = lambda request: HttpResponse(content, content_type="application/json")
+    response = CompressionMiddleware(get_response)(rf.get("/", HTTP_ACCEPT_ENCODING="gzip, deflate, br"))
+    assert response["Content-Encoding"] == "br"
+    assert brotli.decompress(response.content) == content
+
+    get_response = lambda request: StreamingHttpResponse(iter([content, content]))
+    response = CompressionMiddleware(get_response)(rf.get("/", HTTP_ACCEPT_ENCODING="br"))
+    assert brotli.decompress(b"".join(response.streaming_content)) == content * 2
+
 """
 Tests for GET /api/listing/requests/
 """
@@ -429,6 +1591,71 @@ def test_get_request_listing_empty(client, db, affiliated_non_admin_user_token):
     response = client.get(REQUEST_URL + "?status=inactive", HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key)
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
+def test_get_request_listing_paginated(client, db, affiliated_non_admin_user_token, organization):
+    requests = [
+        Request.objects.create(
+            organization = organization,
+            description = REQUEST_DESCRIPTION + str(i),
+        ) for i in range(3)
+    ]
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+
+    response = client.get(REQUEST_URL + "?page_size=2", HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_200_OK
+    assert [r["request_id"] for r in response.data["requests"]] == [r.request_id for r in requests[:2]]
+
+    response = client.get(REQUEST_URL + "?page_size=2&cursor=" + response.data["next"], HTTP_AUTHORIZATION=auth)
+    assert [r["request_id"] for r in response.data["requests"]] == [requests[2].request_id]
+    assert response.data["next"] is None
+    assert response.data["prev"] is not None
+
+def test_get_request_listing_filter_by_traits(client, db, affiliated_non_admin_user_token, organization):
+    request = Request.objects.create(
+        organization = organization,
+        description = REQUEST_DESCRIPTION,
+        trait_mask = trait_mask([1]),
+    )
+    Request.objects.create(
+        organization = organization,
+        description = REQUEST_DESCRIPTION,
+    )
+    response = client.get(REQUEST_URL + "?traits=1", HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [r["request_id"] for r in response.data["requests"]] == [request.request_id]
+
+def test_get_request_listing_not_modified(client, db, affiliated_non_admin_user_token, init_request_listing, organization):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(REQUEST_URL, HTTP_AUTHORIZATION=auth)
+    etag = response["ETag"]
+    response = client.get(REQUEST_URL, HTTP_AUTHORIZATION=auth, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    client.post(REQUEST_URL,
+        HTTP_AUTHORIZATION=auth,
+        data={"org_id": organization.id, "description": REQUEST_DESCRIPTION, "traits": [0]})
+    response = client.get(REQUEST_URL, HTTP_AUTHORIZATION=auth, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response["ETag"] != etag
+
+@override_settings(LISTING_STREAM_CHUNK_SIZE=2)
+def test_get_request_listing_stream(client, db, affiliated_non_admin_user_token, init_request_listing, init_request_listing2):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(REQUEST_URL + "?status=active", HTTP_AUTHORIZATION=auth)
+    streamed = client.get(REQUEST_URL + "?status=active&stream=true", HTTP_AUTHORIZATION=auth)
+
+    assert b"".join(streamed.streaming_content) == response.content
+
+def test_get_request_listing_search(client, db, affiliated_non_admin_user_token, organization):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    client.post(REQUEST_URL, HTTP_AUTHORIZATION=auth,
+        data={"org_id": organization.id, "description": "need baby formula", "traits": [0]})
+    client.post(REQUEST_URL, HTTP_AUTHORIZATION=auth,
+        data={"org_id": organization.id, "description": "need rice", "traits": [0]})
+    response = client.get(REQUEST_URL + "?q=formula", HTTP_AUTHORIZATION=auth)
+
+    assert [r["description"] for r in response.data["requests"]] == ["need baby formula"]
+
 """
 Tests for POST /api/listing/requests/
 """
@@ -455,6 +1682,7 @@ def test_create_request_listing_valid(client, db, affiliated_non_admin_user_toke
     assert created_request.organization.id == org_id
     assert created_request.description == description
     assert [traits[0]["trait"],traits[1]["trait"]] == [trait1, trait2]
+    assert created_request.trait_mask == trait_mask([trait1, trait2])
     assert created_request.deactivation_time == None
 
 def test_create_request_listing_org_invalid(client, db, affiliated_non_admin_user_token):
@@ -474,6 +1702,40 @@ def test_create_request_listing_org_invalid(client, db, affiliated_non_admin_use
 
     assert response.status_code == status.HTTP_400_BAD_REQUEST
 
+"""
+Tests for POST /api/listing/requests/bulk/
+"""
+def test_bulk_create_request_listing_valid(client, db, affiliated_non_admin_user_token, organization):
+    items = [
+        {"org_id": organization.id, "description": "bulk " + str(i), "traits": [i % 2]}
+        for i in range(4)
+    ]
+    response = client.post(REQUEST_BULK_URL,
+        HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key,
+        data={"requests": items},
+        content_type='application/json')
+
+    assert response.status_code == status.HTTP_201_CREATED
+    request_ids = [item["request_id"] for item in response.data["requests"]]
+    created = list(Request.objects.filter(request_id__in=request_ids).order_by('request_id'))
+    assert [r.trait_mask for r in created] == [trait_mask([i % 2]) for i in range(4)]
+    assert list(RequestTraits.objects.filter(request__in=created).order_by('request_id').values_list('trait', flat=True)) == [0, 1, 0, 1]
+
+def test_bulk_create_request_listing_org_invalid(client, db, affiliated_non_admin_user_token, organization):
+    items = [
+        {"org_id": organization.id, "description": "bulk", "traits": [0]},
+        {"org_id": "fake", "description": "bulk", "traits": [0]},
+    ]
+    response = client.post(REQUEST_BULK_URL,
+        HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key,
+        data={"requests": items},
+        content_type='application/json')
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["errors"][0] is None
+    assert "org_id" in response.data["errors"][1]
+    assert not Request.objects.exists()
+
 """
 Tests for DELETE /api/listing/requests/
 """
@@ -514,4 +1776,415 @@ def test_delete_request_listing_missing_param(client, db, affiliated_non_admin_u
         data=post_data,
         content_type='application/json')
 
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
\ No newline at end of file
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_delete_request_listing_many(client, db, affiliated_non_admin_user_token, init_request_listing, init_request_listing2):
+    response = client.delete(REQUEST_URL,
+        HTTP_AUTHORIZATION='Token ' + affiliated_non_admin_user_token.key,
+        data={"request_ids": [init_request_listing.request_id, init_request_listing2.request_id]},
+        content_type='application/json')
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {"deactivated": 2}
+    assert not Request.objects.filter(deactivation_time__isnull=True).exists()
+
+def test_soft_delete_inactive_request(db, organization):
+    serializer = RequestSerializer(data={"org_id": organization.id, "description": REQUEST_DESCRIPTION, "traits": [0]})
+    serializer.is_valid(raise_exception=True)
+    request = serializer.save()
+    deactivation_time = RequestSerializer(request).soft_delete(request).deactivation_time
+    assert deactivation_time is not None
+
+    # already inactive: neither deactivated again nor counted twice
+    assert RequestSerializer(request).soft_delete(request).deactivation_time == deactivation_time
+    counters = ListingCounter.objects.filter(organization=organization, listing_type=ListingType.REQUEST)
+    assert sorted(counters.values_list('trait', 'active', 'inactive')) == [(ListingCounter.TOTAL, 0, 1), (0, 0, 1)]
+    assert ListingChange.objects.filter(listing_id=request.pk, action=ChangeAction.DEACTIVATED).count() == 1
+
+def test_delete_request_listing_concurrent(transactional_db, organization):
+    serializer = RequestSerializer(data={"org_id": organization.id, "description": REQUEST_DESCRIPTION, "traits": [0]})
+    serializer.is_valid(raise_exception=True)
+    listing = serializer.save()
+    results = []
+
+    def deactivate_again():
+        try:
+            results.append(soft_delete_listings(Request.objects.filter(pk=listing.pk)))
+        finally:
+            connection.close()
+
+    with transaction.atomic():
+        assert soft_delete_listings(Request.objects.filter(pk=listing.pk)) == 1
+        other = threading.Thread(target=deactivate_again)
+        other.start()
+        # let the second UPDATE block on the row lock held by this transaction
+        time.sleep(0.5)
+    other.join()
+
+    assert results == [0]
+    counters = ListingCounter.objects.filter(organization=organization, listing_type=ListingType.REQUEST)
+    assert sorted(counters.values_list('trait', 'active', 'inactive')) == [(ListingCounter.TOTAL, 0, 1), (0, 0, 1)]
+    assert ListingChange.objects.filter(listing_id=listing.pk, action=ChangeAction.DEACTIVATED).count() == 1
+
+"""
+Tests for GET /api/listing/requests/<id>/matches/
+"""
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_request_matches(client, db, affiliated_non_admin_user_token, organization,
+        django_capture_on_commit_callbacks):
+    organization.latitude, organization.longitude = 43.0731, -89.4012
+    organization.save()
+    far_org = Organization.objects.create(name=ORG_NAME, address=ORG_ADDRESS, email=ORG_EMAIL,
+        phone=ORG_PHONE, url=ORG_URL, latitude=40.7128, longitude=-74.0060)
+    now = datetime.now(tz=timezone.utc)
+
+    def donate(org, traits, expires_in_days):
+        serializer = DonationSerializer(data={
+            "org_id": org.id,
+            "description": DONATION_DESCRIPTION,
+            "picture": make_picture(),
+            "expiration_date": now + timedelta(days=expires_in_days),
+            "traits": traits,
+        })
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def request_for(org, traits):
+        serializer = RequestSerializer(data={"org_id": org.id, "description": REQUEST_DESCRIPTION, "traits": traits})
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    # pairing runs once the listings are committed
+    with django_capture_on_commit_callbacks(execute=True):
+        # created before the request, paired when the request is created
+        one_trait_late = donate(organization, [0], 3)
+        donate(far_org, [0, 1], 3)
+        request = request_for(organization, [0, 1])
+    with django_capture_on_commit_callbacks(execute=True):
+        # created after the request, paired when the donation is created
+        two_traits = donate(organization, [0, 1], 5)
+        one_trait_soon = donate(organization, [1], 1)
+
+    url = REQUEST_URL + str(request.request_id) + "/matches/"
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(url, HTTP_AUTHORIZATION=auth)
+
+    assert response.status_code == status.HTTP_200_OK
+    matches = response.data["matches"]
+    assert [m["donation"]["donation_id"] for m in matches] == [
+        two_traits.donation_id, one_trait_soon.donation_id, one_trait_late.donation_id]
+    assert [m["trait_overlap"] for m in matches] == [2, 1, 1]
+    assert matches[0]["distance_km"] == 0
+    assert matches[0]["donation"]["traits"] == [0, 1]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        client.delete(DONATION_URL, HTTP_AUTHORIZATION=auth,
+            data={"donation_id": two_traits.donation_id}, content_type='application/json')
+    response = client.get(url, {"limit": 1}, HTTP_AUTHORIZATION=auth)
+    assert [m["donation"]["donation_id"] for m in response.data["matches"]] == [one_trait_soon.donation_id]
+
+    out = StringIO()
+    call_command("rebuild_matches", stdout=out)
+    assert "2 before, 2 now" in out.getvalue()
+
+    client.delete(REQUEST_URL, HTTP_AUTHORIZATION=auth,
+        data={"request_id": request.request_id}, content_type='application/json')
+    response = client.get(url, HTTP_AUTHORIZATION=auth)
+    assert response.data["matches"] == []
+
+    # only the best LISTING_MATCH_CANDIDATES are kept, the next best takes
+    # the place of a deactivated one
+    with override_settings(LISTING_MATCH_CANDIDATES=1):
+        with django_capture_on_commit_callbacks(execute=True):
+            request = request_for(organization, [0, 1])
+        assert list(MatchCandidate.objects.filter(request=request).values_list('donation_id', flat=True)) == [
+            one_trait_soon.donation_id]
+        with django_capture_on_commit_callbacks(execute=True):
+            later = donate(organization, [0, 1], 2)
+        assert list(MatchCandidate.objects.filter(request=request).values_list('donation_id', flat=True)) == [
+            later.donation_id]
+        with django_capture_on_commit_callbacks(execute=True):
+            client.delete(DONATION_URL, HTTP_AUTHORIZATION=auth,
+                data={"donation_id": later.donation_id}, content_type='application/json')
+        assert list(MatchCandidate.objects.filter(request=request).values_list('donation_id', flat=True)) == [
+            one_trait_soon.donation_id]
+
+def test_request_matches_pairing_fails(client, db, affiliated_non_admin_user_token, organization,
+        django_capture_on_commit_callbacks, monkeypatch, caplog):
+    def fail(request_ids):
+        raise RuntimeError("pairing failed")
+
+    monkeypatch.setattr(matching, "match_requests", fail)
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(REQUEST_URL, HTTP_AUTHORIZATION=auth, data={
+            "org_id": organization.id,
+            "description": REQUEST_DESCRIPTION,
+            "traits": [0],
+        })
+    # the request is committed by then, the failure is only logged
+    assert response.status_code == status.HTTP_201_CREATED
+    assert Request.objects.filter(request_id=response.data["request_id"]).exists()
+    assert "rebuild_matches" in caplog.text
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_listing_queries_skip_search_vector(client, db, affiliated_non_admin_user_token, organization,
+        django_capture_on_commit_callbacks):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    with django_capture_on_commit_callbacks(execute=True):
+        client.post(DONATION_URL, HTTP_AUTHORIZATION=auth, data={
+            "org_id": organization.id,
+            "description": DONATION_DESCRIPTION,
+            "picture": make_picture(),
+            "expiration_date": datetime.now(tz=timezone.utc) + timedelta(days=1),
+            "traits": [0],
+        })
+        request_id = client.post(REQUEST_URL, HTTP_AUTHORIZATION=auth, data={
+            "org_id": organization.id,
+            "description": REQUEST_DESCRIPTION,
+            "traits": [0],
+        }).data["request_id"]
+
+    with CaptureQueriesContext(connection) as context:
+        assert len(client.get(DONATION_URL, HTTP_AUTHORIZATION=auth).data["donations"]) == 1
+        assert len(client.get(REQUEST_URL, HTTP_AUTHORIZATION=auth).data["requests"]) == 1
+        assert len(client.get(CHANGES_URL, {"since": 0}, HTTP_AUTHORIZATION=auth).data["changes"]) == 2
+        assert len(client.get(REQUEST_URL + str(request_id) + "/matches/",
+            HTTP_AUTHORIZATION=auth).data["matches"]) == 1
+    # the tsvector is never sent back to Python
+    assert not any("search_vector" in q["sql"] for q in context.captured_queries)
+
+def test_request_matches_invalid(client, db, affiliated_non_admin_user_token, init_request_listing):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(REQUEST_URL + "0/matches/", HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = client.get(REQUEST_URL + str(init_request_listing.request_id) + "/matches/", {"limit": "fake"},
+        HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+"""
+Tests for GET /api/listing/changes/
+"""
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_get_listing_changes(client, db, affiliated_non_admin_user_token, organization):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    response = client.get(CHANGES_URL, HTTP_AUTHORIZATION=auth)
+    assert response.status_code == status.HTTP_200_OK
+    cursor = response.data["cursor"]
+    assert response.data["changes"] == []
+
+    donation_id = client.post(DONATION_URL, HTTP_AUTHORIZATION=auth, data={
+        "org_id": organization.id,
+        "description": DONATION_DESCRIPTION,
+        "picture": make_picture(),
+        "expiration_date": DONATION_EXPIREATION,
+        "traits": [1],
+    }).data["donation_id"]
+    request_id = client.post(REQUEST_URL, HTTP_AUTHORIZATION=auth, data={
+        "org_id": organization.id,
+        "description": REQUEST_DESCRIPTION,
+        "traits": [0],
+    }).data["request_id"]
+    client.delete(DONATION_URL, HTTP_AUTHORIZATION=auth,
+        data={"donation_id": donation_id}, content_type='application/json')
+
+    response = client.get(CHANGES_URL, {"since": cursor}, HTTP_AUTHORIZATION=auth)
+
+    assert response.status_code == status.HTTP_200_OK
+    changes = response.data["changes"]
+    assert [(c["type"], c["id"], c["action"]) for c in changes] == [
+        ("donation", donation_id, "created"),
+        ("request", request_id, "created"),
+        ("donation", donation_id, "deactivated"),
+    ]
+    assert [c["seq"] for c in changes] == sorted(c["seq"] for c in changes)
+    assert all(c["organization_id"] == organization.id for c in changes)
+    assert changes[0]["listing"]["traits"] == [1]
+    assert changes[1]["listing"]["description"] == REQUEST_DESCRIPTION
+    assert changes[2]["listing"] is None
+    assert response.data["cursor"] == changes[-1]["seq"]
+    assert not response.data["has_more"]
+
+    response = client.get(CHANGES_URL, {"since": cursor, "limit": 2}, HTTP_AUTHORIZATION=auth)
+    assert len(response.data["changes"]) == 2
+    assert response.data["has_more"]
+    response = client.get(CHANGES_URL, {"since": response.data["cursor"]}, HTTP_AUTHORIZATION=auth)
+    assert [c["action"] for c in response.data["changes"]] == ["deactivated"]
+
+    response = client.get(CHANGES_URL, {"since": response.data["cursor"]}, HTTP_AUTHORIZATION=auth)
+    assert response.data["changes"] == []
+
+def test_get_listing_changes_invalid(client, db, affiliated_non_admin_user_token):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    for params in [{"since": "fake"}, {"since": -1}, {"since": 0, "limit": 0}]:
+        response = client.get(CHANGES_URL, params, HTTP_AUTHORIZATION=auth)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+"""
+Tests for GET /api/listing/stats/ and the reconcile_listing_stats command
+"""
+STATS_URL="/api/listing/stats/"
+
+@override_settings(MEDIA_ROOT=(TEST_DIR))
+def test_listing_stats(client, db, affiliated_non_admin_user_token, organization):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    items = [{
+        "org_id": organization.id,
+        "description": "bulk " + str(i),
+        "picture": "picture_" + str(i),
+        "expiration_date": (timezone.now() + timedelta(days=1)).isoformat(),
+        "traits": traits,
+    } for i, traits in enumerate([[0], [0, 1], []])]
+    post_data = {"donations": json.dumps(items)}
+    for i in range(3):
+        post_data["picture_" + str(i)] = make_picture()
+    response = client.post(DONATION_BULK_URL, HTTP_AUTHORIZATION=auth, data=post_data)
+    assert response.status_code == status.HTTP_201_CREATED
+    first_donation = response.data["donations"][1]["donation_id"]
+    for traits in [[1], [1]]:
+        response = client.post(REQUEST_URL, HTTP_AUTHORIZATION=auth,
+            data={"org_id": organization.id, "description": REQUEST_DESCRIPTION, "traits": traits})
+        assert response.status_code == status.HTTP_201_CREATED
+    client.delete(DONATION_URL, HTTP_AUTHORIZATION=auth,
+        data={"donation_id": first_donation}, content_type='application/json')
+
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(STATS_URL, {"org_id": organization.id}, HTTP_AUTHORIZATION=auth)
+    assert not any("listing_donation" in q["sql"] or "listing_request" in q["sql"] for q in context.captured_queries)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {
+        "organization_id": organization.id,
+        "donations": {"active": 2, "inactive": 1, "traits": [
+            {"trait": 0, "active": 1, "inactive": 1},
+            {"trait": 1, "active": 0, "inactive": 1},
+        ]},
+        "requests": {"active": 2, "inactive": 0, "traits": [
+            {"trait": 0, "active": 0, "inactive": 0},
+            {"trait": 1, "active": 2, "inactive": 0},
+        ]},
+    }
+
+    stdout = StringIO()
+    call_command('reconcile_listing_stats', stdout=stdout)
+    assert stdout.getvalue().startswith("0 of ")
+
+def test_listing_stats_invalid(client, db, affiliated_non_admin_user_token):
+    auth = 'Token ' + affiliated_non_admin_user_token.key
+    for params in [{}, {"org_id": "fake"}, {"org_id": 0}]:
+        response = client.get(STATS_URL, params, HTTP_AUTHORIZATION=auth)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data == {"message": "Invalid org_id parameter value"}
+
+def test_reconcile_listing_stats(db, organization):
+    serializer = RequestSerializer(data={"org_id": organization.id, "description": REQUEST_DESCRIPTION, "traits": [0]})
+    serializer.is_valid(raise_exception=True)
+    serializer.save()
+    # written behind the signals' back
+    Request.objects.create(organization=organization, description=REQUEST_DESCRIPTION, trait_mask=trait_mask([0]))
+    counter = ListingCounter.objects.get(organization=organization, listing_type=ListingType.REQUEST,
+        trait=ListingCounter.TOTAL)
+    assert counter.active == 1
+
+    stdout = StringIO()
+    call_command('reconcile_listing_stats', '--dry-run', stdout=stdout)
+    assert "stored 1 active / 0 inactive, counted 2 / 0" in stdout.getvalue()
+    assert "2 of 2 counters drifted (dry run)" in stdout.getvalue()
+    counter.refresh_from_db()
+    assert counter.active == 1
+
+    call_command('reconcile_listing_stats', stdout=StringIO())
+    counters = ListingCounter.objects.filter(organization=organization, listing_type=ListingType.REQUEST)
+    assert sorted(counters.values_list('trait', 'active', 'inactive')) == [(ListingCounter.TOTAL, 2, 0), (0, 2, 0)]
+
+"""
+Tests for the /api/listing/events/ stream
+"""
+def stream_events(query_string, headers, during, count, timeout=5):
+    """
+    Connect to the event stream, call during() once subscribed and return
+    the response messages once count events were sent. The stream reads the
+    database from another thread, so callers need transactional_db
+    """
+    messages = []
+    disconnected = None
+
+    async def receive():
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    def sent_events():
+        return [m for m in messages if m.get('body', b'').startswith(b'id:')]
+
+    async def run():
+        nonlocal disconnected
+        disconnected = asyncio.Event()
+        scope = {'type': 'http', 'path': events.EVENTS_PATH, 'query_string': query_string, 'headers': headers}
+        app = asyncio.ensure_future(events.events_application(scope, receive, send))
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while not app.done() and events.broker.seq is None and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        if not app.done():
+            await sync_to_async(during)()
+            while len(sent_events()) < count and loop.time() < deadline:
+                await asyncio.sleep(0.01)
+        disconnected.set()
+        await asyncio.wait_for(app, timeout)
+        # let the poller see that nobody is subscribed any more
+        if events.broker.poller is not None and not events.broker.poller.done():
+            await asyncio.wait_for(events.broker.poller, timeout)
+
+    try:
+        async_to_sync(run)()
+    finally:
+        # the app and the poller run their queries on asgiref's sync thread,
+        # on a connection of its own which would keep the test database open
+        SyncToAsync.single_thread_executor.submit(connections.close_all).result()
+    return messages, [json.loads(m['body'].decode('utf-8').split('data: ')[1]) for m in sent_events()]
+
+@override_settings(LISTING_EVENTS_POLL_INTERVAL=0.01)
+def test_event_stream(transactional_db, affiliated_non_admin_user_token, organization):
+    def create_requests():
+        for traits in [[0], [1], [0, 1]]:
+            serializer = RequestSerializer(data={
+                "org_id": organization.id,
+                "description": REQUEST_DESCRIPTION,
+                "traits": traits,
+            })
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+    messages, sent = stream_events(
+        b"traits=1&org_id=" + str(organization.id).encode() + b"&token=" + affiliated_non_admin_user_token.key.encode(),
+        [], create_requests, count=2)
+
+    assert messages[0]["status"] == 200
+    assert dict(messages[0]["headers"])[b"content-type"] == b"text/event-stream"
+    assert [(event["type"], event["action"], event["traits"]) for event in sent] == [
+        ("request", "created", [1]),
+        ("request", "created", [0, 1]),
+    ]
+    assert all(event["organization_id"] == organization.id for event in sent)
+
+def test_event_stream_cors(transactional_db, affiliated_non_admin_user_token):
+    query_string = b"token=" + affiliated_non_admin_user_token.key.encode()
+    messages, _ = stream_events(query_string, [(b"origin", b"http://localhost:3000")], lambda: None, count=0)
+    headers = dict(messages[0]["headers"])
+    assert headers[b"access-control-allow-origin"] == b"http://localhost:3000"
+    assert headers[b"vary"] == b"Origin"
+
+    messages, _ = stream_events(query_string, [(b"origin", b"http://example.com")], lambda: None, count=0)
+    assert messages[0]["status"] == 200
+    assert b"access-control-allow-origin" not in dict(messages[0]["headers"])
+
+def test_event_stream_unauthenticated(transactional_db):
+    messages, _ = stream_events(b"", [(b"authorization", b"Token fake")], lambda: None, count=0)
+    assert messages[0]["status"] == 401
+
+def test_event_stream_invalid_filter(transactional_db, affiliated_non_admin_user_token):
+    messages, _ = stream_events(b"traits=9",
+        [(b"authorization", ("Token " + affiliated_non_admin_user_token.key).encode())], lambda: None, count=0)
+    assert messages[0]["status"] == 400
@@ -0,0 +1,105 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.dispatch import receiver
+from PIL import Image
+from six import BytesIO
+
+from listing import response_cache
+from listing.models import Donation
+from listing.signals import listings_created
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+def sizes():
+    """
+    {label: longest side in pixels} of the thumbnails made for each picture
+    """
+    return settings.LISTING_THUMBNAIL_SIZES
+
+def thumbnail_name(picture_name, label):
+    """
+    Thumbnails are stored next to the original: donations/x.jpg -> donations/x_small.jpg
+    """
+    root, _ = os.path.splitext(picture_name)
+    return "%s_%s.jpg" % (root, label)
+
+def thumbnail_urls(picture, ready):
+    """
+    {label: url} for the representation, the original picture until the thumbnails exist
+    """
+    if not ready:
+        return {label: picture.url for label in sizes()}
+    return {label: picture.storage.url(thumbnail_name(picture.name, label)) for label in sizes()}
+
+def generate_thumbnails(donation_ids):
+    """
+    Write every thumbnail size for the donations and mark them ready. A
+    picture that cannot be read is logged and skipped, its donation keeps
+    serving the original
+    """
+    ready = []
+    org_ids = set()
+    for donation in Donation.objects.filter(donation_id__in=donation_ids).only('donation_id', 'organization_id', 'picture'):
+        org_ids.add(donation.organization_id)
+        storage = donation.picture.storage
+        names = {label: thumbnail_name(donation.picture.name, label) for label in sizes()}
+        # pictures are content addressed, another donation with the same
+        # picture may already have made them
+        if all(storage.exists(name) for name in names.values()):
+            ready.append(donation.donation_id)
+            continue
+        try:
+            with storage.open(donation.picture.name, 'rb') as picture_file:
+                original = Image.open(picture_file)
+                original.load()
+            if original.mode not in ('RGB', 'L'):
+                original = original.convert('RGB')
+            for label, size in sizes().items():
+                image = original.copy()
+                image.thumbnail((size, size))
+                output = BytesIO()
+                image.save(output, 'JPEG', quality=settings.LISTING_THUMBNAIL_QUALITY)
+                # named after the picture, not content addressed themselves
+                storage.replace(names[label], ContentFile(output.getvalue()))
+        except (OSError, Image.DecompressionBombError):
+            logger.exception("Cannot make the thumbnails of donation %s (%s)",
+                donation.donation_id, donation.picture.name)
+            continue
+        ready.append(donation.donation_id)
+    if Donation.objects.filter(donation_id__in=ready, thumbnails_ready=False).update(thumbnails_ready=True):
+        # the cached representations still point at the original pictures
+        response_cache.invalidate(response_cache.ENDPOINTS[Donation], org_ids)
+    return ready
+
+def _generate_in_worker(donation_ids):
+    try:
+        generate_thumbnails(donation_ids)
+    finally:
+        # worker threads get their own connection, don't leave it open
+        connection.close()
+
+def schedule(donation_ids):
+    """
+    Generate the thumbnails once the transaction that created the donations
+    commits, on a thread pool so the request does not wait for Pillow.
+    LISTING_THUMBNAIL_WORKERS = 0 runs them inline instead
+    """
+    global _executor
+    workers = settings.LISTING_THUMBNAIL_WORKERS
+    if workers == 0:
+        transaction.on_commit(lambda: generate_thumbnails(donation_ids))
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+    transaction.on_commit(lambda: _executor.submit(_generate_in_worker, donation_ids))
+
+@receiver(listings_created, sender=Donation)
+def schedule_thumbnails(sender, listings, **kwargs):
+    schedule([donation.donation_id for donation in listings])
@@ -4,5 +4,11 @@ from . import views
 app_name = 'listing'
 urlpatterns=[
     path('donations/', views.DonationView.as_view(), name='donations'),
+    path('donations/bulk/', views.DonationBulkView.as_view(), name='donations_bulk'),
     path('requests/', views.RequestView.as_view(), name='requests'),
+    path('requests/bulk/', views.RequestBulkView.as_view(), name='requests_bulk'),
+    path('requests/<int:request_id>/matches/', views.RequestMatchesView.as_view(), name='request_matches'),
+    path('changes/', views.ListingChangesView.as_view(), name='changes'),
+    path('stats/', views.ListingStatsView.as_view(), name='stats'),
+    path('cache/stats/', views.ListingCacheStatsView.as_view(), name='cache_stats'),
 ]
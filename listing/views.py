@@ -1,22 +1,164 @@
+import json
 from datetime import datetime
+from hashlib import md5
+from itertools import chain, islice
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Case, Count, F, FloatField, Max, Q, Value, When
+from django.db.models.functions import Cast
+from django.http import StreamingHttpResponse
 from django.utils import timezone
-from rest_framework.permissions import IsAuthenticated
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 
-from identity.models import Organization
-from listing.models import Donation, Request
-from listing.serializers import DonationSerializer, RequestSerializer
+from identity.models import Organization, organizations_near
+from listing import changes, matching, response_cache, stats
+from listing.models import (
+    SEARCH_CONFIG, ChangeAction, Donation, ListingChange, ListingType, MatchCandidate, Request, TraitType,
+    active_filter, inactive_filter, masks_matching, trait_mask)
+from listing.fast_serializers import FastDonationSerializer, FastRequestSerializer
+from listing.pagination import KeysetPagination
+from listing.renderers import ColumnarRenderer
+from listing.serializers import DonationSerializer, RequestSerializer, soft_delete_listings
 
-class DonationView(APIView):
+class ListingView(APIView):
+    """
+    Shared GET for the listing endpoints: filter by org_id, status, traits,
+    a q= text search and near=lat,lon&radius=km, then return either the full
+    list or, when a cursor or page_size is passed, one keyset page ordered by
+    (creation_time, <listing id>), or by search rank when q is given, or by
+    distance when near is given. With stream=true the full list is written
+    out in chunks instead of being built in memory. fields=a,b restricts
+    each listing to those keys and the query to the columns they need, and
+    format=columnar returns one array per field (see listing.renderers)
+    """
     permission_classes = (IsAuthenticated,)
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, ColumnarRenderer]
+    model = None
+    serializer_class = None
+    fast_serializer_class = None
+    listing_key = None
+    id_field = None
+    ordering = None
+    requested_fields = None
+    # aggregates over the filtered listings for state that can change the
+    # representation without creating or deactivating a listing
+    validator_aggregates = {}
+
+    def get_ordering(self):
+        if self.ordering is not None:
+            return self.ordering
+        return ('creation_time', self.id_field)
+
+    def get_serializer_context(self):
+        return {'fields': self.requested_fields}
+
+    def select_rows(self, queryset):
+        """
+        The queryset the listings are read from: values() rows for the fast
+        serializer (LISTING_FAST_SERIALIZER), model instances otherwise
+        """
+        if not settings.LISTING_FAST_SERIALIZER:
+            return self.restrict_columns(queryset)
+        columns = self.fast_serializer_class(self.requested_fields).columns()
+        ordering = [name for name in (f.lstrip('-') for f in self.get_ordering()) if name not in columns]
+        return queryset.values(*columns, *ordering)
+
+    def serialize(self, rows):
+        if settings.LISTING_FAST_SERIALIZER:
+            return self.fast_serializer_class(self.requested_fields).represent(rows)
+        return self.serializer_class(rows, many=True, context=self.get_serializer_context()).data
+
+    def restrict_columns(self, queryset):
+        """
+        SELECT only the columns read by the requested fields and the ordering
+        """
+        if self.requested_fields is None:
+            return queryset
+        columns = {self.id_field}
+        for field in self.requested_fields:
+            columns.update(self.serializer_class.representation_columns[field])
+        model_fields = {field.name for field in self.model._meta.concrete_fields}
+        # annotations such as rank and distance are selected anyway
+        columns.update(name for name in (f.lstrip('-') for f in self.get_ordering()) if name in model_fields)
+        return queryset.only(*columns)
+
+    def get_validators(self, request, queryset):
+        """
+        ETag for the filtered listings, from one aggregate query over the same
+        (indexed) filter. Listings are only ever created or deactivated, so the
+        row count with the latest creation and deactivation times changes
+        whenever the response would. No Last-Modified: under status=active
+        deactivating any but the newest listing moves none of these times, and
+        its one second resolution misses listings created in the same second
+        """
+        summary = queryset.aggregate(
+            count=Count(self.id_field),
+            last_created=Max('creation_time'),
+            last_deactivated=Max('deactivation_time'),
+            **self.validator_aggregates)
+        fingerprint = "|".join([
+            request.get_full_path(),
+            # one ETag per representation: JSON, MessagePack, ...
+            request.accepted_media_type,
+            str(summary['count']),
+            str(summary['last_created']),
+            str(summary['last_deactivated']),
+            *(str(summary[name]) for name in self.validator_aggregates),
+        ])
+        return quote_etag(md5(fingerprint.encode('utf-8')).hexdigest())
+
+    def set_validators(self, response, etag):
+        if not status.is_success(response.status_code):
+            return response
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    def cached_response(self, response, cache_key, etag):
+        # the compression middleware keeps the compressed body next to the entry
+        response.compression_cache_key = cache_key
+        return self.set_validators(response, etag)
 
     def get(self, request, format=None, **kwargs):
+        streaming = request.query_params.get('stream', None) == 'true'
+        if streaming and request.accepted_renderer.format == ColumnarRenderer.format:
+            # the stream is written row by row, bypassing the renderers
+            return Response(
+                {"message": "Invalid format parameter value"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # only valid requests are cached, so a hit can skip validation and the database
+        cache_key, cached = (None, None) if streaming else response_cache.lookup(self.listing_key, request)
+        if cached is not None:
+            etag, data, status_code = cached
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return not_modified
+            return self.cached_response(Response(data, status=status_code), cache_key, etag)
+
+        fields = request.query_params.get('fields', None)
+        if fields is not None:
+            fields = [field for field in fields.split(',') if field]
+            if not fields or not set(fields) <= set(self.serializer_class.representation_columns):
+                return Response(
+                    {"message": "Invalid fields parameter value"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            self.requested_fields = set(fields)
+
         org_id = request.query_params.get('org_id', None)
-        donation_status = request.query_params.get('status', None)
-        all_donations = Donation.objects.all()
-        donations_filtered = all_donations
+        listing_status = request.query_params.get('status', None)
+        # the tsvector is only read by the q= filter, in SQL
+        listings_filtered = self.model.objects.defer('search_vector')
         if org_id is not None:
             try:
                 org = Organization.objects.get(id=org_id)
@@ -25,98 +167,232 @@ class DonationView(APIView):
                     {"message": "Invalid org_id parameter value"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            donations_filtered = all_donations.filter(organization=org)
+            listings_filtered = listings_filtered.filter(organization=org)
 
-        if donation_status is not None:
+        if listing_status is not None:
             # validate if the status is in "active" or "inactive"
-            if donation_status not in ["active", "inactive"]:
+            if listing_status not in ["active", "inactive"]:
                 return Response(
                     {"message": "Invalid status parameter value"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            if donation_status == "active":
-                donations_filtered = donations_filtered.exclude(deactivation_time__lte=datetime.now(tz=timezone.utc))
-            elif donation_status == "inactive":
-                donations_filtered = donations_filtered.filter(deactivation_time__lte=datetime.now(tz=timezone.utc))
+            if listing_status == "active":
+                listings_filtered = listings_filtered.filter(active_filter(datetime.now(tz=timezone.utc)))
+            elif listing_status == "inactive":
+                listings_filtered = listings_filtered.filter(inactive_filter(datetime.now(tz=timezone.utc)))
 
-        # if query set emtpy 
-        if not donations_filtered:
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        traits = request.query_params.get('traits', None)
+        if traits is not None:
+            # traits=0,1 with traits_match=any (default) or all
+            traits_match = request.query_params.get('traits_match', 'any')
+            try:
+                trait_list = [int(trait) for trait in traits.split(',')]
+            except ValueError:
+                trait_list = None
+            if not trait_list or not set(trait_list) <= set(TraitType.values):
+                return Response(
+                    {"message": "Invalid traits parameter value"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if traits_match not in ["any", "all"]:
+                return Response(
+                    {"message": "Invalid traits_match parameter value"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            listings_filtered = listings_filtered.filter(
+                trait_mask__in=masks_matching(trait_mask(trait_list), match_all=(traits_match == "all")))
 
-        serializer = DonationSerializer(donations_filtered, many=True)
-        return Response(
-                    {"donations": serializer.data},
-                    status=status.HTTP_200_OK
+        search = request.query_params.get('q', None)
+        if search is not None:
+            if not search.strip():
+                return Response(
+                    {"message": "Invalid q parameter value"},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-        
-    def post(self, request, format=None):
-        serializer = DonationSerializer(data=request.data)
-        if serializer.is_valid():
-            created_donation = serializer.save()
-            return Response({"donation_id": created_donation.donation_id}, status=status.HTTP_201_CREATED)
-        errors = serializer.errors
-        key = list(errors.keys())[0]
-        return Response(
-            {"message": "for key " + key + " "+  str(errors[key])},
-            status=status.HTTP_400_BAD_REQUEST)
+            # matched through the GIN index on search_vector, best matches first
+            query = SearchQuery(search, config=SEARCH_CONFIG, search_type='websearch')
+            # ts_rank is a float4: cast, so the rank in a page cursor compares
+            # equal to the one it was read from
+            listings_filtered = listings_filtered.filter(search_vector=query).annotate(
+                rank=Cast(SearchRank(F('search_vector'), query), output_field=FloatField()))
+            self.ordering = ('-rank', self.id_field)
 
-    def delete(self, request, format=None):
-        donation_id = request.data.get('donation_id', None)
-        if donation_id is not None:
+        near = request.query_params.get('near', None)
+        if near is not None:
             try:
-                donation = Donation.objects.get(donation_id=donation_id)
-            except (Donation.DoesNotExist, ValueError):
+                latitude, longitude = [float(value) for value in near.split(',')]
+                radius = float(request.query_params.get('radius', settings.LISTING_NEAR_RADIUS_KM))
+            except ValueError:
+                latitude = None
+            if latitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180) \
+                    or not 0 < radius <= settings.LISTING_NEAR_MAX_RADIUS_KM:
                 return Response(
-                    {"message": "Invalid org_id parameter value"},
+                    {"message": "Invalid near parameter value"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            serializer = DonationSerializer(donation)
-            # soft_delete will be triggered in save()
-            serializer.save()
-            return Response(status=status.HTTP_200_OK)
-        return Response(
-            {"message": "Invalid request"},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+            nearby = organizations_near(latitude, longitude, radius)
+            listings_filtered = listings_filtered.filter(organization_id__in=[org_id for org_id, _ in nearby])
+            if nearby:
+                listings_filtered = listings_filtered.annotate(distance=Case(
+                    *[When(organization_id=org_id, then=Value(distance)) for org_id, distance in nearby],
+                    output_field=FloatField()))
+                if self.ordering is None:
+                    self.ordering = ('distance', 'creation_time', self.id_field)
 
-class RequestView(APIView):
-    permission_classes = (IsAuthenticated,)
-    def get(self, request, format=None, **kwargs):
-        org_id = request.query_params.get('org_id', None)
-        request_status = request.query_params.get('status', None)
-        all_requests = Request.objects.all()
-        requests_filtered = all_requests
-        if org_id is not None:
+        # answer polling clients with 304 before anything is serialized
+        etag = self.get_validators(request, listings_filtered)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        if streaming:
+            response = self.stream_response(listings_filtered)
+            return self.set_validators(response, etag)
+
+        response = self.list_response(request, listings_filtered)
+        if not status.is_success(response.status_code):
+            return self.set_validators(response, etag)
+        response_cache.store(cache_key, etag, response.data, response.status_code)
+        return self.cached_response(response, cache_key, etag)
+
+    def delete(self, request, format=None):
+        """
+        Soft delete one listing (<id_field>), a list of them (<id_field>s) or
+        every active listing of an org (org_id), with one UPDATE
+        """
+        listing_id = request.data.get(self.id_field, None)
+        listing_ids = request.data.get(self.id_field + 's', None)
+        org_id = request.data.get('org_id', None)
+        if listing_id is not None:
+            try:
+                listings = self.model.objects.filter(pk=int(listing_id))
+            except (ValueError, TypeError):
+                listings = None
+            if listings is None or not listings.exists():
+                return Response(
+                    {"message": "Invalid " + self.id_field + " parameter value"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        elif listing_ids is not None:
+            try:
+                if not isinstance(listing_ids, list):
+                    raise TypeError
+                listings = self.model.objects.filter(pk__in=[int(i) for i in listing_ids])
+            except (ValueError, TypeError):
+                return Response(
+                    {"message": "Invalid " + self.id_field + "s parameter value"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        elif org_id is not None:
             try:
                 org = Organization.objects.get(id=org_id)
-            except (Organization.DoesNotExist, ValueError):
+            except (Organization.DoesNotExist, ValueError, TypeError):
                 return Response(
                     {"message": "Invalid org_id parameter value"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            requests_filtered = all_requests.filter(organization=org)
+            listings = self.model.objects.filter(organization=org)
+        else:
+            return Response(
+                {"message": "Invalid request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        if request_status is not None:
-            # validate if the status is in "active" or "inactive"
-            if request_status not in ["active", "inactive"]:
+        deactivated = soft_delete_listings(listings)
+        return Response({"deactivated": deactivated}, status=status.HTTP_200_OK)
+
+    def stream_response(self, listings_filtered):
+        """
+        Write {"<listing_key>": [...]} row by row. Rows are read through a
+        server-side cursor and serialized one chunk at a time, so memory stays
+        bounded by the chunk size. Each row goes through the same JSONRenderer
+        as the regular response, so the bytes are identical to it
+        """
+        chunk_size = getattr(settings, 'LISTING_STREAM_CHUNK_SIZE', 500)
+        listings_filtered = self.select_rows(listings_filtered)
+        rows = listings_filtered.order_by(*self.get_ordering()).iterator(chunk_size=chunk_size)
+
+        def chunks():
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    return
+                yield self.serialize(chunk)
+
+        all_chunks = chunks()
+        first_chunk = next(all_chunks, None)
+        # if query set emtpy
+        if first_chunk is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        renderer = JSONRenderer()
+
+        def content():
+            yield b'{' + json.dumps(self.listing_key).encode('utf-8') + b':['
+            separator = b''
+            for chunk in chain([first_chunk], all_chunks):
+                for row in chunk:
+                    yield separator + renderer.render(row)
+                    separator = b','
+            yield b']}'
+
+        return StreamingHttpResponse(content(), status=status.HTTP_200_OK, content_type=renderer.media_type)
+
+    def list_response(self, request, listings_filtered):
+        listings_filtered = self.select_rows(listings_filtered)
+        if KeysetPagination.is_requested(request):
+            paginator = KeysetPagination(self.get_ordering())
+            try:
+                page = paginator.paginate_queryset(listings_filtered, request, view=self)
+            except ValidationError as exc:
                 return Response(
-                    {"message": "Invalid status parameter value"},
+                    {"message": str(exc.detail[0])},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            if request_status == "active":
-                requests_filtered = requests_filtered.exclude(deactivation_time__lte=datetime.now(tz=timezone.utc))
-            elif request_status == "inactive":
-                requests_filtered = requests_filtered.filter(deactivation_time__lte=datetime.now(tz=timezone.utc))
+            if not page:
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            return Response(
+                        paginator.get_paginated_data(self.listing_key, self.serialize(page)),
+                        status=status.HTTP_200_OK
+                    )
 
+        listings_filtered = listings_filtered.order_by(*self.get_ordering())
         # if query set emtpy 
-        if not requests_filtered:
+        if not listings_filtered:
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-        serializer = RequestSerializer(requests_filtered, many=True)
         return Response(
-                    {"requests": serializer.data},
+                    {self.listing_key: self.serialize(listings_filtered)},
                     status=status.HTTP_200_OK
                 )
+
+class DonationView(ListingView):
+    model = Donation
+    serializer_class = DonationSerializer
+    fast_serializer_class = FastDonationSerializer
+    # the thumbnail URLs replace the picture URL once they are generated
+    validator_aggregates = {'thumbnails_ready': Count('donation_id', filter=Q(thumbnails_ready=True))}
+    listing_key = "donations"
+    id_field = "donation_id"
+
+    def post(self, request, format=None):
+        serializer = DonationSerializer(data=request.data)
+        if serializer.is_valid():
+            created_donation = serializer.save()
+            return Response({"donation_id": created_donation.donation_id}, status=status.HTTP_201_CREATED)
+        errors = serializer.errors
+        key = list(errors.keys())[0]
+        return Response(
+            {"message": "for key " + key + " "+  str(errors[key])},
+            status=status.HTTP_400_BAD_REQUEST)
+
+class RequestView(ListingView):
+    model = Request
+    serializer_class = RequestSerializer
+    fast_serializer_class = FastRequestSerializer
+    listing_key = "requests"
+    id_field = "request_id"
+
     def post(self, request, format=None):
         serializer = RequestSerializer(data=request.data)
         if serializer.is_valid():
@@ -130,22 +406,202 @@ class RequestView(APIView):
             {"message": "for key " + key + " "+  str(errors[key])},
             status=status.HTTP_400_BAD_REQUEST)
 
-    def delete(self, request, format=None):
-        request_id = request.data.get('request_id', None)
-        if request_id is not None:
+class RequestMatchesView(APIView):
+    """
+    Donations that could fill a request, most shared traits first, then the
+    ones expiring soonest, then the closest. Served from the candidates that
+    listing.matching keeps up to date, at most limit= of them
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, request_id, format=None):
+        if not Request.objects.filter(request_id=request_id).exists():
+            return Response(
+                {"message": "Invalid request_id"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        max_limit = getattr(settings, 'LISTING_MATCHES_PAGE_SIZE', 50)
+        try:
+            limit = min(int(request.query_params.get('limit', max_limit)), max_limit)
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            return Response(
+                {"message": "Invalid limit parameter value"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        now = datetime.now(tz=timezone.utc)
+        candidates = list(
+            MatchCandidate.objects.filter(request_id=request_id, donation__deactivation_time__isnull=True)
+            # expired donations stay candidates until expire_donations deactivates them
+            .filter(Q(donation__expiration_date__isnull=True) | Q(donation__expiration_date__gt=now))
+            .select_related('donation').defer('donation__search_vector')
+            .order_by(*matching.CANDIDATE_ORDERING)[:limit])
+        donations = DonationSerializer([candidate.donation for candidate in candidates], many=True).data
+        return Response({
+            "request_id": request_id,
+            "matches": [{
+                "donation": donation,
+                "trait_overlap": candidate.trait_overlap,
+                "distance_km": candidate.distance_km,
+            } for candidate, donation in zip(candidates, donations)],
+        }, status=status.HTTP_200_OK)
+
+class ListingBulkView(APIView):
+    """
+    Create many listings in one call. All items are validated together and,
+    if they are all valid, inserted with bulk INSERTs in a single transaction.
+    The response lists the created ids, or one error (null when the item was
+    fine) per item
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = None
+    listing_key = None
+    id_field = None
+
+    def get_items(self, request):
+        items = request.data.get(self.listing_key, None)
+        if isinstance(items, str):
+            # multipart/form-data bodies carry the list as a JSON string
             try:
-                request = Request.objects.get(request_id=request_id)
-            except (Request.DoesNotExist, ValueError):
-                return Response(
-                    {"message": "Invalid org_id parameter value"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            serializer = RequestSerializer(request)
-            # soft_delete will be triggered in save()
-            serializer.save()
-            return Response(status=status.HTTP_200_OK)
+                items = json.loads(items)
+            except ValueError:
+                return None
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            return None
+        return items
+
+    def post(self, request, format=None):
+        items = self.get_items(request)
+        max_size = getattr(settings, 'LISTING_BULK_MAX_SIZE', 1000)
+        if not items or len(items) > max_size:
+            return Response(
+                {"message": "Invalid request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = self.serializer_class(data=items, many=True)
+        if serializer.is_valid():
+            created_listings = serializer.save()
+            return Response(
+                {self.listing_key: [{self.id_field: getattr(listing, self.id_field)} for listing in created_listings]},
+                status=status.HTTP_201_CREATED)
         return Response(
-            {"message": "Invalid request"},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+            {
+                "message": "Invalid " + self.listing_key,
+                "errors": [errors or None for errors in serializer.errors],
+            },
+            status=status.HTTP_400_BAD_REQUEST)
+
+class DonationBulkView(ListingBulkView):
+    """
+    multipart/form-data with a "donations" field holding a JSON list. The
+    "picture" of each item names the file part that holds its image
+    """
+    serializer_class = DonationSerializer
+    listing_key = "donations"
+    id_field = "donation_id"
+
+    def get_items(self, request):
+        items = super().get_items(request)
+        if items is None:
+            return None
+        for item in items:
+            picture = item.get('picture', None)
+            if isinstance(picture, str):
+                item['picture'] = request.FILES.get(picture, None)
+        return items
+
+class RequestBulkView(ListingBulkView):
+    serializer_class = RequestSerializer
+    listing_key = "requests"
+    id_field = "request_id"
+
+class ListingCacheStatsView(APIView):
+    """
+    Hit/miss counters of the listing response cache
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, format=None):
+        return Response(response_cache.stats(), status=status.HTTP_200_OK)
+
+class ListingStatsView(APIView):
+    """
+    Active and inactive listings of one organization (org_id) by listing
+    type and trait, read from the counters maintained by listing.stats
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, format=None):
+        org_id = request.query_params.get('org_id', None)
+        try:
+            org = Organization.objects.get(id=org_id) if org_id is not None else None
+        except (Organization.DoesNotExist, ValueError):
+            org = None
+        if org is None:
+            return Response(
+                {"message": "Invalid org_id parameter value"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(stats.organization_stats(org.id), status=status.HTTP_200_OK)
+
+class ListingChangesView(APIView):
+    """
+    Listings created or deactivated after the since= cursor, oldest first,
+    at most limit= of them. Created listings carry their current
+    representation. Without since only the current cursor is returned: read
+    it before fetching the full lists, then poll with it
+    """
+    permission_classes = (IsAuthenticated,)
+    serializers = {
+        ListingType.DONATION: (Donation, DonationSerializer),
+        ListingType.REQUEST: (Request, RequestSerializer),
+    }
+
+    def get(self, request, format=None):
+        since = request.query_params.get('since', None)
+        if since is None:
+            return Response({"changes": [], "cursor": changes.latest_seq(), "has_more": False},
+                status=status.HTTP_200_OK)
+        max_limit = getattr(settings, 'LISTING_CHANGES_PAGE_SIZE', 500)
+        try:
+            since = int(since)
+            limit = int(request.query_params.get('limit', max_limit))
+        except ValueError:
+            since = limit = -1
+        if since < 0 or limit <= 0:
+            return Response(
+                {"message": "Invalid since or limit parameter value"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = min(limit, max_limit)
+
+        rows = list(ListingChange.objects.filter(seq__gt=since).order_by('seq')[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        # one query (plus the traits prefetch) per listing type
+        listings = {}
+        for listing_type, (model, serializer_class) in self.serializers.items():
+            ids = [row.listing_id for row in rows
+                if row.listing_type == listing_type and row.action == ChangeAction.CREATED]
+            if ids:
+                for rep in serializer_class(model.objects.filter(pk__in=ids).defer('search_vector'), many=True).data:
+                    listings[(listing_type, rep[model._meta.pk.name])] = rep
 
+        return Response({
+            "changes": [{
+                "seq": row.seq,
+                "type": ListingType(row.listing_type).label,
+                "id": row.listing_id,
+                "organization_id": row.organization_id,
+                "action": ChangeAction(row.action).label,
+                "time": row.time,
+                "listing": listings.get((row.listing_type, row.listing_id), None)
+                    if row.action == ChangeAction.CREATED else None,
+            } for row in rows],
+            "cursor": rows[-1].seq if rows else since,
+            "has_more": has_more,
+        }, status=status.HTTP_200_OK)